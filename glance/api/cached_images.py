@@ -25,12 +25,20 @@ import json
 import webob.dec
 import webob.exc
 
+from glance.common import config
 from glance.common import exception
 from glance.common import wsgi
 from glance import api
 from glance import image_cache
+from glance.image_cache.drivers import base
 from glance import registry
 
+SUPPORTED_FILTERS = ('size_min', 'size_max')
+
+SUPPORTED_SORT_KEYS = ('id', 'size', 'hits', 'last_accessed')
+
+SUPPORTED_SORT_DIRS = ('asc', 'desc')
+
 
 class Controller(api.BaseController):
     """
@@ -42,18 +50,90 @@ class Controller(api.BaseController):
         self.cache = image_cache.ImageCache(self.options)
 
     def index(self, req):
+        """
+        GET /cached_images - Page of the active cached images
+        GET /cached_images?status=invalid|incomplete|prefetching - Page of
+        the images in that state
+
+        The page is selected with the `limit`, `marker`, `sort_key` and
+        `sort_dir` parameters of the image list API, and may be filtered
+        with `size_min` and `size_max`.
+        """
+        params = self._get_query_params(req)
         status = req.str_params.get('status')
-        if status == 'invalid':
-            entries = list(self.cache.invalid_entries())
-        elif status == 'incomplete':
-            entries = list(self.cache.incomplete_entries())
-        elif status == 'prefetching':
-            entries = list(self.cache.prefetch_entries())
-        else:
-            entries = list(self.cache.entries())
+        try:
+            if status == 'invalid':
+                entries = base.paginate_entries(
+                    list(self.cache.invalid_entries()), **params)
+            elif status == 'incomplete':
+                entries = base.paginate_entries(
+                    list(self.cache.incomplete_entries()), **params)
+            elif status == 'prefetching':
+                entries = base.paginate_entries(
+                    list(self.cache.prefetch_entries()), **params)
+            else:
+                entries = list(self.cache.entries(**params))
+        except exception.NotFound:
+            msg = _("Invalid marker. Image could not be found in the cache.")
+            raise webob.exc.HTTPBadRequest(explanation=msg)
 
         return dict(cached_images=entries)
 
+    def _get_query_params(self, req):
+        """
+        Extract the paging, sorting and filtering parameters of a cached
+        images listing from the request
+        """
+        return {
+            'filters': self._get_filters(req),
+            'limit': self._get_limit(req),
+            'marker': self._get_int_param(req, 'marker'),
+            'sort_key': self._get_choice_param(req, 'sort_key',
+                                               SUPPORTED_SORT_KEYS),
+            'sort_dir': self._get_choice_param(req, 'sort_dir',
+                                               SUPPORTED_SORT_DIRS),
+        }
+
+    def _get_filters(self, req):
+        filters = {}
+        for param in SUPPORTED_FILTERS:
+            value = self._get_int_param(req, param)
+            if value is not None:
+                filters[param] = value
+        return filters
+
+    def _get_limit(self, req):
+        default = config.get_option(self.options, 'limit_param_default',
+                                    type='int', default=25)
+        api_limit_max = config.get_option(self.options, 'api_limit_max',
+                                          type='int', default=1000)
+        limit = self._get_int_param(req, 'limit')
+        if limit is None:
+            limit = default
+        if limit < 0:
+            msg = _("limit param must be positive")
+            raise webob.exc.HTTPBadRequest(explanation=msg)
+        return min(api_limit_max, limit)
+
+    def _get_int_param(self, req, param):
+        value = req.str_params.get(param)
+        if value is None:
+            return None
+        try:
+            return int(value)
+        except ValueError:
+            msg = _("%s param must be an integer") % param
+            raise webob.exc.HTTPBadRequest(explanation=msg)
+
+    def _get_choice_param(self, req, param, choices):
+        value = req.str_params.get(param, choices[0])
+        if value not in choices:
+            msg = _("Unsupported %(param)s. Acceptable values: "
+                    "%(choices)s") % dict(param=param,
+                                         choices=', '.join(choices))
+            raise webob.exc.HTTPBadRequest(explanation=msg)
+        return value
+
     def delete(self, req, id):
         self.cache.purge(id)
 
@@ -75,10 +155,20 @@ class Controller(api.BaseController):
             return dict(num_purged=num_purged)
 
     def update(self, req, id):
-        """PUT /cached_images/1 is used to prefetch an image into the cache"""
+        """
+        PUT /cached_images/1 is used to prefetch an image into the cache
+        PUT /cached_images/1?priority=10 prefetches it ahead of the images
+        queued with a lower priority
+        """
         image_meta = self.get_active_image_meta_or_404(req, id)
         try:
-            self.cache.queue_prefetch(image_meta)
+            priority = int(req.str_params.get('priority', 0))
+        except ValueError:
+            msg = _("priority must be an integer")
+            raise webob.exc.HTTPBadRequest(explanation=msg)
+
+        try:
+            self.cache.queue_prefetch(image_meta, priority=priority)
         except exception.Invalid, e:
             raise webob.exc.HTTPBadRequest(explanation="%s" % e)
 
@@ -34,7 +34,8 @@ class API(wsgi.Router):
         mapper = routes.Mapper()
         resource = images.create_resource(options)
         mapper.resource("image", "images", controller=resource,
-                        collection={'detail': 'GET'})
+                        collection={'detail': 'GET', 'count': 'GET',
+                                    'stats': 'GET'})
         mapper.connect("/", controller=resource, action="index")
         mapper.connect("/images/{id}", controller=resource,
                        action="meta", conditions=dict(method=["HEAD"]))
@@ -30,10 +30,14 @@ from webob.exc import (HTTPNotFound,
                        HTTPConflict,
                        HTTPBadRequest,
                        HTTPForbidden,
+                       HTTPFound,
+                       HTTPRequestRangeNotSatisfiable,
                        HTTPUnauthorized)
 
 from glance import api
 from glance import image_cache
+from glance.image_cache import peers
+from glance.common import config
 from glance.common import exception
 from glance.common import notifier
 from glance.common import wsgi
@@ -54,7 +58,7 @@ from glance import utils
 logger = logging.getLogger('glance.api.v1.images')
 
 SUPPORTED_FILTERS = ['name', 'status', 'container_format', 'disk_format',
-                     'size_min', 'size_max', 'is_public']
+                     'size_min', 'size_max', 'is_public', 'id']
 
 SUPPORTED_PARAMS = ('limit', 'marker', 'sort_key', 'sort_dir')
 
@@ -69,6 +73,9 @@ class Controller(api.BaseController):
         GET /images -- Returns a set of brief metadata about images
         GET /images/detail -- Returns a set of detailed metadata about
                               images
+        GET /images/count -- Returns the number of images
+        GET /images/stats -- Returns the number and total size of images,
+                             overall or grouped by an image attribute
         HEAD /images/<ID> -- Return metadata about an image with id <ID>
         GET /images/<ID> -- Return image data for image with id <ID>
         POST /images -- Store image data and return metadata about the
@@ -81,7 +88,12 @@ class Controller(api.BaseController):
     def __init__(self, options):
         self.options = options
         glance.store.create_stores(options)
+        utils.set_io_threads(config.get_option(
+            options, 'io_thread_pool_size', type='int', default=20))
         self.notifier = notifier.Notifier(options)
+        self.cache = image_cache.ImageCache(options)
+        self.peers = peers.PeerRouter(options)
+        self.peer_fill = peers.PeerFill(options)
 
     def index(self, req):
         """
@@ -145,6 +157,48 @@ class Controller(api.BaseController):
             raise HTTPBadRequest(explanation="%s" % e)
         return dict(images=images)
 
+    def count(self, req):
+        """
+        Returns the number of public, available images matching the
+        filters of `detail`
+
+        :param req: The WSGI/Webob Request object
+        :retval The response body is a mapping of the following form::
+
+            {'count': <COUNT>}
+        """
+        try:
+            count = registry.get_images_count(self.options, req.context,
+                                              filters=self._get_filters(req))
+        except exception.Invalid, e:
+            raise HTTPBadRequest(explanation="%s" % e)
+        return dict(count=count)
+
+    def stats(self, req):
+        """
+        Returns the number and total size in bytes of the public, available
+        images matching the filters of `detail`, per value of the image
+        attribute given by the `group_by` param, if any
+
+        :param req: The WSGI/Webob Request object
+        :retval The response body is a mapping of the following form::
+
+            {'stats': [
+                {'<GROUP_BY>': <VALUE>,
+                 'count': <COUNT>,
+                 'size': <SIZE>}, ...
+            ]}
+        """
+        params = {'filters': self._get_filters(req)}
+        if 'group_by' in req.str_params:
+            params['group_by'] = req.str_params.get('group_by')
+        try:
+            stats = registry.get_images_stats(self.options, req.context,
+                                              **params)
+        except exception.Invalid, e:
+            raise HTTPBadRequest(explanation="%s" % e)
+        return dict(stats=stats)
+
     def _get_query_params(self, req):
         """
         Extracts necessary query params from request.
@@ -196,50 +250,153 @@ class Controller(api.BaseController):
         :param id: The opaque image identifier
 
         :raises HTTPNotFound if image is not available to user
+        :raises HTTPRequestRangeNotSatisfiable if the requested byte range
+                lies outside of the image data
         """
         image = self.get_active_image_meta_or_404(req, id)
+        image_range = self._get_image_range(req, image)
+        offset, length = image_range or (0, None)
+        cache_only = req.headers.get(peers.CACHE_ONLY_HEADER)
 
         def get_from_store(image):
             """Called if caching disabled"""
             try:
-                image = get_from_backend(image['location'])
+                image = get_from_backend(image['location'], offset=offset,
+                                         length=length)
             except exception.NotFound, e:
                 raise HTTPNotFound(explanation="%s" % e)
             return image
 
+        def get_from_memory(data):
+            """Called if memory cache hit"""
+            if length is not None:
+                return [data[offset:offset + length]]
+            return [data]
+
         def get_from_cache(image, cache):
             """Called if cache hit"""
-            with cache.open(image, "rb") as cache_file:
-                chunks = utils.chunkiter(cache_file)
+            data = cache.load_into_memory(image)
+            if data is not None:
+                return get_from_memory(data)
+
+            cache_file = cache.open_for_read(image, offset=offset)
+            return utils.FileWrapper(cache_file, length=length)
+
+        def get_from_cache_being_written(image, cache):
+            """Called if another request is currently caching the image"""
+            bytes_read = 0
+            try:
+                for chunk in cache.follow_incomplete(image):
+                    bytes_read += len(chunk)
+                    yield chunk
+            except exception.ImageCacheFollowFailed, e:
+                logger.warn(_("%(e)s, retrieving the remainder of image "
+                              "'%(id)s' from store"), locals())
+                chunks = get_from_backend(image['location'],
+                                          offset=bytes_read)
+                for chunk in chunks:
+                    yield chunk
+
+        def get_from_peer(image, owner):
+            """Called if another node owns the image"""
+            try:
+                return self.peers.fetch(req, owner)
+            except Exception, e:
+                logger.warn(_("failed to proxy image '%(id)s' from peer "
+                              "'%(owner)s': %(e)s, retrieving image from "
+                              "store"), dict(id=image['id'], owner=owner, e=e))
+                return get_from_store(image)
+
+        def get_from_peers_or_store(image):
+            """Called to fill the cache"""
+            # NOTE: Data from a peer can only be trusted because the cache
+            # checks it against the checksum from the registry as it is
+            # written, and rolls back the write if it doesn't match
+            if not self.peer_fill.enabled or not image.get('checksum'):
+                for chunk in get_from_store(image):
+                    yield chunk
+                return
+
+            peer_chunks = self.peer_fill.fetch(req)
+            if peer_chunks is None:
+                for chunk in get_from_store(image):
+                    yield chunk
+                return
+
+            peer, chunks = peer_chunks
+            bytes_read = 0
+            try:
+                for chunk in chunks:
+                    bytes_read += len(chunk)
+                    yield chunk
+            except Exception, e:
+                logger.warn(_("failed to read image '%(id)s' from peer "
+                              "'%(peer)s': %(e)s, retrieving the remainder "
+                              "from store"),
+                            dict(id=image['id'], peer=peer, e=e))
+                chunks = get_from_backend(image['location'],
+                                          offset=bytes_read)
                 for chunk in chunks:
                     yield chunk
 
         def get_from_store_tee_into_cache(image, cache):
             """Called if cache miss"""
+            if not cache.reserve(image):
+                logger.debug(_("image '%s' can't be cached, not tee'ing"
+                             " into the cache"), image['id'])
+                for chunk in get_from_store(image):
+                    yield chunk
+                return
+
             with cache.open(image, "wb") as cache_file:
-                chunks = get_from_store(image)
+                chunks = get_from_peers_or_store(image)
                 for chunk in chunks:
                     cache_file.write(chunk)
                     yield chunk
 
-        cache = image_cache.ImageCache(self.options)
+        cache = self.cache
         if cache.enabled:
-            if cache.hit(id):
+            cache.record_access(id)
+            owner = self.peers.get_owner(req, id)
+            data = cache.get_from_memory(image)
+            if data is not None:
+                logger.debug(_("image '%s' is a memory cache HIT"), id)
+                cache.record_hit(id)
+                image_iterator = get_from_memory(data)
+            elif cache.hit(id):
                 # hit
                 logger.debug(_("image '%s' is a cache HIT"), id)
                 image_iterator = get_from_cache(image, cache)
+            elif cache_only:
+                logger.debug(_("image '%s' is a cache MISS for a peer"), id)
+                raise HTTPNotFound(_("Image not found in the cache"))
+            elif owner:
+                # owned by a peer
+                if self.peers.mode == 'redirect':
+                    logger.debug(_("image '%(id)s' is owned by peer "
+                                 "'%(owner)s', redirecting"), locals())
+                    location = self.peers.get_redirect_location(req, owner)
+                    raise HTTPFound(location=location)
+                logger.debug(_("image '%(id)s' is owned by peer "
+                             "'%(owner)s', proxying"), locals())
+                image_iterator = get_from_peer(image, owner)
             else:
                 # miss
                 logger.debug(_("image '%s' is a cache MISS"), id)
 
                 # Make sure we're not already prefetching or caching the image
                 # that just generated the miss
-                if cache.is_image_currently_prefetching(id):
-                    logger.debug(_("image '%s' is already being prefetched,"
+                if image_range:
+                    logger.debug(_("partial request for image '%s',"
                                  " not tee'ing into the cache"), id)
                     image_iterator = get_from_store(image)
                 elif cache.is_image_currently_being_written(id):
                     logger.debug(_("image '%s' is already being cached,"
+                                 " following the cache write"), id)
+                    image_iterator = get_from_cache_being_written(image,
+                                                                  cache)
+                elif cache.is_image_currently_prefetching(id):
+                    logger.debug(_("image '%s' is already being prefetched,"
                                  " not tee'ing into the cache"), id)
                     image_iterator = get_from_store(image)
                 else:
@@ -252,6 +409,8 @@ class Controller(api.BaseController):
                     logger.debug(_("tee'ing image '%s' into cache"), id)
                     image_iterator = get_from_store_tee_into_cache(
                         image, cache)
+        elif cache_only:
+            raise HTTPNotFound(_("Image not found in the cache"))
         else:
             # disabled
             logger.debug(_("image cache DISABLED, retrieving image '%s'"
@@ -261,8 +420,48 @@ class Controller(api.BaseController):
         return {
             'image_iterator': image_iterator,
             'image_meta': image,
+            'image_range': image_range,
         }
 
+    def _get_image_range(self, req, image_meta):
+        """
+        Determines the byte range of the image data requested through the
+        `Range` and `If-Range` headers of the request.
+
+        :param req: The WSGI/Webob Request object
+        :param image_meta: Mapping of metadata about image
+
+        :retval None if the entire image should be returned, otherwise a
+                tuple of (offset, length) describing the requested bytes
+        :raises HTTPRequestRangeNotSatisfiable if the requested byte range
+                lies outside of the image data
+        """
+        # NOTE: Returning the entire image is always a valid response to a
+        # Range request, so we do that for multiple byte ranges
+        if req.range is None or len(req.range.ranges) != 1:
+            return None
+
+        # The ETag we hand out is the image checksum, so that is the only
+        # If-Range validator we can match. Anything else means the client
+        # holds a stale partial copy and must get the entire image back.
+        if req.if_range and \
+                not req.if_range.match(etag=image_meta['checksum']):
+            return None
+
+        image_size = image_meta['size']
+        image_range = req.range.range_for_length(image_size)
+        if image_range is None:
+            msg = _("Requested range not satisfiable for image %(id)s of "
+                    "size %(image_size)d") % ({'id': image_meta['id'],
+                    'image_size': image_size})
+            logger.debug(msg)
+            raise HTTPRequestRangeNotSatisfiable(
+                    msg, request=req, content_type='text/plain',
+                    headers={'Content-Range': 'bytes */%d' % image_size})
+
+        start, stop = image_range
+        return (start, stop - start)
+
     def _reserve(self, req, image_meta):
         """
         Adds the image metadata to the registry and assigns
@@ -807,6 +1006,7 @@ class ImageSerializer(wsgi.JSONResponseSerializer):
 
     def meta(self, response, result):
         image_meta = result['image_meta']
+        response.headers['Accept-Ranges'] = 'bytes'
         self._inject_image_meta_headers(response, image_meta)
         self._inject_location_header(response, image_meta)
         self._inject_checksum_header(response, image_meta)
@@ -814,11 +1014,20 @@ class ImageSerializer(wsgi.JSONResponseSerializer):
 
     def show(self, response, result):
         image_meta = result['image_meta']
+        image_range = result.get('image_range')
 
         response.app_iter = result['image_iterator']
         # Using app_iter blanks content-length, so we set it here...
-        response.headers['Content-Length'] = image_meta['size']
+        if image_range:
+            offset, length = image_range
+            response.status = httplib.PARTIAL_CONTENT
+            response.headers['Content-Range'] = 'bytes %d-%d/%d' % (
+                offset, offset + length - 1, image_meta['size'])
+            response.headers['Content-Length'] = length
+        else:
+            response.headers['Content-Length'] = image_meta['size']
         response.headers['Content-Type'] = 'application/octet-stream'
+        response.headers['Accept-Ranges'] = 'bytes'
 
         self._inject_image_meta_headers(response, image_meta)
         self._inject_location_header(response, image_meta)
@@ -38,7 +38,7 @@ class V1Client(base_client.BaseClient):
     DEFAULT_PORT = 9292
 
     def __init__(self, host, port=None, use_ssl=False, doc_root="/v1",
-                 auth_tok=None):
+                 auth_tok=None, redirect_peers=None):
         """
         Creates a new client to a Glance API service.
 
@@ -47,10 +47,14 @@ class V1Client(base_client.BaseClient):
         :param use_ssl: Should we use HTTPS? (defaults to False)
         :param doc_root: Prefix for all URLs we request from host
         :param auth_tok: The auth token to pass to the server
+        :param redirect_peers: `<host>:<port>` of the API nodes sharing an
+                               image cache with the server, which it may
+                               redirect image requests to
         """
         port = port or self.DEFAULT_PORT
         self.doc_root = doc_root
-        super(Client, self).__init__(host, port, use_ssl, auth_tok)
+        super(Client, self).__init__(host, port, use_ssl, auth_tok,
+                                     redirect_peers)
 
     def do_request(self, method, action, body=None, headers=None, params=None):
         action = "%s/%s" % (self.doc_root, action.lstrip("/"))
@@ -89,6 +93,46 @@ class V1Client(base_client.BaseClient):
         data = json.loads(res.read())['images']
         return data
 
+    def get_images_meta(self, image_ids):
+        """
+        Returns a list of detailed image data mappings for the images with
+        the given ids, all fetched in a single request. Images that don't
+        exist or aren't visible are left out.
+
+        :param image_ids: ids of the images to get
+        """
+        if not image_ids:
+            return []
+        filters = {'id': ','.join(str(image_id) for image_id in image_ids)}
+        return self.get_images_detailed(filters=filters)
+
+    def get_images_count(self, **kwargs):
+        """
+        Returns the number of images matching the filters
+
+        :param filters: dictionary of attributes by which the images
+                        should be filtered
+        """
+        params = self._extract_params(kwargs, ())
+        res = self.do_request("GET", "/images/count", params=params)
+        data = json.loads(res.read())['count']
+        return data
+
+    def get_images_stats(self, **kwargs):
+        """
+        Returns a list of mappings of the number and total size in bytes of
+        the images matching the filters
+
+        :param filters: dictionary of attributes by which the images
+                        should be filtered
+        :param group_by: image attribute the images are counted per value
+                         of, if any
+        """
+        params = self._extract_params(kwargs, ('group_by',))
+        res = self.do_request("GET", "/images/stats", params=params)
+        data = json.loads(res.read())['stats']
+        return data
+
     def get_image(self, image_id):
         """
         Returns a tuple with the image's metadata and the raw disk image as
@@ -272,13 +316,19 @@ class V1Client(base_client.BaseClient):
         num_reaped = data['num_reaped']
         return num_reaped
 
-    def prefetch_cache_image(self, image_id):
+    def prefetch_cache_image(self, image_id, priority=None):
         """
         Pre-fetch a specified image from the cache
+
+        :param priority: Images queued with a higher priority are prefetched
+                         first
         """
         res = self.do_request("HEAD", "/images/%s" % image_id)
         image = utils.get_image_meta_from_headers(res)
-        self.do_request("PUT", "/cached_images/%s" % image_id)
+        params = {}
+        if priority is not None:
+            params['priority'] = priority
+        self.do_request("PUT", "/cached_images/%s" % image_id, params=params)
         return True
 
     def get_prefetching_cache_images(self, **kwargs):
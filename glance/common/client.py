@@ -1,7 +1,11 @@
 import httplib
 import logging
+import os
 import socket
+import threading
+import time
 import urllib
+import urlparse
 
 # See http://code.google.com/p/python-nose/issues/detail?id=373
 # The code below enables glance.client standalone to work with i18n _() blocks
@@ -41,13 +45,128 @@ class ImageBodyIterator(object):
                 break
 
 
+class PooledResponse(httplib.HTTPResponse):
+
+    """
+    A response that hands its connection back to the pool it came from
+    once it has been read to the end. A response closed before then closes
+    its connection instead, as the unread rest of the body would otherwise
+    be taken for the start of the next response on the connection.
+    """
+
+    release = None
+    _reading = False
+
+    def read(self, amt=None):
+        # NOTE: httplib closes the response from within read() once it hits
+        # the end of the body, so whether the connection can be reused is
+        # only known once read() returns
+        self._reading = True
+        read_ok = False
+        try:
+            data = httplib.HTTPResponse.read(self, amt)
+            read_ok = True
+            return data
+        finally:
+            self._reading = False
+            if self.isclosed():
+                self._release(read_ok and
+                              (self.chunked or self.length == 0))
+
+    def close(self):
+        httplib.HTTPResponse.close(self)
+        if not self._reading:
+            self._release(not self.chunked and self.length == 0)
+
+    def _release(self, reusable):
+        if self.release:
+            release, self.release = self.release, None
+            release(reusable)
+
+
+class ConnectionPool(object):
+
+    """
+    A pool of idle keep-alive connections, kept per connection type, host
+    and port, so that consecutive requests to a server don't pay for a new
+    TCP (and SSL) connection each.
+
+    Connections are only pooled while idle: a connection is taken out of
+    the pool for a request and put back once its response was read. At
+    most `max_size` idle connections are kept per server, and connections
+    idle for longer than `max_idle` seconds are closed.
+    """
+
+    def __init__(self, max_size=10, max_idle=60):
+        self.max_size = max_size
+        self.max_idle = max_idle
+        self.connections = {}  # key -> [(connection, idle_since), ...]
+        self.lock = threading.Lock()
+        self.pid = os.getpid()
+
+    def get(self, connection_type, host, port):
+        """
+        Returns a tuple of (connection, reused), with an idle connection
+        to the server from the pool if there is one, or a new one
+        """
+        key = (connection_type, host, port)
+        with self.lock:
+            if self.pid != os.getpid():
+                # NOTE: A forked worker process must not share the
+                # connections of its parent, so drop them without closing
+                self.connections = {}
+                self.pid = os.getpid()
+
+            idle = self.connections.get(key, [])
+            expired = time.time() - self.max_idle
+            while idle and idle[0][1] < expired:
+                idle.pop(0)[0].close()
+            if idle:
+                return idle.pop()[0], True
+
+        c = connection_type(host, port)
+        c.response_class = PooledResponse
+        return c, False
+
+    def put(self, connection_type, host, port, c):
+        """Puts a connection whose response was read back into the pool"""
+        key = (connection_type, host, port)
+        with self.lock:
+            idle = self.connections.setdefault(key, [])
+            if len(idle) < self.max_size:
+                idle.append((c, time.time()))
+                return
+        c.close()
+
+    def clear(self):
+        """Closes all idle connections"""
+        with self.lock:
+            for idle in self.connections.values():
+                for c, idle_since in idle:
+                    c.close()
+            self.connections = {}
+
+
+# Pool of connections shared by all clients in the process
+_pool = ConnectionPool()
+
+
 class BaseClient(object):
 
     """A base client class"""
 
     CHUNKSIZE = 65536
 
-    def __init__(self, host, port, use_ssl, auth_tok):
+    REDIRECT_STATUSES = (httplib.MOVED_PERMANENTLY,
+                         httplib.FOUND,
+                         httplib.SEE_OTHER,
+                         httplib.TEMPORARY_REDIRECT)
+
+    MAX_REDIRECTS = 3
+
+    pool = _pool
+
+    def __init__(self, host, port, use_ssl, auth_tok, redirect_peers=None):
         """
         Creates a new client to some service.
 
@@ -55,11 +174,15 @@ class BaseClient(object):
         :param port: The port where service resides
         :param use_ssl: Should we use HTTPS?
         :param auth_tok: The auth token to pass to the server
+        :param redirect_peers: `<host>:<port>` of the other servers, such as
+                               the image cache peers of an API server, that
+                               redirects are followed to
         """
         self.host = host
         self.port = port
         self.use_ssl = use_ssl
         self.auth_tok = auth_tok
+        self.redirect_peers = redirect_peers or []
         self.connection = None
 
     def set_auth_token(self, auth_tok):
@@ -77,6 +200,43 @@ class BaseClient(object):
         else:
             return httplib.HTTPConnection
 
+    def get_redirect(self, res, connection_type, host, port, action):
+        """
+        Returns a tuple of (connection_type, host, port, action) of the
+        location a redirect response points to, or None if the redirect
+        may not be followed.
+
+        Only redirects to the server of this client or to one of its
+        `redirect_peers` are followed, and never from HTTPS to HTTP.
+        """
+        if connection_type is httplib.HTTPSConnection:
+            scheme = 'https'
+        else:
+            scheme = 'http'
+        url = '%s://%s:%s%s' % (scheme, host, port, action)
+        location = urlparse.urlparse(urlparse.urljoin(
+            url, res.getheader('location', '')))
+
+        if location.scheme == 'https':
+            connection_type = httplib.HTTPSConnection
+        elif location.scheme == 'http' and scheme == 'http':
+            connection_type = httplib.HTTPConnection
+        else:
+            return None
+
+        host = location.hostname
+        port = location.port or httplib.HTTP_PORT
+        if location.port is None and location.scheme == 'https':
+            port = httplib.HTTPS_PORT
+        if ((host, str(port)) != (self.host, str(self.port)) and
+            '%s:%s' % (host, port) not in self.redirect_peers):
+            return None
+
+        action = location.path or '/'
+        if location.query:
+            action += '?' + location.query
+        return connection_type, host, port, action
+
     def do_request(self, method, action, body=None, headers=None,
                    params=None):
         """
@@ -112,37 +272,40 @@ class BaseClient(object):
 
         try:
             connection_type = self.get_connection_type()
-            headers = headers or {}
+            headers = dict(headers or {})
             if 'x-auth-token' not in headers and self.auth_tok:
                 headers['x-auth-token'] = self.auth_tok
-            c = connection_type(self.host, self.port)
-
-            # Do a simple request or a chunked request, depending
-            # on whether the body param is a file-like object and
-            # the method is PUT or POST
-            if hasattr(body, 'read') and method.lower() in ('post', 'put'):
-                # Chunk it, baby...
-                c.putrequest(method, action)
-
-                for header, value in headers.items():
-                    c.putheader(header, value)
-                c.putheader('Transfer-Encoding', 'chunked')
-                c.endheaders()
+            host, port = self.host, self.port
+            redirects = 0
+            while True:
+                res = self._pooled_request(connection_type, host, port,
+                                           method, action, body, headers)
+                status_code = self.get_status_code(res)
+                # NOTE: Only requests without a body are re-sent, the body
+                # of a chunked request can't be read twice
+                if (status_code not in self.REDIRECT_STATUSES or
+                    method not in ('GET', 'HEAD') or
+                    redirects >= self.MAX_REDIRECTS):
+                    break
+                redirect = self.get_redirect(res, connection_type, host,
+                                             port, action)
+                if redirect is None:
+                    break
+                res.read()
+                connection_type, host, port, action = redirect
+                # NOTE: The auth token is only handed to the peers the
+                # client was told about, not to whichever host the server
+                # redirects to
+                if (host != self.host and
+                    '%s:%s' % (host, port) not in self.redirect_peers):
+                    headers.pop('x-auth-token', None)
+                redirects += 1
 
-                chunk = body.read(self.CHUNKSIZE)
-                while chunk:
-                    c.send('%x\r\n%s\r\n' % (len(chunk), chunk))
-                    chunk = body.read(self.CHUNKSIZE)
-                c.send('0\r\n\r\n')
-            else:
-                # Simple request...
-                c.request(method, action, body, headers)
-            res = c.getresponse()
-            status_code = self.get_status_code(res)
             if status_code in (httplib.OK,
                                httplib.CREATED,
                                httplib.ACCEPTED,
-                               httplib.NO_CONTENT):
+                               httplib.NO_CONTENT,
+                               httplib.PARTIAL_CONTENT):
                 return res
             elif status_code == httplib.UNAUTHORIZED:
                 raise exception.NotAuthorized(res.read())
@@ -159,10 +322,85 @@ class BaseClient(object):
             else:
                 raise Exception("Unknown error occurred! %s" % res.read())
 
-        except (socket.error, IOError), e:
+        except (socket.error, IOError, httplib.HTTPException), e:
             raise exception.ClientConnectionError("Unable to connect to "
                                                   "server. Got error: %s" % e)
 
+    def _pooled_request(self, connection_type, host, port, method, action,
+                        body, headers):
+        """
+        Sends a request over a pooled connection to the server and returns
+        the response. The connection goes back to the pool once the
+        response was read, unless the server closes it or the request is
+        a HEAD request.
+
+        A request failing on a reused connection, which the server may
+        have closed while it was idle, is retried once on a new
+        connection, unless its body is a file that can't be re-sent. As a
+        failure to read the response doesn't tell whether the server acted
+        on the request, only GET and HEAD requests are retried then.
+        """
+        c, reused = self.pool.get(connection_type, host, port)
+        sent = False
+        try:
+            self._send_request(c, method, action, body, headers)
+            sent = True
+            res = c.getresponse()
+        except (socket.error, httplib.HTTPException):
+            c.close()
+            if (not reused or hasattr(body, 'read') or
+                (sent and method not in ('GET', 'HEAD'))):
+                raise
+            c, reused = self.pool.get(connection_type, host, port)
+            while reused:
+                c.close()
+                c, reused = self.pool.get(connection_type, host, port)
+            self._send_request(c, method, action, body, headers)
+            res = c.getresponse()
+
+        if not isinstance(res, PooledResponse) or res.will_close:
+            return res
+        if method == 'HEAD':
+            # NOTE: Some servers send a body in reply to HEAD regardless,
+            # which would be taken for the next response on the connection
+            c.close()
+            return res
+
+        def release(reusable):
+            if reusable:
+                self.pool.put(connection_type, host, port, c)
+            else:
+                c.close()
+
+        res.release = release
+        if res.length == 0:
+            # NOTE: There is no body to read
+            res.close()
+        return res
+
+    def _send_request(self, c, method, action, body, headers):
+        """Sends a request over the connection `c`"""
+        # Do a simple request or a chunked request, depending
+        # on whether the body param is a file-like object and
+        # the method is PUT or POST
+        if hasattr(body, 'read') and method.lower() in ('post', 'put'):
+            # Chunk it, baby...
+            c.putrequest(method, action)
+
+            for header, value in headers.items():
+                c.putheader(header, value)
+            c.putheader('Transfer-Encoding', 'chunked')
+            c.endheaders()
+
+            chunk = body.read(self.CHUNKSIZE)
+            while chunk:
+                c.send('%x\r\n%s\r\n' % (len(chunk), chunk))
+                chunk = body.read(self.CHUNKSIZE)
+            c.send('0\r\n\r\n')
+        else:
+            # Simple request...
+            c.request(method, action, body, headers)
+
     def get_status_code(self, response):
         """
         Returns the integer status code from the response, which
@@ -163,3 +163,22 @@ class StoreAddDisabled(GlanceException):
 
 class InvalidNotifierStrategy(GlanceException):
     message = "'%(strategy)s' is not an available notifier strategy."
+
+
+class BadDriverConfiguration(GlanceException):
+    message = _("Driver %(driver_name)s could not be configured correctly. "
+               "Reason: %(reason)s")
+
+
+class InvalidImageCacheDriver(GlanceException):
+    message = _("'%(driver)s' is not an available image cache driver.")
+
+
+class InvalidImageCachePolicy(GlanceException):
+    message = _("'%(policy)s' is not an available image cache admission "
+                "policy.")
+
+
+class ImageCacheFollowFailed(GlanceException):
+    message = _("Unable to follow the cache write of image %(image_id)s. "
+                "Reason: %(reason)s")
@@ -21,6 +21,8 @@ import socket
 import uuid
 
 import kombu.connection
+import kombu.entity
+import kombu.messaging
 
 from glance.common import config
 from glance.common import exception
@@ -95,6 +97,36 @@ class RabbitStrategy(object):
         queue.put(message, serializer="json")
         queue.close()
 
+    def consume(self, priority, callback):
+        """
+        Calls `callback` with each message sent with the given priority,
+        by this or any other process, until the connection to the broker
+        is lost.
+
+        Every consumer gets its own copy of the messages, through a queue
+        bound to the exchange the messages are sent to.
+        """
+        topic = "%s.%s" % (self.topic, priority)
+        exchange = kombu.entity.Exchange(topic, type="direct")
+        queue = kombu.entity.Queue("%s.%s" % (topic, uuid.uuid4()),
+                                   exchange, topic, exclusive=True,
+                                   auto_delete=True)
+
+        def _on_message(body, message):
+            try:
+                callback(body)
+            finally:
+                message.ack()
+
+        consumer = kombu.messaging.Consumer(self.connection.channel(),
+                                            queue, callbacks=[_on_message])
+        consumer.consume()
+        try:
+            while True:
+                self.connection.drain_events()
+        finally:
+            consumer.cancel()
+
     def warn(self, msg):
         self._send_message(msg, "WARN")
 
@@ -21,12 +21,16 @@
 Utility methods for working with WSGI servers
 """
 
+import errno
 import json
 import logging
+import os
+import signal
 import sys
 import datetime
 
 import eventlet
+import eventlet.hubs
 import eventlet.wsgi
 eventlet.patcher.monkey_patch(all=False, socket=True)
 import routes
@@ -35,6 +39,12 @@ import webob.dec
 import webob.exc
 
 from glance.common import exception
+from glance import utils
+
+try:
+    from sendfile import sendfile
+except ImportError:
+    sendfile = None
 
 
 class WritableLogger(object):
@@ -55,30 +65,238 @@ def run_server(application, port):
 
 
 class Server(object):
-    """Server class to manage multiple WSGI sockets and applications."""
+    """
+    Server class to manage multiple WSGI sockets and applications.
+
+    With `workers` set, the server pre-forks that many worker processes
+    sharing the listening socket, and the parent process only supervises
+    them: it respawns the workers that die and passes SIGTERM and SIGHUP
+    on to them.
+    """
 
     def __init__(self, threads=1000):
+        self.threads = threads
         self.pool = eventlet.GreenPool(threads)
+        self.workers = 0
+        self.children = set()
+        self.running = True
 
-    def start(self, application, port, host='0.0.0.0', backlog=128):
+    def start(self, application, port, host='0.0.0.0', backlog=128,
+              workers=0):
         """Run a WSGI server with the given application."""
+        if sendfile is None:
+            logger = logging.getLogger('glance.common.wsgi')
+            logger.warn(_("Could not import sendfile from pysendfile, image "
+                          "data is copied through Python rather than sent "
+                          "with sendfile(2)"))
+
         socket = eventlet.listen((host, port), backlog=backlog)
-        self.pool.spawn_n(self._run, application, socket)
+        if not workers:
+            self.pool.spawn_n(self._run, application, socket)
+            return
+
+        self.application = application
+        self.socket = socket
+        self.workers = workers
+        signal.signal(signal.SIGTERM, self._handle_signal)
+        signal.signal(signal.SIGHUP, self._handle_signal)
+        while len(self.children) < self.workers:
+            self._spawn_worker()
 
     def wait(self):
         """Wait until all servers have completed running."""
+        if not self.workers:
+            try:
+                self.pool.waitall()
+            except KeyboardInterrupt:
+                pass
+            return
+
+        while self.children:
+            try:
+                pid, status = os.wait()
+            except KeyboardInterrupt:
+                self._handle_signal(signal.SIGTERM, None)
+                continue
+            except OSError, e:
+                if e.errno == errno.EINTR:
+                    continue
+                if e.errno == errno.ECHILD:
+                    break
+                raise
+
+            if pid not in self.children:
+                continue
+            self.children.remove(pid)
+            if self.running:
+                logger = logging.getLogger('glance.common.wsgi')
+                logger.error(_("Worker %(pid)d exited with status "
+                               "%(status)d, respawning"), locals())
+                self._spawn_worker()
+
+    def _spawn_worker(self):
+        """Fork a worker process serving the shared socket."""
+        pid = os.fork()
+        if pid:
+            self.children.add(pid)
+            return pid
+
+        # NOTE: The worker is stopped by the signals the parent passes on
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGHUP, signal.SIG_DFL)
+        eventlet.hubs.use_hub()
+        self.pool = eventlet.GreenPool(self.threads)
+        status = 0
         try:
-            self.pool.waitall()
+            self._run(self.application, self.socket)
         except KeyboardInterrupt:
             pass
+        except Exception:
+            logger = logging.getLogger('glance.common.wsgi')
+            logger.exception(_("Worker %d failed"), os.getpid())
+            status = 1
+        os._exit(status)
+
+    def _handle_signal(self, signum, frame):
+        """Stop respawning workers and pass the signal on to them."""
+        self.running = False
+        for pid in list(self.children):
+            try:
+                os.kill(pid, signum)
+            except OSError, e:
+                if e.errno != errno.ESRCH:
+                    raise
 
     def _run(self, application, socket):
         """Start a WSGI server in a new green thread."""
         logger = logging.getLogger('eventlet.wsgi.server')
-        eventlet.wsgi.server(socket, application, custom_pool=self.pool,
+        eventlet.wsgi.server(socket, SendfileApplication(application),
+                             custom_pool=self.pool,
                              log=WritableLogger(logger))
 
 
+class SendfileApplication(object):
+    """
+    Wraps a WSGI application so that response bodies backed by a real
+    file are written to the client socket with sendfile(2), rather than
+    being copied through Python strings chunk by chunk.
+
+    A response body qualifies when it provides `fileno()` and `tell()`
+    along with a `length` attribute holding the number of bytes to send,
+    or None to send the remainder of the file. See
+    `glance.utils.FileWrapper`.
+
+    The server still writes the status line and headers, keeps the
+    connection alive and logs the request as usual, although the body
+    length it logs doesn't count the bytes sent with sendfile(2).
+    """
+
+    def __init__(self, application):
+        self.application = application
+
+    def __call__(self, environ, start_response):
+        state = {'forwarding': False, 'pending': None, 'write': None}
+
+        def forward_start_response():
+            state['forwarding'] = True
+            if state['pending']:
+                state['write'] = start_response(*state['pending'])
+                state['pending'] = None
+            return state['write']
+
+        def write(data):
+            return forward_start_response()(data)
+
+        def capture_start_response(status, headers, exc_info=None):
+            if state['forwarding']:
+                return start_response(status, headers, exc_info)
+            state['pending'] = (status, headers, exc_info)
+            return write
+
+        result = self.application(environ, capture_start_response)
+
+        sendfile_args = None
+        if state['pending'] and not state['pending'][2]:
+            sendfile_args = self._get_sendfile_args(environ, result)
+
+        if sendfile_args is None:
+            forward_start_response()
+            return result
+
+        status, headers, _exc_info = state['pending']
+        fd, offset, count = sendfile_args
+        headers = [(key, value) for key, value in headers
+                   if key.lower() != 'content-length']
+        headers.append(('Content-Length', str(count)))
+        try:
+            # NOTE: Writing an empty string has the server send the status
+            # line and headers, deciding on keep-alive and logging the
+            # request as it does for any other response. Only the body is
+            # left for us to send.
+            start_response(status, headers)('')
+            self._sendfile(environ, fd, offset, count)
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+        return []
+
+    @staticmethod
+    def _get_sendfile_args(environ, result):
+        """
+        Returns a tuple of (fd, offset, count) describing the bytes to send
+        for the response body `result`, or None if the body cannot be sent
+        with sendfile(2).
+        """
+        if sendfile is None:
+            return None
+
+        # NOTE: Bodies bound for SSL sockets have to be encrypted by us,
+        # and responses to HEAD requests have no body at all
+        if environ.get('wsgi.url_scheme') != 'http' or \
+                environ.get('REQUEST_METHOD') == 'HEAD' or \
+                'eventlet.input' not in environ:
+            return None
+
+        try:
+            fd = result.fileno()
+            offset = result.tell()
+            count = result.length
+            if count is None:
+                count = os.fstat(fd).st_size - offset
+        except (AttributeError, IOError, OSError, ValueError):
+            return None
+        return (fd, offset, count)
+
+    @staticmethod
+    def _sendfile(environ, fd, offset, count):
+        """
+        Writes `count` bytes of `fd`, starting at `offset`, to the client
+        socket.
+
+        :raises IOError if the file ends before `count` bytes were sent, so
+                that the server closes the connection rather than leave the
+                client waiting for the rest of the body
+        """
+        sock = environ['eventlet.input'].get_socket()
+
+        while count > 0:
+            try:
+                # NOTE: The socket is non-blocking, so only reading the
+                # file can block the I/O thread
+                sent = utils.execute_io(sendfile, sock.fileno(), fd, offset,
+                                        count)
+            except OSError, e:
+                if e.errno != errno.EAGAIN:
+                    raise
+                eventlet.hubs.trampoline(sock.fileno(), write=True)
+                continue
+            if not sent:
+                raise IOError(_("file ended %d bytes short of the response "
+                                "body") % count)
+            offset += sent
+            count -= sent
+
+
 class Middleware(object):
     """
     Base WSGI middleware wrapper. These classes require an application to be
@@ -19,19 +19,54 @@
 LRU Cache for Image Data
 """
 from contextlib import contextmanager
-import datetime
+import errno
+import hashlib
 import itertools
 import logging
 import os
+import re
+import stat
 import sys
 import time
 
+import eventlet
+
 from glance.common import config
 from glance.common import exception
+from glance.image_cache.drivers import base
+from glance.image_cache.drivers import sqlite
+from glance.image_cache.drivers import xattr
+from glance.image_cache import memory
+from glance.image_cache import policies
 from glance import utils
 
 logger = logging.getLogger('glance.image_cache')
 
+# Names of the directories the cached images are sharded into
+SHARD_RE = re.compile('^[0-9a-f]{2}$')
+
+
+class ChecksummingWriter(object):
+    """Writes to a file while computing the MD5 checksum and the size of
+    the data written
+    """
+
+    def __init__(self, fp):
+        self.fp = fp
+        self.checksum = hashlib.md5()
+        self.size = 0
+
+    def write(self, data):
+        utils.execute_io(self._write, data)
+
+    def _write(self, data):
+        self.fp.write(data)
+        self.checksum.update(data)
+        self.size += len(data)
+
+    def __getattr__(self, name):
+        return getattr(self.fp, name)
+
 
 class ImageCache(object):
     """Provides an LRU cache for image data.
@@ -44,18 +79,52 @@ class ImageCache(object):
     Assumptions
     ===========
 
-        1. Cache data directory exists on a filesytem that updates atime on
-           reads ('noatime' should NOT be set)
+        1. Space for an image is reserved with `reserve` before the image is
+           written into the cache. Reserving evicts the least recently
+           accessed images as needed, so the cache never grows beyond
+           `image_cache_max_size_bytes`.
+
+        2. `glance-prune` may still be scheduled to run as a periodic job via
+           cron, to free more than the bare minimum of space at once and so
+           make evictions on the read path less frequent.
+
+    Cache Drivers
+    =============
+
+    The bookkeeping for the cached images (names, sizes, hit counts and
+    access times) is kept by a driver, chosen with the `image_cache_driver`
+    option:
+
+        sqlite (default): keeps the bookkeeping in an SQLite database in the
+            cache directory.
+
+        xattr: keeps the bookkeeping in xattrs on the cache files and relies
+            on the filesystem updating atime on reads ('noatime' should NOT
+            be set).
+
+    Admission Policies
+    ==================
 
-        2. Cache data directory exists on a filesystem that supports xattrs.
-           This is optional, but highly recommended since it allows us to
-           present ops with useful information pertaining to the cache, like
-           human readable filenames and statistics.
+    When an image only fits into the cache by evicting other images, the
+    admission policy chosen with the `image_cache_admission_policy` option
+    decides whether it is cached:
 
-        3. `glance-prune` is scheduled to run as a periodic job via cron. This
-            is needed to run the LRU prune strategy to keep the cache size
-            within the limits set by the config file.
+        lru (default): always caches the image.
 
+        tinylfu: only caches the image if it was requested more often than
+            each image evicted for it.
+
+        size-aware-gdsf: only caches the image if it was requested more
+            often per byte than each image evicted for it.
+
+
+    Memory Tier
+    ===========
+
+    Small images, like kernels and ramdisks, can also be held in memory so
+    that requests for them are served without touching the disk. The tier
+    is disabled unless `image_cache_memory_max_size_bytes` is set, and only
+    holds images of up to `image_cache_memory_max_image_size_bytes`.
 
     Cache Directory Notes
     =====================
@@ -64,19 +133,51 @@ class ImageCache(object):
     active cache entries and subdirectories for handling partial downloads
     and errored-out cache images.
 
+    So that no directory grows too large to list quickly, the active cache
+    entries are sharded into two levels of subdirectories named after the
+    first two pairs of hex digits of the MD5 of the image id. Entries left at
+    the top of the directory by older releases are moved into their shards
+    when the cache is opened.
+
     The layout looks like:
 
         image-cache/
-            entry1
-            entry2
+            cache.db
+            c4/
+                ca/
+                    1
+            c8/
+                1f/
+                    2
             ...
             incomplete/
             invalid/
             prefetch/
             prefetching/
+            reserved/
+
+    `cache.db` belongs to the sqlite driver and `reserved/` to the xattr
+    driver.
     """
+
+    DRIVERS = {
+        'sqlite': sqlite.Driver,
+        'xattr': xattr.Driver,
+    }
+
+    POLICIES = {
+        'lru': policies.LRUPolicy,
+        'tinylfu': policies.TinyLFUPolicy,
+        'size-aware-gdsf': policies.SizeAwareGDSFPolicy,
+    }
+
     def __init__(self, options):
         self.options = options
+        self._driver = None
+        self._policy = None
+        self._memory = None
+        self._pending_hits = {}
+        self._flush_timer = None
         self._make_cache_directory_if_needed()
 
     def _make_cache_directory_if_needed(self):
@@ -96,11 +197,96 @@ class ImageCache(object):
                           "creating '%s'"), path)
             os.makedirs(path)
 
+        self._migrate_flat_entries()
+
+    def _migrate_flat_entries(self):
+        """Moves cache entries written before the cache directory was
+        sharded into their shards
+        """
+        migrated = 0
+        for path, file_info in self._regular_files(self.path):
+            try:
+                image_id = int(os.path.basename(path))
+            except ValueError:
+                continue
+            self._make_shard_directory(image_id)
+            os.rename(path, self.path_for_image(image_id))
+            migrated += 1
+
+        if migrated:
+            logger.info(_("moved %d image cache entries into the sharded "
+                          "directory layout"), migrated)
+
+    def _make_shard_directory(self, image_id):
+        """Creates the directory the entry of an image goes into"""
+        shard_path = os.path.dirname(self.path_for_image(image_id))
+        try:
+            os.makedirs(shard_path)
+        except OSError, e:
+            if e.errno != errno.EEXIST:
+                raise
+
     @property
     def enabled(self):
         return config.get_option(
             self.options, 'image_cache_enabled', type='bool', default=False)
 
+    @property
+    def driver(self):
+        """The driver keeping the bookkeeping for the cached images"""
+        if self._driver is None:
+            driver_name = config.get_option(self.options,
+                                            'image_cache_driver',
+                                            default='sqlite')
+            try:
+                driver_class = self.DRIVERS[driver_name]
+            except KeyError:
+                raise exception.InvalidImageCacheDriver(driver=driver_name)
+            # NOTE: The pruner and the other cache tools don't create the
+            # cache directories, but their drivers only see sharded entries
+            if os.path.isdir(self.path):
+                self._migrate_flat_entries()
+            driver = driver_class(self)
+            driver.configure()
+            self._driver = driver
+        return self._driver
+
+    @property
+    def policy(self):
+        """The policy deciding which images are admitted into the cache"""
+        if self._policy is None:
+            policy_name = config.get_option(self.options,
+                                            'image_cache_admission_policy',
+                                            default='lru')
+            try:
+                policy_class = self.POLICIES[policy_name]
+            except KeyError:
+                raise exception.InvalidImageCachePolicy(policy=policy_name)
+            self._policy = policy_class(self.options)
+        return self._policy
+
+    @property
+    def memory(self):
+        """The in-memory tier holding the data of small images"""
+        if self._memory is None:
+            max_size = config.get_option(
+                self.options, 'image_cache_memory_max_size_bytes',
+                type='int', default=0)
+            max_image_size = config.get_option(
+                self.options, 'image_cache_memory_max_image_size_bytes',
+                type='int', default=32 * 1024 * 1024)
+            self._memory = memory.get_memory_cache(self.path, max_size,
+                                                   max_image_size)
+        return self._memory
+
+    @property
+    def max_size(self):
+        """The maximum number of bytes of image data the cache may hold"""
+        default = 1 * 1024 * 1024 * 1024  # 1 GB
+        return config.get_option(
+            self.options, 'image_cache_max_size_bytes',
+            type='int', default=default)
+
     @property
     def path(self):
         """This is the base path for the image cache"""
@@ -144,7 +330,8 @@ class ImageCache(object):
 
     def path_for_image(self, image_id):
         """This crafts an absolute path to a specific entry"""
-        return os.path.join(self.path, str(image_id))
+        digest = hashlib.md5(str(image_id)).hexdigest()
+        return os.path.join(self.path, digest[:2], digest[2:4], str(image_id))
 
     def incomplete_path_for_image(self, image_id):
         """This crafts an absolute path to a specific entry in the incomplete
@@ -159,23 +346,27 @@ class ImageCache(object):
         return os.path.join(self.invalid_path, str(image_id))
 
     @contextmanager
-    def open(self, image_meta, mode="rb"):
+    def open(self, image_meta, mode="rb", offset=0):
         """Open a cache image for reading or writing.
 
         We have two possible scenarios:
 
             1. READ: we should attempt to read the file from the cache's
-               main directory
+               main directory, starting at byte `offset`
 
             2. WRITE: we should write to a file under the cache's incomplete
                directory, and when it's finished, move it out the main cache
-               directory.
+               directory. Space for the image must have been reserved with
+               `reserve` beforehand, the reservation is released once the
+               write is over. If the data written doesn't match the image's
+               size or checksum, the file is moved to the invalid directory
+               instead.
         """
         if mode == 'wb':
             with self._open_write(image_meta, mode) as cache_file:
                 yield cache_file
         elif mode == 'rb':
-            with self._open_read(image_meta, mode) as cache_file:
+            with self._open_read(image_meta, mode, offset) as cache_file:
                 yield cache_file
         else:
             # NOTE(sirp): `rw` and `a' modes are not supported since image
@@ -191,15 +382,14 @@ class ImageCache(object):
             utils.set_xattr(incomplete_path, key, value)
 
         def commit():
-            set_xattr('image_name', image_meta['name'])
-            set_xattr('hits', 0)
-
             final_path = self.path_for_image(image_id)
             logger.debug(_("fetch finished, commiting by moving "
                          "'%(incomplete_path)s' to '%(final_path)s'"),
                          dict(incomplete_path=incomplete_path,
                               final_path=final_path))
+            self._make_shard_directory(image_id)
             os.rename(incomplete_path, final_path)
+            self.driver.add_cached_image(image_meta, final_path)
 
         def rollback(e):
             set_xattr('image_name', image_meta['name'])
@@ -212,24 +402,291 @@ class ImageCache(object):
                               invalid_path=invalid_path))
             os.rename(incomplete_path, invalid_path)
 
+        def verify(writer):
+            size = image_meta.get('size')
+            if size and writer.size != size:
+                return _("wrote %(written)d bytes, expected %(size)d "
+                         "bytes") % dict(written=writer.size, size=size)
+
+            checksum = image_meta.get('checksum')
+            if checksum and writer.checksum.hexdigest() != checksum:
+                return _("checksum of the data written %(written)s doesn't "
+                         "match expected checksum %(checksum)s") % dict(
+                            written=writer.checksum.hexdigest(),
+                            checksum=checksum)
+
         try:
             with open(incomplete_path, mode) as cache_file:
                 set_xattr('expected_size', image_meta['size'])
-                yield cache_file
-        except Exception as e:
-            rollback(e)
+                writer = ChecksummingWriter(cache_file)
+                yield writer
+        except BaseException as e:
+            # NOTE: Also roll back when the request reading the image goes
+            # away mid-write, which surfaces here as a GeneratorExit, so the
+            # incomplete file isn't left behind for followers to wait on
+            rollback("%s" % e or e.__class__.__name__)
             raise
         else:
-            commit()
+            error = verify(writer)
+            if error:
+                logger.error(_("refusing to cache image '%(image_id)s', "
+                               "%(error)s"), locals())
+                rollback(error)
+            else:
+                commit()
+        finally:
+            self.driver.delete_reservation(image_id)
 
     @contextmanager
-    def _open_read(self, image_meta, mode):
+    def _open_read(self, image_meta, mode, offset=0):
+        cache_file = self.open_for_read(image_meta, offset)
+        try:
+            yield cache_file
+        finally:
+            cache_file.close()
+
+    def open_for_read(self, image_meta, offset=0):
+        """Open a cached image for reading, positioned at byte `offset`.
+
+        Unlike `open`, the caller is responsible for closing the returned
+        file. This lets the file be handed off to the WSGI server so that
+        it can be sent without being copied through Python.
+        """
         image_id = image_meta['id']
         path = self.path_for_image(image_id)
-        with open(path, mode) as cache_file:
-            yield cache_file
+        cache_file = open(path, 'rb')
+        if offset:
+            cache_file.seek(offset)
+
+        self.record_hit(image_id)
+        return cache_file
+
+    def record_hit(self, image_id):
+        """Counts a hit on a cached image.
+
+        Hits are aggregated in memory and handed to the driver in a batch
+        every `image_cache_hit_flush_interval` seconds, so serving a hit
+        doesn't write to the disk.
+        """
+        count, last_accessed = self._pending_hits.get(str(image_id), (0, 0))
+        self._pending_hits[str(image_id)] = (count + 1, time.time())
+
+        if self._flush_timer is None:
+            interval = config.get_option(self.options,
+                                         'image_cache_hit_flush_interval',
+                                         type='int', default=10)
+            if interval > 0:
+                self._flush_timer = eventlet.spawn_after(interval,
+                                                         self.flush_hits)
+            else:
+                self.flush_hits()
+
+    def flush_hits(self):
+        """Hands the hits counted since the last flush to the driver"""
+        if self._flush_timer is not None:
+            self._flush_timer.cancel()
+            self._flush_timer = None
+
+        hits, self._pending_hits = self._pending_hits, {}
+        if not hits:
+            return
+        try:
+            self.driver.record_hits(hits)
+        except Exception:
+            logger.exception(_("Failed to record hits on cached images"))
+
+    def get_from_memory(self, image_meta):
+        """Returns the data of an image held in the memory tier, or None if
+        the image isn't held there
+        """
+        return self.memory.get(image_meta['id'])
+
+    def load_into_memory(self, image_meta):
+        """Reads a cached image into the memory tier, if it is small enough
+        to be held there.
+
+        :retval The image data, or None if the image isn't held in memory
+        """
+        if not self.memory.accepts(image_meta['size']):
+            return None
+
+        cache_file = self.open_for_read(image_meta)
+        try:
+            data = utils.execute_io(cache_file.read)
+        finally:
+            cache_file.close()
+
+        if len(data) != image_meta['size']:
+            logger.warn(_("cached image '%(id)s' is %(found)d bytes, "
+                          "expected %(size)d bytes, not holding it in "
+                          "memory"), dict(id=image_meta['id'],
+                                          found=len(data),
+                                          size=image_meta['size']))
+            return None
+
+        self.memory.add(image_meta['id'], data)
+        return data
+
+    def follow_incomplete(self, image_meta, poll_interval=0.1):
+        """Yields the data of an image that another request is currently
+        writing into the cache, as the data lands on disk.
+
+        This lets concurrent cache misses for the same image share a single
+        download from the backend store instead of each opening their own.
+
+        :raises `glance.common.exception.ImageCacheFollowFailed` if the
+                image size is unknown, the write errors out, or the write
+                makes no progress for `image_cache_follow_timeout` seconds.
+                Callers can resume from the store at the number of bytes
+                already yielded.
+        """
+        image_id = image_meta['id']
+        image_size = image_meta['size']
+        if not image_size:
+            raise exception.ImageCacheFollowFailed(
+                image_id=image_id, reason=_("image size is unknown"))
+
+        timeout = config.get_option(self.options,
+                                    'image_cache_follow_timeout',
+                                    type='int', default=60)
+
+        incomplete_path = self.incomplete_path_for_image(image_id)
+        try:
+            cache_file = open(incomplete_path, 'rb')
+        except IOError, e:
+            if e.errno != errno.ENOENT or not self.hit(image_id):
+                raise exception.ImageCacheFollowFailed(
+                    image_id=image_id, reason=_("write is not in progress"))
+            # NOTE: The write was committed before we got to it
+            cache_file = open(self.path_for_image(image_id), 'rb')
+
+        with cache_file:
+            bytes_read = 0
+            committed = False
+            last_progress = time.time()
+            while bytes_read < image_size:
+                chunk = utils.execute_io(
+                    cache_file.read,
+                    min(utils.FileWrapper.CHUNKSIZE, image_size - bytes_read))
+                if chunk:
+                    bytes_read += len(chunk)
+                    last_progress = time.time()
+                    yield chunk
+                    continue
+
+                # NOTE: Seeking clears the file's EOF indicator, otherwise
+                # reads would not see data appended after it was hit
+                cache_file.seek(bytes_read)
+
+                if committed:
+                    raise exception.ImageCacheFollowFailed(
+                        image_id=image_id, reason=_("cached image is "
+                                                    "truncated"))
+
+                if not self.is_image_currently_being_written(image_id):
+                    if not self.hit(image_id):
+                        raise exception.ImageCacheFollowFailed(
+                            image_id=image_id, reason=_("write failed"))
+                    # NOTE: Once the write is committed, all of the data is
+                    # in the file we are holding open, so stop waiting
+                    committed = True
+                    continue
+
+                if time.time() - last_progress > timeout:
+                    raise exception.ImageCacheFollowFailed(
+                        image_id=image_id, reason=_("write is stalled"))
+
+                eventlet.sleep(poll_interval)
+
+    def record_access(self, image_id):
+        """Tells the admission policy that the image was requested"""
+        self.policy.record_access(image_id)
+
+    def reserve(self, image_meta, force=False):
+        """Reserves room in the cache for an image that is about to be
+        written into it, evicting the least recently accessed images until
+        the image fits.
+
+        :param force: Evict images regardless of the admission policy, for
+                      images that were explicitly asked to be cached
+
+        :retval True if the image may be written into the cache, False if it
+                can't be cached because its size is unknown, it doesn't fit
+                into the cache even once emptied of everything not being
+                written, the admission policy rejects it, or it is already
+                being written
+        """
+        image_id = image_meta['id']
+        size = image_meta['size']
+        max_size = self.max_size
+        if not size or size > max_size:
+            logger.debug(_("image '%(image_id)s' of size %(size)s can't be "
+                         "cached, cache max_size=%(max_size)d B"), locals())
+            return False
+
+        # NOTE: Let the driver see the latest hits before it picks images to
+        # evict
+        self.flush_hits()
+        while True:
+            try:
+                if self.driver.reserve(image_id, size, max_size):
+                    return True
+            except exception.Duplicate:
+                logger.debug(_("image '%s' is already being cached"),
+                             image_id)
+                return False
+
+            victims, fits = self.get_images_to_evict(size, max_size)
+            if not fits or not victims:
+                # NOTE: What's left of the cache is reserved for the images
+                # other requests are writing into it
+                logger.debug(_("no room left to cache image '%s'"), image_id)
+                return False
+
+            # NOTE: Only evict once the image was admitted in favour of every
+            # image it would evict, so a rejected image doesn't leave a hole
+            # in the cache
+            for victim in victims:
+                if not force and not self.policy.admit((image_id, size),
+                                                       victim):
+                    logger.debug(_("admission policy rejected image "
+                                 "'%(image_id)s' in favour of cached image "
+                                 "'%(victim_id)s'"),
+                                 dict(image_id=image_id, victim_id=victim[0]))
+                    return False
+
+            for victim_id, victim_size in victims:
+                logger.debug(_("evicting image '%(victim_id)s' to free "
+                             "%(victim_size)d B for image '%(image_id)s'"),
+                             locals())
+                self.purge(victim_id)
+
+    def invalidate(self, image_id, reason):
+        """Moves a cached image to the invalid directory, for instance
+        because its data no longer matches its checksum.
+
+        Only the memory tier of this process drops the image, other
+        processes keep serving their in-memory copy until it is evicted.
+        """
+        path = self.path_for_image(image_id)
+        invalid_path = self.invalid_path_for_image(image_id)
+        utils.set_xattr(path, 'error', reason)
+        logger.debug(_("invalidating cached image by moving '%(path)s' to "
+                     "'%(invalid_path)s'"), locals())
+        os.rename(path, invalid_path)
+        self.driver.delete_cached_image(image_id)
+        self.memory.remove(image_id)
+
+    def get_images_to_verify(self, verified_before):
+        """Returns a list of (image_id, checksum) tuples of the cached images
+        that weren't verified since `verified_before`, least recently
+        verified first
+        """
+        return self.driver.get_images_to_verify(verified_before)
 
-        utils.inc_xattr(path, 'hits')  # bump the hit count
+    def record_verified(self, image_id):
+        """Records that the data of a cached image was just verified"""
+        self.driver.record_verified(image_id, time.time())
 
     def hit(self, image_id):
         return os.path.exists(self.path_for_image(image_id))
@@ -246,18 +703,54 @@ class ImageCache(object):
     def purge(self, image_id):
         path = self.path_for_image(image_id)
         self._delete_file(path)
+        self.driver.delete_cached_image(image_id)
+        self.memory.remove(image_id)
 
     def clear(self):
         purged = 0
-        for path in self.get_all_regular_files(self.path):
-            self._delete_file(path)
+        for entry in list(self.entries()):
+            self.purge(entry['id'])
             purged += 1
         return purged
 
+    def get_cache_size(self):
+        """Returns the total size in bytes of the cached images"""
+        return self.driver.get_cache_size()
+
+    def get_least_recently_accessed(self):
+        """Returns a tuple of (image_id, size) for the least recently
+        accessed cached image, or None if the cache is empty
+        """
+        return self.driver.get_least_recently_accessed()
+
+    def get_images_to_evict(self, size, max_size):
+        """Returns a tuple of (images, fits), where images is a list of
+        (image_id, size) of the least recently accessed cached images to
+        evict to make room for `size` bytes in a cache of `max_size` bytes,
+        and fits tells whether evicting them makes enough room
+        """
+        return self.driver.get_images_to_evict(size, max_size)
+
     def is_image_currently_being_written(self, image_id):
-        """Returns true if we're currently downloading an image"""
+        """Returns true if we're currently downloading an image.
+
+        An incomplete file only counts as being written while the image
+        still holds its reservation and the file was written to within the
+        last `image_cache_follow_timeout` seconds. Otherwise the write
+        behind it died, and the file is just waiting for the reaper.
+        """
         incomplete_path = self.incomplete_path_for_image(image_id)
-        return os.path.exists(incomplete_path)
+        try:
+            mtime = os.stat(incomplete_path).st_mtime
+        except OSError:
+            return False
+
+        timeout = config.get_option(self.options,
+                                    'image_cache_follow_timeout',
+                                    type='int', default=60)
+        if time.time() - mtime > timeout:
+            return False
+        return self.driver.is_reserved(image_id)
 
     def is_currently_prefetching_any_images(self):
         """True if we are currently prefetching an image.
@@ -274,9 +767,12 @@ class ImageCache(object):
         prefetching_path = os.path.join(self.prefetching_path, str(image_id))
         return os.path.exists(prefetching_path)
 
-    def queue_prefetch(self, image_meta):
+    def queue_prefetch(self, image_meta, priority=0):
         """This adds a image to be prefetched to the queue directory.
 
+        Images with a higher `priority` are prefetched first, images with the
+        same priority in the order they were queued.
+
         If the image already exists in the queue directory or the
         prefetching directory, we ignore it.
         """
@@ -301,12 +797,25 @@ class ImageCache(object):
 
         prefetch_path = os.path.join(self.prefetch_path, str(image_id))
 
-        # Touch the file to add it to the queue
+        # Write the priority into the file to add it to the queue
         with open(prefetch_path, "w") as f:
-            pass
+            f.write(str(priority))
 
         utils.set_xattr(prefetch_path, 'image_name', image_meta['name'])
 
+    def get_prefetch_priority(self, image_id):
+        """Returns the priority an image was queued for prefetching with"""
+        prefetch_path = os.path.join(self.prefetch_path, str(image_id))
+        return self._read_prefetch_priority(prefetch_path)
+
+    @staticmethod
+    def _read_prefetch_priority(path):
+        try:
+            with open(path) as f:
+                return int(f.read().strip() or 0)
+        except (IOError, ValueError):
+            return 0
+
     def delete_queued_prefetch_image(self, image_id):
         prefetch_path = os.path.join(self.prefetch_path, str(image_id))
         self._delete_file(prefetch_path)
@@ -315,27 +824,6 @@ class ImageCache(object):
         prefetching_path = os.path.join(self.prefetching_path, str(image_id))
         self._delete_file(prefetching_path)
 
-    def pop_prefetch_item(self):
-        """This returns the next prefetch job.
-
-        The prefetch directory is treated like a FIFO; so we sort by modified
-        time and pick the oldest.
-        """
-        items = []
-        for path in self.get_all_regular_files(self.prefetch_path):
-            mtime = os.path.getmtime(path)
-            items.append((mtime, path))
-
-        if not items:
-            raise IndexError
-
-        # Sort oldest files to the end of the list
-        items.sort(reverse=True)
-
-        mtime, path = items.pop()
-        image_id = os.path.basename(path)
-        return image_id
-
     def do_prefetch(self, image_id):
         """This moves the file from the prefetch queue path to the in-progress
         prefetching path (so we don't try to prefetch something twice).
@@ -345,18 +833,43 @@ class ImageCache(object):
         os.rename(prefetch_path, prefetching_path)
 
     @staticmethod
-    def get_all_regular_files(basepath):
+    def _regular_files(basepath):
+        """Yields a tuple of (path, stat result) for each regular file in
+        `basepath`, with a single stat per file
+        """
         for fname in os.listdir(basepath):
             path = os.path.join(basepath, fname)
-            if os.path.isfile(path):
-                yield path
+            try:
+                file_info = os.stat(path)
+            except OSError:
+                # NOTE: Removed since we listed the directory
+                continue
+            if stat.S_ISREG(file_info.st_mode):
+                yield path, file_info
 
-    def _base_entries(self, basepath):
-        def iso8601_from_timestamp(timestamp):
-            return datetime.datetime.utcfromtimestamp(timestamp)\
-                                    .isoformat()
+    @classmethod
+    def get_all_regular_files(cls, basepath):
+        for path, file_info in cls._regular_files(basepath):
+            yield path
 
-        for path in self.get_all_regular_files(basepath):
+    def _cached_image_files(self):
+        """Yields a tuple of (path, stat result) for each file in the shards
+        of the main cache directory
+        """
+        for shard in os.listdir(self.path):
+            if not SHARD_RE.match(shard):
+                continue
+            shard_path = os.path.join(self.path, shard)
+            for subshard in os.listdir(shard_path):
+                if not SHARD_RE.match(subshard):
+                    continue
+                subshard_path = os.path.join(shard_path, subshard)
+                for path_info in self._regular_files(subshard_path):
+                    yield path_info
+
+    def _entries_from_files(self, files):
+        iso8601_from_timestamp = base.iso8601_from_timestamp
+        for path, file_info in files:
             filename = os.path.basename(path)
             try:
                 image_id = int(filename)
@@ -368,20 +881,23 @@ class ImageCache(object):
             entry['path'] = path
             entry['name'] = utils.get_xattr(path, 'image_name',
                                             default='UNKNOWN')
-
-            mtime = os.path.getmtime(path)
-            entry['last_modified'] = iso8601_from_timestamp(mtime)
-
-            atime = os.path.getatime(path)
-            entry['last_accessed'] = iso8601_from_timestamp(atime)
-
-            entry['size'] = os.path.getsize(path)
-
+            entry['last_modified'] = iso8601_from_timestamp(
+                    file_info.st_mtime)
+            entry['last_accessed'] = iso8601_from_timestamp(
+                    file_info.st_atime)
+            entry['size'] = file_info.st_size
             entry['expected_size'] = utils.get_xattr(
                     path, 'expected_size', default='UNKNOWN')
 
             yield entry
 
+    def _base_entries(self, basepath):
+        return self._entries_from_files(self._regular_files(basepath))
+
+    def _cached_entries(self):
+        """Cache info read from the files in the main cache directory"""
+        return self._entries_from_files(self._cached_image_files())
+
     def invalid_entries(self):
         """Cache info for invalid cached images"""
         for entry in self._base_entries(self.invalid_path):
@@ -404,23 +920,24 @@ class ImageCache(object):
             path = entry['path']
             entry['status'] = 'in-progress' if 'prefetching' in path\
                                             else 'queued'
+            entry['priority'] = self._read_prefetch_priority(path)
             yield entry
 
-    def entries(self):
-        """Cache info for currently cached images"""
-        for entry in self._base_entries(self.path):
-            path = entry['path']
-            entry['hits'] = utils.get_xattr(path, 'hits', default='UNKNOWN')
-            yield entry
+    def entries(self, **kwargs):
+        """Cache info for currently cached images
+
+        Takes the filters, marker, limit, sort_key and sort_dir parameters
+        of `glance.image_cache.drivers.base.Driver.get_cached_images`.
+        """
+        return self.driver.get_cached_images(**kwargs)
 
     def _reap_old_files(self, dirpath, entry_type, grace=None):
         """
         """
         now = time.time()
         reaped = 0
-        for path in self.get_all_regular_files(dirpath):
-            mtime = os.path.getmtime(path)
-            age = now - mtime
+        for path, file_info in self._regular_files(dirpath):
+            age = now - file_info.st_mtime
             if not grace:
                 logger.debug(_("No grace period, reaping '%(path)s'"
                              " immediately"), locals())
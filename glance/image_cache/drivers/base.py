@@ -0,0 +1,203 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2011 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Base class for image cache metadata drivers
+"""
+
+import datetime
+
+from glance.common import exception
+
+
+class Driver(object):
+    """
+    A cache metadata driver keeps track of the bookkeeping information for
+    the images in the main cache directory: their names, sizes, hit counts
+    and when they were last accessed. The image data itself is always
+    managed by the `glance.image_cache.ImageCache`.
+    """
+
+    def __init__(self, cache):
+        """
+        :param cache: The `glance.image_cache.ImageCache` the driver keeps
+                      the bookkeeping for
+        """
+        self.cache = cache
+        self.options = cache.options
+
+    def configure(self):
+        """
+        Configure the driver to use the stored configuration options.
+        Any driver that needs special configuration should implement
+        this method. If the driver is not able to be configured,
+        it should raise `glance.common.exception.BadDriverConfiguration`
+        """
+        pass
+
+    def get_cached_images(self, filters=None, marker=None, limit=None,
+                          sort_key='id', sort_dir='asc'):
+        """
+        Returns an iterable of mappings of information about the images
+        in the cache
+
+        :param filters: dictionary of `size_min` and `size_max` bounds on
+                        the sizes of the images
+        :param marker: id after which to start the page of images
+        :param limit: maximum number of images to return
+        :param sort_key: image attribute to sort the images by, one of
+                         `id`, `size`, `hits` or `last_accessed`
+        :param sort_dir: direction in which to sort (asc, desc)
+        :raises `glance.common.exception.NotFound` if the marker image
+                isn't in the cache
+        """
+        raise NotImplementedError
+
+    def get_cache_size(self):
+        """
+        Returns the total size in bytes of the images in the cache
+        """
+        raise NotImplementedError
+
+    def get_least_recently_accessed(self):
+        """
+        Returns a tuple of (image_id, size) for the least recently accessed
+        image in the cache, or None if the cache is empty
+        """
+        raise NotImplementedError
+
+    def get_images_to_evict(self, size, max_size):
+        """
+        Picks the least recently accessed images to evict so that `size`
+        more bytes fit into the cache within `max_size` bytes, alongside
+        the other cached images and the reservations
+
+        :retval A tuple of (images, fits), where `images` is a list of
+                tuples of (image_id, size), least recently accessed first,
+                and `fits` is False if evicting all of them still leaves too
+                little room
+        """
+        raise NotImplementedError
+
+    def add_cached_image(self, image_meta, path):
+        """
+        Records an image that was just written into the cache
+
+        :param image_meta: Mapping of metadata about image
+        :param path: The path of the image's file in the cache
+        """
+        raise NotImplementedError
+
+    def reserve(self, image_id, size, max_size):
+        """
+        Reserves `size` bytes of the cache for an image that is about to be
+        written into it, provided the cached images and the other
+        reservations leave room for it within `max_size` bytes.
+
+        :retval True if the space was reserved, False if there isn't enough
+                free space
+        :raises `glance.common.exception.Duplicate` if the image already
+                holds a reservation
+        """
+        raise NotImplementedError
+
+    def delete_reservation(self, image_id):
+        """
+        Releases the space reserved for an image once its write into the
+        cache either was committed or failed
+        """
+        raise NotImplementedError
+
+    def is_reserved(self, image_id):
+        """
+        Returns True if space is currently reserved for the image
+        """
+        raise NotImplementedError
+
+    def record_hits(self, hits):
+        """
+        Records a batch of accesses to cached images
+
+        :param hits: Mapping of image id to a tuple of (count, last_accessed)
+                     with the number of hits since the last batch and the
+                     timestamp of the latest one
+        """
+        raise NotImplementedError
+
+    def get_images_to_verify(self, verified_before):
+        """
+        Returns a list of (image_id, checksum) tuples of the cached images
+        with a known checksum that weren't verified since the timestamp
+        `verified_before`, least recently verified first
+        """
+        raise NotImplementedError
+
+    def record_verified(self, image_id, verified_at):
+        """
+        Records that the data of a cached image was verified against its
+        checksum at the timestamp `verified_at`
+        """
+        raise NotImplementedError
+
+    def delete_cached_image(self, image_id):
+        """
+        Removes the bookkeeping for an image that was removed from the cache
+        """
+        raise NotImplementedError
+
+
+def iso8601_from_timestamp(timestamp):
+    return datetime.datetime.utcfromtimestamp(timestamp).isoformat()
+
+
+def paginate_entries(entries, filters=None, marker=None, limit=None,
+                     sort_key='id', sort_dir='asc'):
+    """
+    Filters, sorts and pages a list of cache entries in memory, for the
+    listings that aren't backed by an index. Takes the same parameters as
+    `Driver.get_cached_images`.
+    """
+    filters = filters or {}
+    if filters.get('size_min') is not None:
+        entries = [e for e in entries if e['size'] >= filters['size_min']]
+    if filters.get('size_max') is not None:
+        entries = [e for e in entries if e['size'] <= filters['size_max']]
+
+    def sort_value(entry):
+        value = entry.get(sort_key)
+        if sort_key == 'hits':
+            # NOTE: Hits read from xattrs are strings, or UNKNOWN
+            try:
+                value = int(value)
+            except (TypeError, ValueError):
+                value = -1
+        return value, entry['id']
+
+    entries = sorted(entries, key=sort_value, reverse=(sort_dir == 'desc'))
+
+    if marker is not None:
+        for index, entry in enumerate(entries):
+            if entry['id'] == marker:
+                entries = entries[index + 1:]
+                break
+        else:
+            raise exception.NotFound(_("Image %s is not in the cache")
+                                     % marker)
+
+    if limit is not None:
+        entries = entries[:limit]
+    return entries
@@ -0,0 +1,372 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2011 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Cache metadata driver that keeps the bookkeeping in an embedded SQLite
+database inside the cache directory.
+
+Unlike the xattr driver, this works on filesystems mounted with `noatime`
+or without xattr support, and lets the pruner find the least recently
+accessed image and the size of the cache with indexed queries instead of
+stat'ing every file in the cache.
+"""
+
+from contextlib import contextmanager
+import logging
+import os
+import sqlite3
+import time
+
+from glance.common import config
+from glance.common import exception
+from glance.image_cache.drivers import base
+from glance import utils
+
+logger = logging.getLogger('glance.image_cache.drivers.sqlite')
+
+DEFAULT_SQLITE_DB = 'cache.db'
+
+# Number of seconds to wait on a database locked by another process
+DEFAULT_SQL_CALL_TIMEOUT = 2
+
+SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS cached_images (
+           image_id INTEGER PRIMARY KEY,
+           name TEXT,
+           size INTEGER NOT NULL DEFAULT 0,
+           expected_size INTEGER,
+           hits INTEGER NOT NULL DEFAULT 0,
+           last_accessed REAL NOT NULL,
+           last_modified REAL NOT NULL,
+           checksum TEXT,
+           last_verified REAL NOT NULL DEFAULT 0
+       )""",
+    """CREATE INDEX IF NOT EXISTS ix_cached_images_last_accessed
+           ON cached_images (last_accessed)""",
+    """CREATE INDEX IF NOT EXISTS ix_cached_images_last_verified
+           ON cached_images (last_verified)""",
+    """CREATE INDEX IF NOT EXISTS ix_cached_images_size
+           ON cached_images (size)""",
+    """CREATE INDEX IF NOT EXISTS ix_cached_images_hits
+           ON cached_images (hits)""",
+    """CREATE TABLE IF NOT EXISTS cache_reservations (
+           image_id INTEGER PRIMARY KEY,
+           size INTEGER NOT NULL,
+           reserved_at REAL NOT NULL
+       )""",
+]
+
+# Columns the cached images may be sorted by, each backed by an index
+SORT_COLUMNS = {
+    'id': 'image_id',
+    'size': 'size',
+    'hits': 'hits',
+    'last_accessed': 'last_accessed',
+}
+
+# Columns added to the cached_images table after it was first released, as
+# (name, definition) pairs
+ADDED_COLUMNS = [
+    ('checksum', 'TEXT'),
+    ('last_verified', 'REAL NOT NULL DEFAULT 0'),
+]
+
+
+class Driver(base.Driver):
+
+    def configure(self):
+        """
+        Configure the driver to use the stored configuration options,
+        creating the cache database if it doesn't exist yet.
+
+        :raises `glance.common.exception.BadDriverConfiguration` if the
+                cache database can't be opened
+        """
+        db_file = config.get_option(self.options, 'image_cache_sqlite_db',
+                                    default=DEFAULT_SQLITE_DB)
+        self.db_path = os.path.join(self.cache.path, db_file)
+        try:
+            self._initialize_db()
+        except sqlite3.DatabaseError, e:
+            reason = _("Failed to initialize the image cache database "
+                       "'%(db_path)s': %(e)s") % dict(db_path=self.db_path,
+                                                     e=e)
+            logger.error(reason)
+            raise exception.BadDriverConfiguration(driver_name='sqlite',
+                                                   reason=reason)
+
+    def _initialize_db(self):
+        is_new_db = not os.path.exists(self.db_path)
+        with self.get_db() as db:
+            self._add_missing_columns(db)
+            for statement in SCHEMA:
+                db.execute(statement)
+            if is_new_db:
+                self._import_cached_images(db)
+
+    def _add_missing_columns(self, db):
+        """Upgrades a cached_images table created by an older release"""
+        columns = [row['name'] for row in
+                   db.execute("PRAGMA table_info(cached_images)")]
+        if not columns:
+            return
+
+        for name, definition in ADDED_COLUMNS:
+            if name not in columns:
+                db.execute("ALTER TABLE cached_images ADD COLUMN %s %s"
+                           % (name, definition))
+
+    def _import_cached_images(self, db):
+        """
+        Adds the images already in the cache directory to a newly created
+        database, so switching over from the xattr driver keeps the cache.
+        """
+        imported = 0
+        for entry in self.cache._cached_entries():
+            path = entry['path']
+            hits = utils.get_xattr(path, 'hits', default=0)
+            expected_size = utils.get_xattr(path, 'expected_size',
+                                            default=None)
+            checksum = utils.get_xattr(path, 'checksum', default=None)
+            db.execute("""INSERT OR IGNORE INTO cached_images
+                          (image_id, name, size, expected_size, hits,
+                           last_accessed, last_modified, checksum)
+                          VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
+                       (entry['id'], entry['name'], entry['size'],
+                        expected_size, hits,
+                        os.path.getatime(path), os.path.getmtime(path),
+                        checksum))
+            imported += 1
+
+        if imported:
+            logger.info(_("Imported %(imported)d existing image cache "
+                          "entries into '%(db_path)s'"),
+                        dict(imported=imported, db_path=self.db_path))
+
+    @contextmanager
+    def get_db(self, immediate=False):
+        """
+        Returns a connection to the cache database inside a transaction,
+        committing when the block completes and rolling back if it raises
+
+        :param immediate: Take the database's write lock when the
+                          transaction begins rather than on its first write
+        """
+        conn = sqlite3.connect(self.db_path, timeout=DEFAULT_SQL_CALL_TIMEOUT,
+                               check_same_thread=False, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
+            conn.execute(immediate and "BEGIN IMMEDIATE" or "BEGIN")
+            try:
+                yield conn
+                conn.execute("COMMIT")
+            except:
+                conn.execute("ROLLBACK")
+                raise
+        finally:
+            conn.close()
+
+    def get_cached_images(self, filters=None, marker=None, limit=None,
+                          sort_key='id', sort_dir='asc'):
+        filters = filters or {}
+        column = SORT_COLUMNS[sort_key]
+        direction = sort_dir == 'desc' and 'DESC' or 'ASC'
+        where = []
+        args = []
+
+        if filters.get('size_min') is not None:
+            where.append("size >= ?")
+            args.append(filters['size_min'])
+        if filters.get('size_max') is not None:
+            where.append("size <= ?")
+            args.append(filters['size_max'])
+
+        with self.get_db() as db:
+            if marker is not None:
+                row = db.execute("SELECT %s FROM cached_images "
+                                 "WHERE image_id = ?" % column,
+                                 (int(marker),)).fetchone()
+                if row is None:
+                    raise exception.NotFound(_("Image %s is not in the "
+                                               "cache") % marker)
+                # NOTE: Ties on the sort key are broken by the image id
+                op = direction == 'DESC' and '<' or '>'
+                where.append("(%(column)s %(op)s ? OR "
+                             "(%(column)s = ? AND image_id %(op)s ?))"
+                             % locals())
+                args.extend([row[0], row[0], int(marker)])
+
+            query = ["""SELECT image_id, name, size, expected_size, hits,
+                               last_accessed, last_modified
+                        FROM cached_images"""]
+            if where:
+                query.append("WHERE " + " AND ".join(where))
+            query.append("ORDER BY %(column)s %(direction)s, "
+                         "image_id %(direction)s" % locals())
+            if limit is not None:
+                query.append("LIMIT ?")
+                args.append(limit)
+            rows = db.execute(" ".join(query), args).fetchall()
+
+        for row in rows:
+            yield {
+                'id': row['image_id'],
+                'path': self.cache.path_for_image(row['image_id']),
+                'name': row['name'] or 'UNKNOWN',
+                'size': row['size'],
+                'expected_size': (row['expected_size']
+                                  if row['expected_size'] is not None
+                                  else 'UNKNOWN'),
+                'hits': row['hits'],
+                'last_accessed': base.iso8601_from_timestamp(
+                    row['last_accessed']),
+                'last_modified': base.iso8601_from_timestamp(
+                    row['last_modified']),
+            }
+
+    def get_cache_size(self):
+        with self.get_db() as db:
+            row = db.execute("""SELECT COALESCE(SUM(size), 0)
+                                FROM cached_images""").fetchone()
+        return row[0]
+
+    def get_least_recently_accessed(self):
+        with self.get_db() as db:
+            row = db.execute("""SELECT image_id, size FROM cached_images
+                                ORDER BY last_accessed LIMIT 1""").fetchone()
+        if row is None:
+            return None
+        return row['image_id'], row['size']
+
+    def get_images_to_evict(self, size, max_size):
+        victims = []
+        with self.get_db() as db:
+            row = db.execute("""SELECT
+                (SELECT COALESCE(SUM(size), 0) FROM cached_images) +
+                (SELECT COALESCE(SUM(size), 0) FROM cache_reservations)
+                """).fetchone()
+            excess = row[0] + size - max_size
+            if excess > 0:
+                for row in db.execute("""SELECT image_id, size
+                                         FROM cached_images
+                                         ORDER BY last_accessed"""):
+                    victims.append((row['image_id'], row['size']))
+                    excess -= row['size']
+                    if excess <= 0:
+                        break
+        return victims, excess <= 0
+
+    def add_cached_image(self, image_meta, path):
+        now = time.time()
+        with self.get_db() as db:
+            # NOTE: The data was checked against the checksum as it was
+            # written
+            checksum = image_meta.get('checksum')
+            db.execute("""INSERT OR REPLACE INTO cached_images
+                          (image_id, name, size, expected_size, hits,
+                           last_accessed, last_modified, checksum,
+                           last_verified)
+                          VALUES (?, ?, ?, ?, 0, ?, ?, ?, ?)""",
+                       (int(image_meta['id']), image_meta['name'],
+                        os.path.getsize(path), image_meta['size'],
+                        now, now, checksum, checksum and now or 0))
+            db.execute("DELETE FROM cache_reservations WHERE image_id = ?",
+                       (int(image_meta['id']),))
+
+    def record_hits(self, hits):
+        try:
+            with self.get_db() as db:
+                db.executemany("""UPDATE cached_images
+                                  SET hits = hits + ?,
+                                      last_accessed = MAX(last_accessed, ?)
+                                  WHERE image_id = ?""",
+                               [(count, last_accessed, int(image_id))
+                                for image_id, (count, last_accessed)
+                                in hits.iteritems()])
+        except sqlite3.DatabaseError, e:
+            # NOTE: Missed hits only skew the LRU ordering a little, so
+            # don't fail over them
+            logger.warn(_("Failed to record %(num_hits)d hits on cached "
+                          "images: %(e)s"),
+                        dict(num_hits=sum(c for c, l in hits.itervalues()),
+                             e=e))
+
+    def get_images_to_verify(self, verified_before):
+        with self.get_db() as db:
+            rows = db.execute("""SELECT image_id, checksum FROM cached_images
+                                 WHERE last_verified < ?
+                                 AND checksum IS NOT NULL
+                                 ORDER BY last_verified""",
+                              (verified_before,)).fetchall()
+        return [(row['image_id'], row['checksum']) for row in rows]
+
+    def record_verified(self, image_id, verified_at):
+        with self.get_db() as db:
+            db.execute("""UPDATE cached_images SET last_verified = ?
+                          WHERE image_id = ?""",
+                       (verified_at, int(image_id)))
+
+    def delete_cached_image(self, image_id):
+        with self.get_db() as db:
+            db.execute("DELETE FROM cached_images WHERE image_id = ?",
+                       (int(image_id),))
+
+    def reserve(self, image_id, size, max_size):
+        now = time.time()
+        stall_timeout = config.get_option(self.options,
+                                          'image_cache_stall_timeout',
+                                          type='int', default=86400)
+        # NOTE: Taking the write lock up front keeps another process from
+        # reserving the same free space between our check and our insert
+        with self.get_db(immediate=True) as db:
+            # Reservations outlive the writes of processes that died
+            # mid-write, so expire them along with stalled cache entries
+            db.execute("DELETE FROM cache_reservations WHERE reserved_at < ?",
+                       (now - stall_timeout,))
+
+            if db.execute("""SELECT 1 FROM cache_reservations
+                             WHERE image_id = ?""",
+                          (int(image_id),)).fetchone():
+                raise exception.Duplicate(_("Image %s is already reserved "
+                                            "in the cache") % image_id)
+
+            row = db.execute("""SELECT
+                (SELECT COALESCE(SUM(size), 0) FROM cached_images) +
+                (SELECT COALESCE(SUM(size), 0) FROM cache_reservations)
+                """).fetchone()
+            if row[0] + size > max_size:
+                return False
+
+            db.execute("""INSERT INTO cache_reservations
+                          (image_id, size, reserved_at) VALUES (?, ?, ?)""",
+                       (int(image_id), size, now))
+            return True
+
+    def delete_reservation(self, image_id):
+        with self.get_db() as db:
+            db.execute("DELETE FROM cache_reservations WHERE image_id = ?",
+                       (int(image_id),))
+
+    def is_reserved(self, image_id):
+        stall_timeout = config.get_option(self.options,
+                                          'image_cache_stall_timeout',
+                                          type='int', default=86400)
+        with self.get_db() as db:
+            row = db.execute("""SELECT 1 FROM cache_reservations
+                                WHERE image_id = ? AND reserved_at >= ?""",
+                             (int(image_id), time.time() - stall_timeout))
+            return row.fetchone() is not None
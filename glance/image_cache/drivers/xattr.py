@@ -0,0 +1,226 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2011 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Cache metadata driver that keeps the bookkeeping in the cache files
+themselves, using xattrs and the filesystem's access times.
+
+Assumptions
+===========
+
+    1. Cache data directory exists on a filesytem that updates atime on
+       reads ('noatime' should NOT be set)
+
+    2. Cache data directory exists on a filesystem that supports xattrs.
+       This is optional, but highly recommended since it allows us to
+       present ops with useful information pertaining to the cache, like
+       human readable filenames and statistics.
+
+    3. The cache data directory supports `flock`, which serializes the
+       reservations of space for images being written across processes.
+       Each reservation is a file in the `reserved` subdirectory holding the
+       size reserved.
+"""
+
+import contextlib
+import errno
+import fcntl
+import os
+import stat
+import time
+
+from glance.common import config
+from glance.common import exception
+from glance.image_cache.drivers import base
+from glance import utils
+
+
+class Driver(base.Driver):
+
+    def configure(self):
+        if not os.path.exists(self.reservations_path):
+            os.makedirs(self.reservations_path)
+
+    @property
+    def reservations_path(self):
+        return os.path.join(self.cache.path, 'reserved')
+
+    def _reservation_path(self, image_id):
+        return os.path.join(self.reservations_path, str(int(image_id)))
+
+    @property
+    def _stall_timeout(self):
+        return config.get_option(self.options, 'image_cache_stall_timeout',
+                                 type='int', default=86400)
+
+    @contextlib.contextmanager
+    def _reservations_locked(self):
+        """Keeps other processes from reserving space until released"""
+        lock_path = os.path.join(self.reservations_path, '.lock')
+        with open(lock_path, 'a') as lock_file:
+            # NOTE: Closing the file releases the lock
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            yield
+
+    def _get_reservations(self):
+        """
+        Returns a dict of image_id -> size of the space reserved in the
+        cache, and removes the reservations of writes that stalled, such as
+        those of processes that died mid-write
+        """
+        reservations = {}
+        stalled_before = time.time() - self._stall_timeout
+        for filename in os.listdir(self.reservations_path):
+            try:
+                image_id = int(filename)
+            except ValueError:
+                continue
+            path = os.path.join(self.reservations_path, filename)
+            try:
+                if os.path.getmtime(path) < stalled_before:
+                    os.unlink(path)
+                    continue
+                with open(path) as reservation_file:
+                    reservations[image_id] = int(reservation_file.read())
+            except (IOError, OSError, ValueError):
+                # NOTE: The write finished and dropped its reservation in
+                # the meantime
+                continue
+        return reservations
+
+    def get_cached_images(self, **kwargs):
+        entries = []
+        for entry in self.cache._cached_entries():
+            path = entry['path']
+            entry['hits'] = utils.get_xattr(path, 'hits', default='UNKNOWN')
+            entries.append(entry)
+        return base.paginate_entries(entries, **kwargs)
+
+    def _get_stats(self):
+        for path, file_info in self.cache._cached_image_files():
+            try:
+                image_id = int(os.path.basename(path))
+            except ValueError:
+                continue
+            yield (file_info[stat.ST_ATIME],  # access time
+                   file_info[stat.ST_MTIME],  # modification time
+                   file_info[stat.ST_SIZE],   # size in bytes
+                   image_id)
+
+    def get_cache_size(self):
+        return sum(size for atime, mtime, size, image_id in self._get_stats())
+
+    def get_least_recently_accessed(self):
+        # NOTE(sirp): 'Recency' is determined via the filesystem, first using
+        # atime (access time) and falling back to mtime (modified time).
+        #
+        # It has become more common to disable access-time updates by setting
+        # the `noatime` option for the filesystem. `noatime` is NOT compatible
+        # with this method, use the sqlite driver instead.
+        stats = list(self._get_stats())
+        if not stats:
+            return None
+        atime, mtime, size, image_id = min(stats)
+        return image_id, size
+
+    def get_images_to_evict(self, size, max_size):
+        # NOTE: Scan the cache directory once, however many images have to
+        # be evicted
+        stats = sorted(self._get_stats())
+        used = (sum(stat[2] for stat in stats) +
+                sum(self._get_reservations().values()))
+        excess = used + size - max_size
+        victims = []
+        for atime, mtime, image_size, image_id in stats:
+            if excess <= 0:
+                break
+            victims.append((image_id, image_size))
+            excess -= image_size
+        return victims, excess <= 0
+
+    def add_cached_image(self, image_meta, path):
+        utils.set_xattr(path, 'image_name', image_meta['name'])
+        utils.set_xattr(path, 'hits', 0)
+        if image_meta.get('checksum'):
+            # NOTE: The data was checked against the checksum as it was
+            # written
+            utils.set_xattr(path, 'checksum', image_meta['checksum'])
+            utils.set_xattr(path, 'last_verified', time.time())
+
+    def reserve(self, image_id, size, max_size):
+        # NOTE: Holding the lock keeps another process from reserving the
+        # same free space between our check and writing our reservation
+        with self._reservations_locked():
+            reservations = self._get_reservations()
+            if int(image_id) in reservations:
+                raise exception.Duplicate(_("Image %s is already reserved "
+                                            "in the cache") % image_id)
+
+            used = self.get_cache_size() + sum(reservations.values())
+            if used + size > max_size:
+                return False
+
+            with open(self._reservation_path(image_id), 'w') as f:
+                f.write(str(size))
+            return True
+
+    def delete_reservation(self, image_id):
+        try:
+            os.unlink(self._reservation_path(image_id))
+        except OSError, e:
+            if e.errno != errno.ENOENT:
+                raise
+
+    def is_reserved(self, image_id):
+        try:
+            reserved_at = os.path.getmtime(self._reservation_path(image_id))
+        except OSError:
+            return False
+        return reserved_at >= time.time() - self._stall_timeout
+
+    def record_hits(self, hits):
+        # NOTE: The reads themselves update the access times
+        for image_id, (count, last_accessed) in hits.iteritems():
+            try:
+                utils.inc_xattr(self.cache.path_for_image(image_id), 'hits',
+                                count)
+            except (IOError, OSError):
+                # NOTE: The image was removed from the cache since
+                pass
+
+    def get_images_to_verify(self, verified_before):
+        images = []
+        for entry in self.cache._cached_entries():
+            path = entry['path']
+            checksum = utils.get_xattr(path, 'checksum', default=None)
+            if not checksum:
+                continue
+            last_verified = float(utils.get_xattr(path, 'last_verified',
+                                                  default=0))
+            if last_verified < verified_before:
+                images.append((last_verified, entry['id'], checksum))
+
+        images.sort()
+        return [(image_id, checksum) for last, image_id, checksum in images]
+
+    def record_verified(self, image_id, verified_at):
+        utils.set_xattr(self.cache.path_for_image(image_id), 'last_verified',
+                        verified_at)
+
+    def delete_cached_image(self, image_id):
+        # NOTE: The bookkeeping goes away along with the file
+        pass
@@ -0,0 +1,105 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2011 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+In-memory tier of the Image Cache for small images
+"""
+
+import logging
+
+try:
+    from collections import OrderedDict
+except ImportError:
+    # NOTE: Python 2.6 predates collections.OrderedDict
+    from ordereddict import OrderedDict
+
+logger = logging.getLogger('glance.image_cache.memory')
+
+# Memory tiers shared by all ImageCaches of a cache directory in this process
+_memory_caches = {}
+
+
+class MemoryCache(object):
+    """
+    Bounded LRU cache holding the data of small images in memory, so
+    requests for them are served without touching the disk.
+
+    A `max_size` of 0 disables the tier.
+    """
+
+    def __init__(self, max_size, max_image_size):
+        """
+        :param max_size: Maximum number of bytes of image data to hold
+        :param max_image_size: Size in bytes of the largest image to hold
+        """
+        self.max_size = max_size
+        self.max_image_size = max_image_size
+        self.size = 0
+        self.images = OrderedDict()  # least recently used first
+
+    def accepts(self, size):
+        """Returns True if an image of `size` bytes may be held"""
+        return bool(size) and size <= min(self.max_size, self.max_image_size)
+
+    def get(self, image_id):
+        """Returns the data of an image, or None if it isn't held"""
+        data = self.images.pop(str(image_id), None)
+        if data is not None:
+            self.images[str(image_id)] = data
+        return data
+
+    def add(self, image_id, data):
+        """
+        Holds the data of an image, evicting the least recently used images
+        to make room for it
+
+        :retval True if the image is held, False if it is too large
+        """
+        if not self.accepts(len(data)):
+            return False
+
+        self.remove(image_id)
+        while self.size + len(data) > self.max_size:
+            evicted_id, evicted = self.images.popitem(last=False)
+            self.size -= len(evicted)
+            logger.debug(_("evicted image '%s' from the memory cache"),
+                         evicted_id)
+
+        self.images[str(image_id)] = data
+        self.size += len(data)
+        return True
+
+    def remove(self, image_id):
+        data = self.images.pop(str(image_id), None)
+        if data is not None:
+            self.size -= len(data)
+
+    def clear(self):
+        self.images.clear()
+        self.size = 0
+
+
+def get_memory_cache(path, max_size, max_image_size):
+    """
+    Returns the memory tier for the cache directory `path`, so that every
+    ImageCache of the directory in this process sees the same images
+    """
+    memory_cache = _memory_caches.get(path)
+    if memory_cache is None:
+        memory_cache = MemoryCache(max_size, max_image_size)
+        _memory_caches[path] = memory_cache
+    return memory_cache
@@ -0,0 +1,248 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2011 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Peer mode of the Image Cache
+
+In peer mode, the Image Caches of all API nodes act as one cache: each image
+is owned by one node, picked through a consistent hash ring of the nodes, and
+only the owner caches it. The other nodes either redirect requests for the
+image to its owner or proxy the image data from it, so every image is cached
+once instead of once per node.
+
+Independently of peer mode, a node may also fill its cache from the caches
+of sibling nodes listed in `image_cache_fill_peers` before going to the
+store, which is cheaper when the siblings are closer than the store.
+"""
+
+import bisect
+import hashlib
+import logging
+
+from glance.common import client
+from glance.common import config
+from glance.common import exception
+
+logger = logging.getLogger('glance.image_cache.peers')
+
+# Header marking a request that a peer proxies to the image's owner, so the
+# owner serves it itself even if its hash ring disagrees
+PEER_REQUEST_HEADER = 'x-image-cache-peer-request'
+
+# Header asking a peer to only serve an image from its cache, and respond
+# with 404 Not Found if it doesn't hold the image
+CACHE_ONLY_HEADER = 'x-image-cache-only'
+
+
+def parse_peers(peers):
+    """
+    Parses a comma-separated list of `<host>:<port>` peers
+
+    :raises RuntimeError if an entry isn't of the form `<host>:<port>`
+    """
+    peers = [peer.strip() for peer in peers.split(',') if peer.strip()]
+    for peer in peers:
+        split_peer(peer)
+    return peers
+
+
+def split_peer(peer):
+    """Returns a tuple of (host, port) of a `<host>:<port>` peer"""
+    try:
+        host, port = peer.rsplit(':', 1)
+        return host, int(port)
+    except ValueError:
+        raise RuntimeError(_("Invalid peer '%s', expected <host>:<port>")
+                           % peer)
+
+
+def get_from_peer(peer, req, path, headers=None, use_ssl=False):
+    """
+    Issues a GET request for image data to a peer on behalf of `req`
+
+    :param peer: `<host>:<port>` of the peer
+    :param req: The WSGI/Webob Request object being served
+    :param path: Path of the image on the peer
+    :param headers: Extra headers to send to the peer
+    :param use_ssl: Should we use HTTPS?
+
+    :retval An iterator over the image data returned by the peer
+    """
+    host, port = split_peer(peer)
+    headers = dict(headers or {})
+    headers[PEER_REQUEST_HEADER] = 'True'
+    if 'x-auth-token' in req.headers:
+        headers['x-auth-token'] = req.headers['x-auth-token']
+
+    peer_client = client.BaseClient(host, port, use_ssl=use_ssl,
+                                    auth_tok=None)
+    res = peer_client.do_request("GET", path, headers=headers)
+    return client.ImageBodyIterator(res)
+
+
+class HashRing(object):
+    """
+    Consistent hash ring mapping keys to nodes.
+
+    Each node is placed on the ring `replicas` times, so keys spread evenly
+    over the nodes, and adding or removing a node only moves the keys of
+    that node.
+    """
+
+    def __init__(self, nodes, replicas=100):
+        self.nodes = list(nodes)
+        self.ring = []
+        for node in self.nodes:
+            for replica in xrange(replicas):
+                self.ring.append((self._hash("%s-%d" % (node, replica)),
+                                  node))
+        self.ring.sort()
+        self.hashes = [hash_ for hash_, node in self.ring]
+
+    @staticmethod
+    def _hash(key):
+        return long(hashlib.md5(key).hexdigest()[:16], 16)
+
+    def get_node(self, key):
+        """Returns the node owning `key`, or None if the ring is empty"""
+        if not self.ring:
+            return None
+        index = bisect.bisect(self.hashes, self._hash(str(key)))
+        return self.ring[index % len(self.ring)][1]
+
+
+class PeerRouter(object):
+    """Routes requests for images owned by other API nodes to their owner"""
+
+    MODES = ('proxy', 'redirect')
+
+    def __init__(self, options):
+        """
+        :raises RuntimeError if peer mode is misconfigured
+        """
+        self.options = options
+        self.peers = parse_peers(config.get_option(
+            options, 'image_cache_peers', default=''))
+        self.self_peer = config.get_option(options, 'image_cache_peer_self',
+                                           default=None)
+        self.mode = config.get_option(options, 'image_cache_peer_mode',
+                                      default='proxy')
+        self.use_ssl = config.get_option(options, 'image_cache_peer_use_ssl',
+                                         type='bool', default=False)
+
+        if not self.enabled:
+            return
+
+        if self.mode not in self.MODES:
+            raise RuntimeError(_("Invalid image_cache_peer_mode '%(mode)s', "
+                                 "expected one of %(modes)s")
+                               % dict(mode=self.mode,
+                                      modes=', '.join(self.MODES)))
+        if self.self_peer not in self.peers:
+            raise RuntimeError(_("image_cache_peer_self must be set to the "
+                                 "entry of this node in image_cache_peers"))
+
+        self.ring = HashRing(self.peers)
+
+    @property
+    def enabled(self):
+        return bool(self.peers)
+
+    def get_owner(self, req, image_id):
+        """
+        Returns the `host:port` of the peer owning an image, or None if
+        this node should serve the request itself: because it owns the
+        image, peer mode is disabled or a peer already routed the request
+        """
+        if not self.enabled or req.headers.get(PEER_REQUEST_HEADER):
+            return None
+
+        owner = self.ring.get_node(image_id)
+        if owner == self.self_peer:
+            return None
+        return owner
+
+    def get_redirect_location(self, req, owner):
+        """Returns the URL of the request on the owner of the image"""
+        return "%s://%s%s" % (req.scheme, owner, req.path_qs)
+
+    def fetch(self, req, owner):
+        """
+        Forwards a request for image data to the owner of the image
+
+        :retval An iterator over the image data returned by the owner
+        :raises `glance.common.exception.ClientConnectionError` if the
+                owner can't be reached, or another exception if it fails
+                to serve the request
+        """
+        headers = {}
+        for header in ('range', 'if-range'):
+            if header in req.headers:
+                headers[header] = req.headers[header]
+
+        logger.debug(_("proxying '%(path)s' from peer '%(owner)s'"),
+                     dict(path=req.path_qs, owner=owner))
+        return get_from_peer(owner, req, req.path_qs, headers,
+                             use_ssl=self.use_ssl)
+
+
+class PeerFill(object):
+    """
+    Fills the cache from the caches of sibling API nodes, tried in the
+    order they are listed in `image_cache_fill_peers`, so the closest
+    siblings should come first.
+    """
+
+    def __init__(self, options):
+        """
+        :raises RuntimeError if a peer isn't of the form `<host>:<port>`
+        """
+        self.options = options
+        self.peers = parse_peers(config.get_option(
+            options, 'image_cache_fill_peers', default=''))
+        self.use_ssl = config.get_option(options, 'image_cache_peer_use_ssl',
+                                         type='bool', default=False)
+
+    @property
+    def enabled(self):
+        return bool(self.peers)
+
+    def fetch(self, req):
+        """
+        Asks the siblings in turn for the image data of `req` from their
+        caches
+
+        :retval A tuple of (peer, iterator over the image data) for the
+                first sibling holding the image, or None if none of them
+                does
+        """
+        for peer in self.peers:
+            try:
+                chunks = get_from_peer(peer, req, req.path,
+                                       {CACHE_ONLY_HEADER: 'True'},
+                                       use_ssl=self.use_ssl)
+            except exception.NotFound:
+                continue
+            except Exception, e:
+                logger.warn(_("failed to ask peer '%(peer)s' for "
+                              "'%(path)s': %(e)s"),
+                            dict(peer=peer, path=req.path, e=e))
+                continue
+            logger.debug(_("filling '%(path)s' from peer '%(peer)s'"),
+                         dict(path=req.path, peer=peer))
+            return peer, chunks
+        return None
@@ -0,0 +1,130 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2011 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Admission policies for the Image Cache
+
+When making room for a new image means evicting a cached one, the admission
+policy decides whether the new image is worth more than the image it would
+evict. Policies see every request for an image, cached or not, through
+`record_access`.
+"""
+
+from glance.common import config
+
+
+class CountMinSketch(object):
+    """
+    Estimates how often keys were seen in a fixed amount of memory.
+
+    Estimates can only be too high, never too low, and are capped at
+    `max_count`. Once `sample_size` keys were added, all counters are
+    halved so that the sketch follows changes in popularity.
+    """
+
+    DEPTH = 4
+
+    def __init__(self, width, max_count=15, sample_size=None):
+        self.width = width
+        self.max_count = max_count
+        self.sample_size = sample_size or 10 * width
+        self.additions = 0
+        self.table = [[0] * width for row in xrange(self.DEPTH)]
+
+    def _indexes(self, key):
+        for row in xrange(self.DEPTH):
+            yield row, hash((row, key)) % self.width
+
+    def add(self, key):
+        for row, index in self._indexes(key):
+            if self.table[row][index] < self.max_count:
+                self.table[row][index] += 1
+
+        self.additions += 1
+        if self.additions >= self.sample_size:
+            self.reset()
+
+    def estimate(self, key):
+        return min(self.table[row][index]
+                   for row, index in self._indexes(key))
+
+    def reset(self):
+        """Halves all counters to age the frequencies seen so far"""
+        for counters in self.table:
+            for index, count in enumerate(counters):
+                counters[index] = count >> 1
+        self.additions >>= 1
+
+
+class LRUPolicy(object):
+    """Admits every image, evicting the least recently accessed images"""
+
+    def __init__(self, options):
+        self.options = options
+
+    def record_access(self, image_id):
+        pass
+
+    def admit(self, candidate, victim):
+        """
+        Returns True if caching the candidate image is worth evicting the
+        victim image
+
+        :param candidate: Tuple of (image_id, size) of the image to cache
+        :param victim: Tuple of (image_id, size) of the image to evict
+        """
+        return True
+
+
+class TinyLFUPolicy(LRUPolicy):
+    """
+    Only admits an image when it was requested more often than the image it
+    would evict, so a one-off request for an image can't flush images that
+    are in steady demand out of the cache.
+    """
+
+    def __init__(self, options):
+        super(TinyLFUPolicy, self).__init__(options)
+        width = config.get_option(options, 'image_cache_sketch_width',
+                                  type='int', default=4096)
+        self.sketch = CountMinSketch(width)
+
+    def record_access(self, image_id):
+        self.sketch.add(str(image_id))
+
+    def frequency(self, image_id):
+        return self.sketch.estimate(str(image_id))
+
+    def admit(self, candidate, victim):
+        return self.frequency(candidate[0]) > self.frequency(victim[0])
+
+
+class SizeAwareGDSFPolicy(TinyLFUPolicy):
+    """
+    Only admits an image when it was requested more often per byte than the
+    image it would evict, which is the GreedyDual-Size-Frequency priority
+    with a uniform cost. Aging is handled by the frequency sketch.
+
+    Many small images in steady demand are favoured over one large image.
+    """
+
+    def admit(self, candidate, victim):
+        candidate_id, candidate_size = candidate
+        victim_id, victim_size = victim
+        # NOTE: Compare freq/size without dividing, sizes are positive
+        return (self.frequency(candidate_id) * max(victim_size, 1) >
+                self.frequency(victim_id) * max(candidate_size, 1))
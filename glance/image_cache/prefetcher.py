@@ -18,10 +18,12 @@
 """
 Prefetches images into the Image Cache
 """
+import heapq
 import logging
 import os
-import stat
-import time
+import urlparse
+
+import eventlet
 
 from glance.common import config
 from glance.common import context
@@ -33,36 +35,118 @@ from glance.store import get_from_backend
 logger = logging.getLogger('glance.image_cache.prefetcher')
 
 
+class PrefetchQueue(object):
+    """
+    Priority queue of the images waiting in the cache's prefetch directory.
+
+    The directory is only listed on `refresh`, and each newly queued image
+    is read once, so popping an image doesn't re-list and sort the whole
+    directory.
+    """
+
+    def __init__(self, cache):
+        self.cache = cache
+        self.heap = []
+        self.queued = set()
+
+    def __len__(self):
+        return len(self.heap)
+
+    def refresh(self):
+        """Adds the images queued since the last refresh"""
+        for fname in os.listdir(self.cache.prefetch_path):
+            if fname in self.queued:
+                continue
+            path = os.path.join(self.cache.prefetch_path, fname)
+            try:
+                queued_at = os.path.getmtime(path)
+            except OSError:
+                # NOTE: Dequeued since we listed the directory
+                continue
+            priority = self.cache.get_prefetch_priority(fname)
+            heapq.heappush(self.heap, (-priority, queued_at, fname))
+            self.queued.add(fname)
+
+    def pop(self):
+        """
+        Returns the id of the image with the highest priority that is still
+        queued
+
+        :raises IndexError if the queue is empty
+        """
+        while True:
+            priority, queued_at, image_id = heapq.heappop(self.heap)
+            self.queued.discard(image_id)
+            # NOTE: Images are dequeued without us when they get cached by
+            # a regular download in the meantime
+            if self.cache.is_image_queued_for_prefetch(image_id):
+                return image_id
+
+
 class Prefetcher(object):
     def __init__(self, options):
         self.options = options
         self.cache = ImageCache(options)
+        self.queue = PrefetchQueue(self.cache)
+        workers = config.get_option(options,
+                                    'image_cache_prefetcher_workers',
+                                    type='int', default=4)
+        self.pool = eventlet.GreenPool(workers)
+        self.backend_semaphores = self._get_backend_semaphores()
+
+    def _get_backend_semaphores(self):
+        """
+        Parses the `image_cache_prefetcher_backend_workers` option, a comma
+        separated list of <scheme>:<workers> pairs, into a mapping of store
+        scheme to the semaphore limiting the prefetches from that store
+        """
+        semaphores = {}
+        limits = self.options.get('image_cache_prefetcher_backend_workers')
+        for limit in (limits or '').split(','):
+            if not limit.strip():
+                continue
+            try:
+                scheme, workers = limit.split(':')
+                semaphores[scheme.strip()] = eventlet.semaphore.Semaphore(
+                    int(workers))
+            except ValueError:
+                msg = _("Invalid image_cache_prefetcher_backend_workers "
+                        "entry '%s', expected <scheme>:<workers>") % limit
+                logger.error(msg)
+                raise RuntimeError(msg)
+        return semaphores
+
+    def _get_backend_semaphore(self, location):
+        scheme = urlparse.urlparse(location)[0].split('+')[0]
+        return self.backend_semaphores.get(scheme)
 
     def fetch_image_into_cache(self, image_id):
         ctx = context.RequestContext(is_admin=True, show_deleted=True)
         image_meta = registry.get_image_metadata(
                     self.options, ctx, image_id)
-        with self.cache.open(image_meta, "wb") as cache_file:
-            chunks = get_from_backend(image_meta['location'],
-                                      expected_size=image_meta['size'],
-                                      options=self.options)
-            for chunk in chunks:
-                cache_file.write(chunk)
-
-    def run(self):
-        if self.cache.is_currently_prefetching_any_images():
-            logger.debug(_("Currently prefetching, going back to sleep..."))
+        if not self.cache.reserve(image_meta, force=True):
+            logger.warn(_("Image %s can't be cached, skipping prefetch"),
+                        image_id)
             return
 
+        semaphore = self._get_backend_semaphore(image_meta['location'])
+        if semaphore is not None:
+            semaphore.acquire()
         try:
-            image_id = self.cache.pop_prefetch_item()
-        except IndexError:
-            logger.debug(_("Nothing to prefetch, going back to sleep..."))
-            return
+            with self.cache.open(image_meta, "wb") as cache_file:
+                chunks = get_from_backend(image_meta['location'],
+                                          expected_size=image_meta['size'],
+                                          options=self.options)
+                for chunk in chunks:
+                    cache_file.write(chunk)
+        finally:
+            if semaphore is not None:
+                semaphore.release()
 
+    def prefetch(self, image_id):
         if self.cache.hit(image_id):
             logger.warn(_("Image %s is already in the cache, deleting "
-                        "prefetch job and going back to sleep..."), image_id)
+                        "prefetch job..."), image_id)
             self.cache.delete_queued_prefetch_image(image_id)
             return
 
@@ -71,18 +155,56 @@ class Prefetcher(object):
         # prefetch another
         if self.cache.is_image_currently_being_written(image_id):
             logger.warn(_("Image %s is already being cached, deleting "
-                        "prefetch job and going back to sleep..."), image_id)
+                        "prefetch job..."), image_id)
             self.cache.delete_queued_prefetch_image(image_id)
             return
 
-        logger.debug(_("Prefetching '%s'"), image_id)
-        self.cache.do_prefetch(image_id)
+        try:
+            self.cache.do_prefetch(image_id)
+        except OSError:
+            # NOTE: Another prefetcher claimed the image first
+            logger.debug(_("Image %s is already being prefetched"), image_id)
+            return
 
+        logger.debug(_("Prefetching '%s'"), image_id)
         try:
             self.fetch_image_into_cache(image_id)
+        except Exception:
+            logger.exception(_("Failed to prefetch image %s"), image_id)
         finally:
             self.cache.delete_prefetching_image(image_id)
 
+    def dispatch(self):
+        """
+        Hands the queued images to the worker pool, highest priority first,
+        until the queue is empty. Waits for a free worker whenever all of
+        them are busy.
+        """
+        self.queue.refresh()
+        while True:
+            try:
+                image_id = self.queue.pop()
+            except IndexError:
+                logger.debug(_("Nothing left to prefetch"))
+                return
+            self.pool.spawn_n(self.prefetch, image_id)
+
+    def run(self):
+        """Prefetches all of the queued images, then returns"""
+        self.dispatch()
+        self.pool.waitall()
+
+    def run_forever(self, wakeup_time):
+        """Prefetches images as they are queued, checking the queue every
+        `wakeup_time` seconds
+        """
+        logger.info(_("Starting prefetcher: workers=%(workers)d "
+                      "wakeup_time=%(wakeup_time)s"),
+                    dict(workers=self.pool.size, wakeup_time=wakeup_time))
+        while True:
+            self.dispatch()
+            eventlet.sleep(wakeup_time)
+
 
 def app_factory(global_config, **local_conf):
     conf = global_config.copy()
@@ -19,9 +19,6 @@
 Prunes the Image Cache
 """
 import logging
-import os
-import stat
-import time
 
 from glance.common import config
 from glance.image_cache import ImageCache
@@ -36,10 +33,7 @@ class Pruner(object):
 
     @property
     def max_size(self):
-        default = 1 * 1024 * 1024 * 1024  # 1 GB
-        return config.get_option(
-            self.options, 'image_cache_max_size_bytes',
-            type='int', default=default)
+        return self.cache.max_size
 
     @property
     def percent_extra_to_free(self):
@@ -52,46 +46,8 @@ class Pruner(object):
 
     def prune_cache(self):
         """Prune the cache using an LRU strategy"""
-
-        # NOTE(sirp): 'Recency' is determined via the filesystem, first using
-        # atime (access time) and falling back to mtime (modified time).
-        #
-        # It has become more common to disable access-time updates by setting
-        # the `noatime` option for the filesystem. `noatime` is NOT compatible
-        # with this method.
-        #
-        # If `noatime` needs to be supported, we will need to persist access
-        # times elsewhere (either as a separate file, in the DB, or as
-        # an xattr).
-        def get_stats():
-            stats = []
-            for path in self.cache.get_all_regular_files(self.cache.path):
-                file_info = os.stat(path)
-                stats.append((file_info[stat.ST_ATIME],  # access time
-                              file_info[stat.ST_MTIME],  # modification time
-                              file_info[stat.ST_SIZE],   # size in bytes
-                              path))                     # absolute path
-            return stats
-
-        def prune_lru(stats, to_free):
-            # Sort older access and modified times to the back
-            stats.sort(reverse=True)
-
-            freed = 0
-            while to_free > 0:
-                atime, mtime, size, path = stats.pop()
-                logger.debug(_("deleting '%(path)s' to free %(size)d B"),
-                             locals())
-                os.unlink(path)
-                to_free -= size
-                freed += size
-
-            return freed
-
-        stats = get_stats()
-
         # Check for overage
-        cur_size = sum(s[2] for s in stats)
+        cur_size = self.cache.get_cache_size()
         max_size = self.max_size
         logger.debug(_("cur_size=%(cur_size)d B max_size=%(max_size)d B"),
                      locals())
@@ -105,7 +61,17 @@ class Pruner(object):
         logger.debug(_("overage=%(overage)d B extra=%(extra)d B"
                      " total=%(to_free)d B"), locals())
 
-        freed = prune_lru(stats, to_free)
+        # NOTE: Pick all the images to delete from one look at the cache,
+        # rather than looking for the least recently accessed image again
+        # after each deletion
+        victims, fits = self.cache.get_images_to_evict(extra, max_size)
+        freed = 0
+        for image_id, size in victims:
+            logger.debug(_("deleting image '%(image_id)s' to free "
+                         "%(size)d B"), locals())
+            self.cache.purge(image_id)
+            freed += size
+
         logger.debug(_("finished pruning, freed %(freed)d bytes"), locals())
 
 
@@ -0,0 +1,125 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2011 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Verifies the data of the images in the Image Cache against their checksums,
+to catch files that got corrupted on disk after they were cached
+
+Only the cached files are verified. A copy of an image an API server holds
+in its memory tier stays there until it is evicted or the server restarts.
+"""
+import errno
+import hashlib
+import logging
+import time
+
+from glance.common import config
+from glance.image_cache import ImageCache
+from glance import utils
+
+logger = logging.getLogger('glance.image_cache.verifier')
+
+
+class Verifier(object):
+    def __init__(self, options):
+        self.options = options
+        self.cache = ImageCache(options)
+
+    @property
+    def max_bytes_per_second(self):
+        """Rate at which the verifier reads the cache, 0 means unlimited"""
+        return config.get_option(
+            self.options, 'image_cache_verifier_max_bytes_per_second',
+            type='int', default=10 * 1024 * 1024)
+
+    @property
+    def verify_interval(self):
+        """Number of seconds after which a cached image is verified again"""
+        return config.get_option(
+            self.options, 'image_cache_verify_interval',
+            type='int', default=7 * 24 * 60 * 60)
+
+    def run(self):
+        verified_before = time.time() - self.verify_interval
+        for image_id, checksum in self.cache.get_images_to_verify(
+                verified_before):
+            self.verify_image(image_id, checksum)
+
+    def verify_image(self, image_id, checksum):
+        """
+        Reads a cached image back and invalidates it if its data no longer
+        matches `checksum`
+
+        :retval True if the image is intact, False otherwise
+        """
+        path = self.cache.path_for_image(image_id)
+        max_bytes_per_second = self.max_bytes_per_second
+        md5 = hashlib.md5()
+        started = time.time()
+        read = 0
+        try:
+            with open(path, 'rb') as cache_file:
+                for chunk in utils.chunkiter(cache_file):
+                    md5.update(chunk)
+                    read += len(chunk)
+                    if max_bytes_per_second:
+                        # Sleep until we are back under the rate limit
+                        ahead = (float(read) / max_bytes_per_second -
+                                 (time.time() - started))
+                        if ahead > 0:
+                            time.sleep(ahead)
+        except (IOError, OSError), e:
+            if e.errno == errno.ENOENT:
+                logger.debug(_("image '%s' was removed from the cache "
+                             "before it could be verified"), image_id)
+                return False
+            # NOTE: Failing to read the data back, say because of a bad
+            # sector, is as much a corruption as a checksum mismatch
+            reason = _("failed to read the cached data: %s") % e
+            self.invalidate_image(image_id, reason)
+            return False
+
+        if md5.hexdigest() != checksum:
+            reason = _("checksum of the cached data %(actual)s doesn't match "
+                       "expected checksum %(checksum)s") % dict(
+                            actual=md5.hexdigest(), checksum=checksum)
+            self.invalidate_image(image_id, reason)
+            return False
+
+        logger.debug(_("verified cached image '%s'"), image_id)
+        self.cache.record_verified(image_id)
+        return True
+
+    def invalidate_image(self, image_id, reason):
+        """
+        Invalidates a corrupted cached image, or removes it from the cache
+        if even that fails
+        """
+        logger.error(_("invalidating cached image '%(image_id)s', "
+                       "%(reason)s"), locals())
+        try:
+            self.cache.invalidate(image_id, reason)
+        except (IOError, OSError):
+            logger.exception(_("failed to invalidate cached image '%s', "
+                               "removing it"), image_id)
+            self.cache.purge(image_id)
+
+
+def app_factory(global_config, **local_conf):
+    conf = global_config.copy()
+    conf.update(local_conf)
+    return Verifier(conf)
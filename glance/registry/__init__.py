@@ -21,12 +21,18 @@ Registry API
 
 import logging
 
+from glance.common import config
+from glance.registry import cache
 from glance.registry import client
 
 logger = logging.getLogger('glance.registry')
 
 
 def get_registry_client(options, cxt):
+    driver = config.get_option(options, 'registry_driver', default='http')
+    if driver == 'local':
+        return client.LocalRegistryClient(options, cxt)
+
     host = options['registry_host']
     port = int(options['registry_port'])
     return client.RegistryClient(host, port, auth_tok=cxt.auth_tok)
@@ -42,9 +48,24 @@ def get_images_detail(options, context, **kwargs):
     return c.get_images_detailed(**kwargs)
 
 
-def get_image_metadata(options, context, image_id):
+def get_images_count(options, context, **kwargs):
+    c = get_registry_client(options, context)
+    return c.get_images_count(**kwargs)
+
+
+def get_images_stats(options, context, **kwargs):
     c = get_registry_client(options, context)
-    return c.get_image(image_id)
+    return c.get_images_stats(**kwargs)
+
+
+def get_image_metadata(options, context, image_id):
+    metadata_cache = cache.get_metadata_cache(options)
+    image_meta = metadata_cache.get(context, image_id)
+    if image_meta is None:
+        c = get_registry_client(options, context)
+        image_meta = c.get_image(image_id)
+        metadata_cache.add(context, image_id, image_meta)
+    return image_meta
 
 
 def add_image_metadata(options, context, image_meta):
@@ -71,6 +92,7 @@ def update_image_metadata(options, context, image_id, image_meta,
 
     c = get_registry_client(options, context)
     new_image_meta = c.update_image(image_id, image_meta, purge_props)
+    cache.get_metadata_cache(options).invalidate(image_id)
 
     if options['debug']:
         logger.debug(_("Returned image metadata from call to "
@@ -83,7 +105,9 @@ def update_image_metadata(options, context, image_id, image_meta,
 def delete_image_metadata(options, context, image_id):
     logger.debug(_("Deleting image metadata for image %s..."), image_id)
     c = get_registry_client(options, context)
-    return c.delete_image(image_id)
+    result = c.delete_image(image_id)
+    cache.get_metadata_cache(options).invalidate(image_id)
+    return result
 
 
 def get_image_members(options, context, image_id):
@@ -98,17 +122,23 @@ def get_member_images(options, context, member_id):
 
 def replace_members(options, context, image_id, member_data):
     c = get_registry_client(options, context)
-    return c.replace_members(image_id, member_data)
+    result = c.replace_members(image_id, member_data)
+    cache.get_metadata_cache(options).invalidate(image_id)
+    return result
 
 
 def add_member(options, context, image_id, member_id, can_share=None):
     c = get_registry_client(options, context)
-    return c.add_member(image_id, member_id, can_share=can_share)
+    result = c.add_member(image_id, member_id, can_share=can_share)
+    cache.get_metadata_cache(options).invalidate(image_id)
+    return result
 
 
 def delete_member(options, context, image_id, member_id):
     c = get_registry_client(options, context)
-    return c.delete_member(image_id, member_id)
+    result = c.delete_member(image_id, member_id)
+    cache.get_metadata_cache(options).invalidate(image_id)
+    return result
 
 
 def _debug_print_metadata(image_meta):
@@ -0,0 +1,168 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2011 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+In-process cache of image metadata fetched from the registry
+"""
+
+import copy
+import logging
+import time
+
+import eventlet
+
+from glance.common import config
+from glance.common import notifier
+
+try:
+    from collections import OrderedDict
+except ImportError:
+    # NOTE: Python 2.6 predates collections.OrderedDict
+    from ordereddict import OrderedDict
+
+logger = logging.getLogger('glance.registry.cache')
+
+# Metadata cache shared by all requests in this process
+_metadata_cache = None
+
+
+class MetadataCache(object):
+    """
+    Bounded LRU cache of the metadata of active images, so that repeated
+    lookups of an image don't go to the registry every time.
+
+    An image may be visible to some requesters and not to others, so its
+    metadata is cached per visibility scope, see `get_scope`. Entries
+    expire `ttl` seconds after they were fetched, which bounds how long
+    changes made through other API nodes go unnoticed.
+
+    A `max_size` of 0 disables the cache.
+    """
+
+    def __init__(self, max_size, ttl):
+        """
+        :param max_size: Maximum number of images to hold metadata for
+        :param ttl: Number of seconds cached metadata stays valid
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        # image_id -> {scope: (expires, image_meta)}, least recently used
+        # image first
+        self.images = OrderedDict()
+
+    @property
+    def enabled(self):
+        return self.max_size > 0
+
+    @staticmethod
+    def get_scope(context):
+        """Returns the visibility scope of a request context"""
+        return context.is_admin, context.owner
+
+    def get(self, context, image_id):
+        """Returns the metadata of an image, or None if it isn't cached"""
+        scopes = self.images.pop(str(image_id), None)
+        if scopes is None:
+            return None
+        self.images[str(image_id)] = scopes
+
+        expires, image_meta = scopes.get(self.get_scope(context),
+                                         (None, None))
+        if expires is None or expires < time.time():
+            return None
+        return copy.deepcopy(image_meta)
+
+    def add(self, context, image_id, image_meta):
+        """
+        Holds the metadata of an image, evicting the least recently used
+        images to make room for it. Only active images are held, as the
+        others are about to change.
+        """
+        if not self.enabled or image_meta.get('status') != 'active':
+            return
+
+        scopes = self.images.pop(str(image_id), {})
+        while len(self.images) >= self.max_size:
+            self.images.popitem(last=False)
+
+        scopes[self.get_scope(context)] = (time.time() + self.ttl,
+                                           copy.deepcopy(image_meta))
+        self.images[str(image_id)] = scopes
+
+    def invalidate(self, image_id):
+        """Drops the metadata of an image for all scopes"""
+        if self.images.pop(str(image_id), None) is not None:
+            logger.debug(_("invalidated cached metadata of image %s"),
+                         image_id)
+
+    def clear(self):
+        self.images.clear()
+
+
+def get_metadata_cache(options):
+    """Returns the metadata cache of this process"""
+    global _metadata_cache
+    if _metadata_cache is None:
+        max_size = config.get_option(options, 'registry_cache_max_size',
+                                     type='int', default=0)
+        ttl = config.get_option(options, 'registry_cache_ttl',
+                                type='int', default=10)
+        _metadata_cache = MetadataCache(max_size, ttl)
+
+        if _metadata_cache.enabled and config.get_option(
+                options, 'registry_cache_notification_invalidation',
+                type='bool', default=False):
+            eventlet.spawn_n(listen_for_notifications, options)
+    return _metadata_cache
+
+
+def invalidate_from_notification(message):
+    """
+    Invalidation hook for notifications about image changes, such as
+    those sent by `glance.common.notifier.Notifier`, so that the changes
+    other API nodes make to an image drop it from the cache
+
+    :param message: Notification message, see
+                    `glance.common.notifier.Notifier.generate_message`
+    """
+    if _metadata_cache is None:
+        return
+    if message.get('event_type') not in ('image.update', 'image.upload',
+                                         'image.delete'):
+        return
+
+    payload = message.get('payload')
+    if isinstance(payload, dict):
+        image_id = payload.get('id')
+    else:
+        image_id = payload
+    if image_id is not None:
+        _metadata_cache.invalidate(image_id)
+
+
+def listen_for_notifications(options):
+    """
+    Feeds the notifications sent through the rabbit notifier strategy to
+    `invalidate_from_notification`, until the connection to the broker is
+    lost
+    """
+    try:
+        strategy = notifier.RabbitStrategy(options)
+        strategy.consume('INFO', invalidate_from_notification)
+    except Exception:
+        logger.exception(_("stopped invalidating cached image metadata "
+                           "from notifications"))
@@ -20,10 +20,17 @@ Simple client class to speak with any RESTful service that implements
 the Glance Registry API
 """
 
+import copy
+import datetime
 import json
 import urllib
 
+import webob
+import webob.exc
+
 from glance.common.client import BaseClient
+from glance.common import exception
+from glance.registry import context as rcontext
 from glance.registry import server
 
 
@@ -75,6 +82,41 @@ class RegistryClient(BaseClient):
         data = json.loads(res.read())['images']
         return data
 
+    def get_images_meta(self, image_ids):
+        """
+        Returns a list of detailed image data mappings from Registry for
+        the images with the given ids, all fetched in a single request.
+        Images that don't exist or aren't visible are left out.
+
+        :param image_ids: ids of the images to get
+        """
+        return _get_images_meta(self, image_ids)
+
+    def get_images_count(self, **kwargs):
+        """
+        Returns the number of images in Registry matching the filters
+
+        :param filters: dict of keys & expected values to filter results
+        """
+        params = self._extract_params(kwargs, ())
+        res = self.do_request("GET", "/images/count", params=params)
+        data = json.loads(res.read())['count']
+        return data
+
+    def get_images_stats(self, **kwargs):
+        """
+        Returns a list of mappings of the number and total size of the
+        images in Registry matching the filters
+
+        :param filters: dict of keys & expected values to filter results
+        :param group_by: image attribute the images are counted per value
+                         of, if any
+        """
+        params = self._extract_params(kwargs, ('group_by',))
+        res = self.do_request("GET", "/images/stats", params=params)
+        data = json.loads(res.read())['stats']
+        return data
+
     def get_image(self, image_id):
         """Returns a mapping of image metadata from Registry"""
         res = self.do_request("GET", "/images/%s" % image_id)
@@ -170,3 +212,216 @@ class RegistryClient(BaseClient):
         res = self.do_request("DELETE", "/images/%s/members/%s" %
                               (image_id, member_id))
         return res.status == 204
+
+
+class LocalRegistryClient(object):
+
+    """
+    A client calling the Registry's controller in-process, for API servers
+    with direct access to the registry database. It applies the same
+    visibility rules as the Registry server, without the HTTP round-trip
+    and the JSON encoding on both sides of every call.
+    """
+
+    def __init__(self, options, context):
+        """
+        Creates a new in-process client to the registry database.
+
+        :param options: Mapping of configuration options, holding the
+                        `sql_connection` of the registry database
+        :param context: The context of the request being served
+        """
+        self.controller = server.Controller(options)
+        self.context = rcontext.RequestContext(
+                auth_tok=context.auth_tok,
+                user=context.user,
+                tenant=context.tenant,
+                is_admin=context.is_admin,
+                read_only=context.read_only,
+                show_deleted=context.show_deleted,
+                owner_is_tenant=context.owner_is_tenant)
+
+    def _call(self, action, params=None, headers=None, **kwargs):
+        """
+        Calls an action of the Registry's controller and returns its
+        result. Handles converting HTTP errors of the controller to
+        OpenStack/Glance exceptions, just like `BaseClient.do_request`.
+        """
+        query = ''
+        if params:
+            query = '?' + urllib.urlencode(params)
+        req = webob.Request.blank('/' + query, headers=headers)
+        req.context = self.context
+
+        try:
+            result = getattr(self.controller, action)(req, **kwargs)
+        except webob.exc.HTTPException, e:
+            result = e
+
+        if not isinstance(result, webob.exc.HTTPException):
+            return _to_primitive(result)
+
+        status_code = result.status_int
+        if status_code < 400:
+            return result
+        elif status_code in (401, 403):
+            raise exception.NotAuthorized(str(result))
+        elif status_code == 404:
+            raise exception.NotFound(str(result))
+        elif status_code == 409:
+            raise exception.Duplicate(str(result))
+        elif status_code == 400:
+            raise exception.Invalid(str(result))
+        else:
+            raise Exception("Unknown error occurred! %s" % result)
+
+    def _get_params(self, kwargs, allowed_params=server.SUPPORTED_PARAMS):
+        params = dict(kwargs.get('filters') or {})
+        for param in allowed_params:
+            if param in kwargs and kwargs[param] is not None:
+                params[param] = kwargs[param]
+        return params
+
+    def get_images(self, **kwargs):
+        """
+        Returns a list of image id/name mappings from Registry
+
+        :param filters: dict of keys & expected values to filter results
+        :param marker: image id after which to start page
+        :param limit: max number of images to return
+        :param sort_key: results will be ordered by this image attribute
+        :param sort_dir: direction in which to to order results (asc, desc)
+        """
+        return self._call('index', self._get_params(kwargs))['images']
+
+    def get_images_detailed(self, **kwargs):
+        """
+        Returns a list of detailed image data mappings from Registry
+
+        :param filters: dict of keys & expected values to filter results
+        :param marker: image id after which to start page
+        :param limit: max number of images to return
+        :param sort_key: results will be ordered by this image attribute
+        :param sort_dir: direction in which to to order results (asc, desc)
+        """
+        return self._call('detail', self._get_params(kwargs))['images']
+
+    def get_images_meta(self, image_ids):
+        """
+        Returns a list of detailed image data mappings from Registry for
+        the images with the given ids. Images that don't exist or aren't
+        visible are left out.
+
+        :param image_ids: ids of the images to get
+        """
+        return _get_images_meta(self, image_ids)
+
+    def get_images_count(self, **kwargs):
+        """
+        Returns the number of images in Registry matching the filters
+
+        :param filters: dict of keys & expected values to filter results
+        """
+        return self._call('count', self._get_params(kwargs, ()))['count']
+
+    def get_images_stats(self, **kwargs):
+        """
+        Returns a list of mappings of the number and total size of the
+        images in Registry matching the filters
+
+        :param filters: dict of keys & expected values to filter results
+        :param group_by: image attribute the images are counted per value
+                         of, if any
+        """
+        params = self._get_params(kwargs, ('group_by',))
+        return self._call('stats', params)['stats']
+
+    def get_image(self, image_id):
+        """Returns a mapping of image metadata from Registry"""
+        return self._call('show', id=image_id)['image']
+
+    def add_image(self, image_metadata):
+        """
+        Tells registry about an image's metadata
+        """
+        if 'image' not in image_metadata.keys():
+            image_metadata = dict(image=image_metadata)
+        body = copy.deepcopy(image_metadata)
+        return self._call('create', body=body)['image']
+
+    def update_image(self, image_id, image_metadata, purge_props=False):
+        """
+        Updates Registry's information about an image
+        """
+        if 'image' not in image_metadata.keys():
+            image_metadata = dict(image=image_metadata)
+        body = copy.deepcopy(image_metadata)
+
+        headers = {}
+        if purge_props:
+            headers["X-Glance-Registry-Purge-Props"] = "true"
+
+        return self._call('update', headers=headers, id=image_id,
+                          body=body)['image']
+
+    def delete_image(self, image_id):
+        """
+        Deletes Registry's information about an image
+        """
+        self._call('delete', id=image_id)
+        return True
+
+    def get_image_members(self, image_id):
+        """Returns a list of membership associations from Registry"""
+        return self._call('members', image_id=image_id)['members']
+
+    def get_member_images(self, member_id):
+        """Returns a list of membership associations from Registry"""
+        return self._call('shared_images', member=member_id)['shared_images']
+
+    def replace_members(self, image_id, member_data):
+        """Replaces Registry's information about image membership"""
+        if 'memberships' not in member_data.keys():
+            member_data = dict(memberships=[member_data])
+
+        res = self._call('replace_members', image_id=image_id,
+                         body=member_data)
+        return res.status_int == 204
+
+    def add_member(self, image_id, member_id, can_share=None):
+        """Adds to Registry's information about image membership"""
+        body = None
+        if can_share is not None:
+            body = dict(member=dict(can_share=can_share))
+
+        res = self._call('add_member', image_id=image_id, member=member_id,
+                         body=body)
+        return res.status_int == 204
+
+    def delete_member(self, image_id, member_id):
+        """Deletes Registry's information about image membership"""
+        res = self._call('delete_member', image_id=image_id,
+                         member=member_id)
+        return res.status_int == 204
+
+
+def _get_images_meta(client, image_ids):
+    """Gets the detailed image data of many images with one request"""
+    if not image_ids:
+        return []
+    filters = {'id': ','.join(str(image_id) for image_id in image_ids)}
+    return client.get_images_detailed(filters=filters)
+
+
+def _to_primitive(value):
+    """
+    Converts the datetimes in a result of the Registry's controller to
+    strings, just like they arrive from the Registry server
+    """
+    if isinstance(value, dict):
+        return dict((k, _to_primitive(v)) for k, v in value.iteritems())
+    if isinstance(value, list):
+        return [_to_primitive(v) for v in value]
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    return value
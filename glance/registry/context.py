@@ -27,8 +27,14 @@ class RequestContext(context.RequestContext):
     Also provides tests for image visibility and sharability.
     """
 
-    def is_image_visible(self, image):
-        """Return True if the image is visible in this context."""
+    def is_image_visible(self, image, **kwargs):
+        """
+        Return True if the image is visible in this context.
+
+        The membership association of the image with the owner of this
+        context, or None, may be passed as the `membership` keyword
+        argument when already known, to save looking it up.
+        """
         # Is admin == image visible
         if self.is_admin:
             return True
@@ -47,11 +53,15 @@ class RequestContext(context.RequestContext):
                 return True
 
             # Figure out if this image is shared with that tenant
-            try:
-                db_api.image_member_find(self, image.id, self.owner)
-                return True
-            except exception.NotFound:
-                pass
+            if 'membership' in kwargs:
+                if kwargs['membership'] is not None:
+                    return True
+            else:
+                try:
+                    db_api.image_member_find(self, image.id, self.owner)
+                    return True
+                except exception.NotFound:
+                    pass
 
         # Private image
         return False
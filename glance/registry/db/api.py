@@ -22,14 +22,17 @@ Defines interface for DB access
 """
 
 import logging
+import os
 
 from sqlalchemy import asc, create_engine, desc
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import exc
+from sqlalchemy.orm import aliased
 from sqlalchemy.orm import joinedload
+from sqlalchemy.orm.attributes import set_committed_value
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy.sql import or_, and_
+from sqlalchemy.sql import or_, and_, func
 
 from glance.common import config
 from glance.common import exception
@@ -37,6 +40,7 @@ from glance.common import utils
 from glance.registry.db import models
 
 _ENGINE = None
+_ENGINE_PID = None
 _MAKER = None
 BASE = models.BASE
 
@@ -55,6 +59,10 @@ DISK_FORMATS = ['ami', 'ari', 'aki', 'vhd', 'vmdk', 'raw', 'qcow2', 'vdi',
 STATUSES = ['active', 'saving', 'queued', 'killed', 'pending_delete',
             'deleted']
 
+# Images a property filter may match for the property to be joined to the
+# images rather than checked image by image, see _filter_by_properties
+PROPERTY_JOIN_MAX_MATCHES = 10000
+
 
 def configure_db(options):
     """
@@ -63,7 +71,7 @@ def configure_db(options):
 
     :param options: Mapping of configuration options
     """
-    global _ENGINE
+    global _ENGINE, _ENGINE_PID
     if not _ENGINE:
         debug = config.get_option(
             options, 'debug', type='bool', default=False)
@@ -73,6 +81,7 @@ def configure_db(options):
             options, 'sql_idle_timeout', type='int', default=3600)
         _ENGINE = create_engine(options['sql_connection'],
                                 pool_recycle=timeout)
+        _ENGINE_PID = os.getpid()
         logger = logging.getLogger('sqlalchemy.engine')
         if debug:
             logger.setLevel(logging.DEBUG)
@@ -84,7 +93,12 @@ def configure_db(options):
 
 def get_session(autocommit=True, expire_on_commit=False):
     """Helper method to grab session"""
-    global _MAKER, _ENGINE
+    global _MAKER, _ENGINE, _ENGINE_PID
+    if _ENGINE and _ENGINE_PID != os.getpid():
+        # NOTE: A worker process forked by the server must not share the
+        # pooled connections of its parent, it opens its own instead
+        _ENGINE.dispose()
+        _ENGINE_PID = os.getpid()
     if not _MAKER:
         assert _ENGINE
         _MAKER = sessionmaker(bind=_ENGINE,
@@ -131,23 +145,37 @@ def image_get(context, image_id, session=None):
     except (TypeError, ValueError):
         raise exception.NotFound("No image found")
 
+    # NOTE: The membership of the requester is fetched along with the
+    # image, so checking the visibility of the image takes no other query
+    query = session.query(models.Image, models.ImageMember).\
+                   options(joinedload(models.Image.properties)).\
+                   options(joinedload(models.Image.members)).\
+                   outerjoin((models.ImageMember,
+                              _owner_membership(context))).\
+                   filter(models.Image.deleted == _deleted(context)).\
+                   filter(models.Image.id == image_id)
     try:
-        image = session.query(models.Image).\
-                       options(joinedload(models.Image.properties)).\
-                       options(joinedload(models.Image.members)).\
-                       filter_by(deleted=_deleted(context)).\
-                       filter_by(id=image_id).\
-                       one()
+        image, membership = query.one()
     except exc.NoResultFound:
         raise exception.NotFound("No image found with ID %s" % image_id)
 
     # Make sure they can look at it
-    if not context.is_image_visible(image):
+    if not context.is_image_visible(image, membership=membership):
         raise exception.NotAuthorized("Image not visible to you")
 
     return image
 
 
+def _owner_membership(context):
+    """
+    Returns the join condition of images to the memberships of the owner
+    of the context, so that visibility is decided within the query
+    """
+    return and_(models.ImageMember.image_id == models.Image.id,
+                models.ImageMember.member == context.owner,
+                models.ImageMember.deleted == _deleted(context))
+
+
 def image_get_all_pending_delete(context, delete_time=None, limit=None):
     """Get all images that are pending deletion
 
@@ -173,26 +201,30 @@ def image_get_all_pending_delete(context, delete_time=None, limit=None):
 
 
 def image_get_all(context, filters=None, marker=None, limit=None,
-                  sort_key='created_at', sort_dir='desc'):
+                  sort_key='created_at', sort_dir='desc',
+                  load_properties=True, load_members=True):
     """
     Get all images that match zero or more filters.
 
+    The page of images is selected first, and the properties and members
+    of its images are then loaded with one query each, rather than joined
+    to the images, which would multiply the rows fetched for the page.
+
     :param filters: dict of filter keys and values. If a 'properties'
                     key is present, it is treated as a dict of key/value
-                    filters on the image properties attribute
+                    filters on the image properties attribute. If an 'id'
+                    key is present, it is treated as a list of the ids of
+                    the images to get
     :param marker: image id after which to start page
     :param limit: maximum number of images to return
     :param sort_key: image attribute by which results should be sorted
     :param sort_dir: direction in which results should be sorted (asc, desc)
+    :param load_properties: whether to load the properties of the images
+    :param load_members: whether to load the members of the images
     """
-    filters = filters or {}
-
     session = get_session()
-    query = session.query(models.Image).\
-                   options(joinedload(models.Image.properties)).\
-                   options(joinedload(models.Image.members)).\
-                   filter_by(deleted=_deleted(context)).\
-                   filter(models.Image.status != 'killed')
+    query = _filter_images(context, session, session.query(models.Image),
+                           filters or {})
 
     sort_dir_func = {
         'asc': asc,
@@ -204,6 +236,93 @@ def image_get_all(context, filters=None, marker=None, limit=None,
     query = query.order_by(sort_dir_func(sort_key_attr)).\
                   order_by(sort_dir_func(models.Image.id))
 
+    if marker != None:
+        # images returned should be created before the image defined by marker
+        marker_image = image_get(context, marker)
+        marker_value = getattr(marker_image, sort_key)
+        if sort_dir == 'desc':
+            query = query.filter(
+                or_(sort_key_attr < marker_value,
+                    and_(sort_key_attr == marker_value,
+                         models.Image.id < marker)))
+        else:
+            query = query.filter(
+                or_(sort_key_attr > marker_value,
+                    and_(sort_key_attr == marker_value,
+                         models.Image.id > marker)))
+
+    if limit != None:
+        query = query.limit(limit)
+
+    images = query.all()
+    if load_properties:
+        _load_image_collection(session, images, models.ImageProperty,
+                               'properties')
+    if load_members:
+        _load_image_collection(session, images, models.ImageMember,
+                               'members')
+    return images
+
+
+def image_count(context, filters=None):
+    """
+    Count the images that match zero or more filters.
+
+    :param filters: dict of filter keys and values, see `image_get_all`
+    """
+    session = get_session()
+    query = session.query(func.count(models.Image.id))
+    return _filter_images(context, session, query, filters or {}).scalar()
+
+
+def image_stats(context, filters=None, group_by=None):
+    """
+    Count the images that match zero or more filters and sum their sizes,
+    overall or per value of an image attribute.
+
+    :param filters: dict of filter keys and values, see `image_get_all`
+    :param group_by: image attribute whose values the images are counted
+                     per, or None to count all the images together
+    :retval a list of mappings of the form::
+
+        {'count': <COUNT>, 'size': <SIZE>}
+
+    with the value of the `group_by` attribute under its name, ordered by
+    that value.
+    """
+    columns = [func.count(models.Image.id), func.sum(models.Image.size)]
+    if group_by is not None:
+        group_by_attr = getattr(models.Image, group_by)
+        columns.insert(0, group_by_attr)
+
+    session = get_session()
+    query = _filter_images(context, session, session.query(*columns),
+                           filters or {})
+    if group_by is not None:
+        query = query.group_by(group_by_attr).order_by(group_by_attr)
+
+    stats = []
+    for row in query.all():
+        if group_by is not None:
+            value, count, size = row
+            stat = {group_by: value}
+        else:
+            count, size = row
+            stat = {}
+        stat.update(count=count, size=int(size or 0))
+        stats.append(stat)
+    return stats
+
+
+def _filter_images(context, session, query, filters):
+    """
+    Restricts a query on the images to the non-deleted, non-killed images
+    matching the filters of `image_get_all`, popping the filters applied
+    off `filters`
+    """
+    query = query.filter(models.Image.deleted == _deleted(context)).\
+                  filter(models.Image.status != 'killed')
+
     if 'size_min' in filters:
         query = query.filter(models.Image.size >= filters['size_min'])
         del filters['size_min']
@@ -215,40 +334,97 @@ def image_get_all(context, filters=None, marker=None, limit=None,
     if 'is_public' in filters and filters['is_public'] is not None:
         the_filter = [models.Image.is_public == filters['is_public']]
         if filters['is_public'] and context.owner is not None:
+            # NOTE: The images shared with the owner are selected once for
+            # the whole query, rather than checked image by image
+            shared = session.query(models.ImageMember.image_id).\
+                            filter_by(member=context.owner).\
+                            filter_by(deleted=_deleted(context))
             the_filter.extend([(models.Image.owner == context.owner),
-                               models.Image.members.any(member=context.owner)])
+                               models.Image.id.in_(shared.subquery())])
         if len(the_filter) > 1:
             query = query.filter(or_(*the_filter))
         else:
             query = query.filter(the_filter[0])
         del filters['is_public']
 
-    for (k, v) in filters.pop('properties', {}).items():
-        query = query.filter(models.Image.properties.any(name=k, value=v))
+    if 'id' in filters:
+        query = query.filter(models.Image.id.in_(filters.pop('id')))
+
+    query = _filter_by_properties(session, query,
+                                  filters.pop('properties', {}))
 
     for (k, v) in filters.items():
         if v is not None:
             query = query.filter(getattr(models.Image, k) == v)
 
-    if marker != None:
-        # images returned should be created before the image defined by marker
-        marker_image = image_get(context, marker)
-        marker_value = getattr(marker_image, sort_key)
-        if sort_dir == 'desc':
-            query = query.filter(
-                or_(sort_key_attr < marker_value,
-                    and_(sort_key_attr == marker_value,
-                         models.Image.id < marker)))
+    return query
+
+
+def _filter_by_properties(session, query, properties):
+    """
+    Restricts a query of images to those having all of the given properties.
+
+    The properties are looked up by name and hash of their value, which is
+    indexed, see `glance.registry.db.models.hash_property_value`. When one
+    of the properties is rare enough, it is joined to the images, so that
+    the images having it are fetched through the index rather than found by
+    scanning the images in sort order, and the other properties are checked
+    image by image. A property shared by many images is cheaper to check
+    image by image, as the scan soon finds a page of images having it.
+
+    :param session: session the query runs in
+    :param query: query of images to restrict
+    :param properties: dict of property names and values to filter on
+    """
+    hashes = dict((name, models.hash_property_value(value))
+                  for (name, value) in properties.items())
+
+    rarest = None
+    rarest_matches = PROPERTY_JOIN_MAX_MATCHES
+    for name in properties:
+        matches = _count_property_matches(session, name, hashes[name])
+        if matches < rarest_matches:
+            rarest, rarest_matches = name, matches
+
+    for (name, value) in properties.items():
+        if name == rarest:
+            prop = aliased(models.ImageProperty)
+            query = query.join((prop, and_(prop.image_id == models.Image.id,
+                                           prop.name == name,
+                                           prop.value_hash == hashes[name],
+                                           prop.value == value)))
         else:
-            query = query.filter(
-                or_(sort_key_attr > marker_value,
-                    and_(sort_key_attr == marker_value,
-                         models.Image.id > marker)))
+            query = query.filter(models.Image.properties.any(
+                name=name, value_hash=hashes[name], value=value))
+    return query
 
-    if limit != None:
-        query = query.limit(limit)
 
-    return query.all()
+def _count_property_matches(session, name, value_hash):
+    """
+    Returns the number of image properties with a name and value hash, up
+    to PROPERTY_JOIN_MAX_MATCHES, counting index entries only
+    """
+    matches = session.query(models.ImageProperty.image_id).\
+                      filter_by(name=name).\
+                      filter_by(value_hash=value_hash).\
+                      limit(PROPERTY_JOIN_MAX_MATCHES).\
+                      subquery()
+    return session.query(func.count('*')).select_from(matches).scalar()
+
+
+def _load_image_collection(session, images, model, attr):
+    """
+    Loads a collection of related rows, such as the properties, of all the
+    images with a single `IN` query
+    """
+    rows = dict((image.id, []) for image in images)
+    if rows:
+        query = session.query(model).filter(model.image_id.in_(rows.keys()))
+        for row in query:
+            rows[row.image_id].append(row)
+
+    for image in images:
+        set_committed_value(image, attr, rows[image.id])
 
 
 def _drop_protected_attrs(model_class, values):
@@ -0,0 +1,96 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2011 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from migrate.changeset import *
+from sqlalchemy import *
+
+from glance.registry.db.migrate_repo.schema import from_migration_import
+
+
+def get_images_table(meta):
+    """
+    No changes to the images table from 008...
+    """
+    (get_images_table,) = from_migration_import(
+        '008_add_image_members_table', ['get_images_table'])
+
+    images = get_images_table(meta)
+    return images
+
+
+def get_image_properties_table(meta):
+    """
+    No changes to the image properties table from 008...
+    """
+    (get_image_properties_table,) = from_migration_import(
+        '008_add_image_members_table', ['get_image_properties_table'])
+
+    image_properties = get_image_properties_table(meta)
+    return image_properties
+
+
+def get_image_members_table(meta):
+    """
+    No changes to the image members table from 008...
+    """
+    (get_image_members_table,) = from_migration_import(
+        '008_add_image_members_table', ['get_image_members_table'])
+
+    image_members = get_image_members_table(meta)
+    return image_members
+
+
+def get_indexes(meta):
+    """
+    Returns the indexes serving the image listings: every listing filters
+    on `deleted` and is ordered by one of the sort keys, then `id`, so
+    there is one index per sort key that also serves equality filters on
+    that key. The properties and members of the images listed are looked
+    up by image and member.
+    """
+    images = get_images_table(meta)
+    image_properties = get_image_properties_table(meta)
+    image_members = get_image_members_table(meta)
+
+    indexes = []
+    for key in ('created_at', 'updated_at', 'name', 'status', 'disk_format',
+                'container_format', 'size'):
+        indexes.append(Index('ix_images_deleted_%s' % key,
+                             images.c.deleted, images.c[key], images.c.id))
+    indexes.extend([
+        Index('ix_images_deleted_is_public', images.c.deleted,
+              images.c.is_public),
+        Index('ix_images_deleted_owner', images.c.deleted, images.c.owner),
+        Index('ix_image_properties_image_id_deleted',
+              image_properties.c.image_id, image_properties.c.deleted),
+        Index('ix_image_members_member_deleted', image_members.c.member,
+              image_members.c.deleted)])
+    return indexes
+
+
+def upgrade(migrate_engine):
+    meta = MetaData()
+    meta.bind = migrate_engine
+    for index in get_indexes(meta):
+        index.create(migrate_engine)
+
+
+def downgrade(migrate_engine):
+    meta = MetaData()
+    meta.bind = migrate_engine
+    for index in get_indexes(meta):
+        index.drop(migrate_engine)
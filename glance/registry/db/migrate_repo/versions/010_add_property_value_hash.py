@@ -0,0 +1,182 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2011 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+import hashlib
+
+from migrate.changeset import *
+from sqlalchemy import *
+
+from glance.registry.db.migrate_repo.schema import (
+    Boolean, DateTime, Integer, String, Text, from_migration_import)
+
+
+def get_images_table(meta):
+    """
+    No changes to the images table from 009...
+    """
+    (get_images_table,) = from_migration_import(
+        '009_add_listing_indexes', ['get_images_table'])
+
+    images = get_images_table(meta)
+    return images
+
+
+def get_image_properties_table(meta):
+    """
+    Returns the Table object for the image_properties table that
+    corresponds to the image_properties table definition of this version.
+    """
+    images = get_images_table(meta)
+
+    image_properties = Table('image_properties', meta,
+        Column('id', Integer(), primary_key=True, nullable=False),
+        Column('image_id', Integer(), ForeignKey('images.id'), nullable=False,
+               index=True),
+        Column('name', String(255), nullable=False),
+        Column('value', Text()),
+        Column('value_hash', String(32)),
+        Column('created_at', DateTime(), nullable=False),
+        Column('updated_at', DateTime()),
+        Column('deleted_at', DateTime()),
+        Column('deleted', Boolean(), nullable=False, default=False,
+               index=True),
+        UniqueConstraint('image_id', 'name'),
+        mysql_engine='InnoDB',
+        useexisting=True)
+
+    return image_properties
+
+
+def get_image_members_table(meta):
+    """
+    No changes to the image members table from 009...
+    """
+    (get_image_members_table,) = from_migration_import(
+        '009_add_listing_indexes', ['get_image_members_table'])
+
+    image_members = get_image_members_table(meta)
+    return image_members
+
+
+def get_index(meta):
+    """
+    Returns the index serving the property filters of the image listings,
+    which look properties up by name and hash of their value
+    """
+    image_properties = get_image_properties_table(meta)
+    return Index('ix_image_properties_name_value_hash',
+                 image_properties.c.name, image_properties.c.value_hash,
+                 image_properties.c.image_id)
+
+
+def hash_value(value):
+    """Same as `glance.registry.db.models.hash_property_value`"""
+    if value is None:
+        return None
+    if isinstance(value, unicode):
+        value = value.encode('utf-8')
+    return hashlib.md5(str(value)).hexdigest()
+
+
+def upgrade(migrate_engine):
+    meta = MetaData()
+    meta.bind = migrate_engine
+
+    image_properties = get_image_properties_table(meta)
+
+    value_hash = Column('value_hash', String(32))
+    value_hash.create(image_properties)
+
+    conn = migrate_engine.connect()
+    sel = select([image_properties.c.id, image_properties.c.value])
+    hashes = [{'prop_id': id, 'prop_value_hash': hash_value(value)}
+              for id, value in conn.execute(sel).fetchall()]
+    if hashes:
+        updater = image_properties.update().\
+            where(image_properties.c.id == bindparam('prop_id')).\
+            values(value_hash=bindparam('prop_value_hash'))
+        trans = conn.begin()
+        conn.execute(updater, hashes)
+        trans.commit()
+    conn.close()
+
+    get_index(meta).create(migrate_engine)
+
+
+def downgrade(migrate_engine):
+    meta = MetaData()
+    meta.bind = migrate_engine
+
+    get_index(meta).drop(migrate_engine)
+
+    if migrate_engine.name == 'sqlite':
+        downgrade_sqlite(migrate_engine)
+        return
+
+    image_properties = get_image_properties_table(meta)
+    image_properties.columns['value_hash'].drop()
+
+
+def downgrade_sqlite(migrate_engine):
+    """
+    SQLite does not support ALTER TABLE DROP COLUMN, so the table is
+    copied into one without the column. The indexes of the table go with
+    it, so they are read off the schema beforehand and created again
+    as they were, whichever indexes the database had.
+    """
+    columns = ('id, image_id, name, value, created_at, updated_at, '
+               'deleted_at, deleted')
+    conn = migrate_engine.connect()
+    trans = conn.begin()
+    indexes = [row[0] for row in conn.execute(
+        "SELECT sql FROM sqlite_master WHERE type = 'index' "
+        "AND tbl_name = 'image_properties' AND sql IS NOT NULL")]
+
+    conn.execute("""CREATE TEMPORARY TABLE image_properties_backup (
+        id INTEGER NOT NULL,
+        image_id INTEGER NOT NULL,
+        name VARCHAR(255) NOT NULL,
+        value TEXT,
+        created_at DATETIME NOT NULL,
+        updated_at DATETIME,
+        deleted_at DATETIME,
+        deleted BOOLEAN NOT NULL,
+        PRIMARY KEY (id))""")
+    conn.execute("INSERT INTO image_properties_backup SELECT %s "
+                 "FROM image_properties" % columns)
+    conn.execute("DROP TABLE image_properties")
+
+    conn.execute("""CREATE TABLE image_properties (
+        id INTEGER NOT NULL,
+        image_id INTEGER NOT NULL,
+        name VARCHAR(255) NOT NULL,
+        value TEXT,
+        created_at DATETIME NOT NULL,
+        updated_at DATETIME,
+        deleted_at DATETIME,
+        deleted BOOLEAN NOT NULL,
+        PRIMARY KEY (id),
+        CHECK (deleted IN (0, 1)),
+        UNIQUE (image_id, name),
+        FOREIGN KEY(image_id) REFERENCES images (id))""")
+    for index in indexes:
+        conn.execute(index)
+
+    conn.execute("INSERT INTO image_properties SELECT %s "
+                 "FROM image_properties_backup" % columns)
+    conn.execute("DROP TABLE image_properties_backup")
+    trans.commit()
+    conn.close()
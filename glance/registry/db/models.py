@@ -22,11 +22,12 @@ SQLAlchemy models for glance data
 
 import sys
 import datetime
+import hashlib
 
 from sqlalchemy.orm import relationship, backref, exc, object_mapper, validates
 from sqlalchemy import Column, Integer, String, BigInteger
 from sqlalchemy import ForeignKey, DateTime, Boolean, Text
-from sqlalchemy import UniqueConstraint
+from sqlalchemy import Index, UniqueConstraint
 from sqlalchemy.ext.declarative import declarative_base
 
 import glance.registry.db.api
@@ -119,6 +120,12 @@ class ImageProperty(BASE, ModelBase):
 
     name = Column(String(255), index=True, nullable=False)
     value = Column(Text)
+    value_hash = Column(String(32))
+
+    @validates('value')
+    def validate_value(self, key, value):
+        self.value_hash = hash_property_value(value)
+        return value
 
 
 class ImageMember(BASE, ModelBase):
@@ -134,6 +141,48 @@ class ImageMember(BASE, ModelBase):
     can_share = Column(Boolean, nullable=False, default=False)
 
 
+def _add_listing_indexes():
+    """
+    Adds the indexes serving the image listings to the tables, kept in sync
+    with the 009_add_listing_indexes migration
+    """
+    images = Image.__table__
+    for key in ('created_at', 'updated_at', 'name', 'status', 'disk_format',
+                'container_format', 'size'):
+        Index('ix_images_deleted_%s' % key, images.c.deleted, images.c[key],
+              images.c.id)
+    Index('ix_images_deleted_is_public', images.c.deleted,
+          images.c.is_public)
+    Index('ix_images_deleted_owner', images.c.deleted, images.c.owner)
+    Index('ix_image_properties_image_id_deleted',
+          ImageProperty.__table__.c.image_id,
+          ImageProperty.__table__.c.deleted)
+    Index('ix_image_members_member_deleted', ImageMember.__table__.c.member,
+          ImageMember.__table__.c.deleted)
+
+
+_add_listing_indexes()
+
+# NOTE: Index serving the property filters of the image listings, kept in
+# sync with the 010_add_property_value_hash migration
+Index('ix_image_properties_name_value_hash',
+      ImageProperty.__table__.c.name, ImageProperty.__table__.c.value_hash,
+      ImageProperty.__table__.c.image_id)
+
+
+def hash_property_value(value):
+    """
+    Returns the hash of an image property value, by which property filters
+    look properties up, as values are of unbounded length and can't be
+    indexed themselves
+    """
+    if value is None:
+        return None
+    if isinstance(value, unicode):
+        value = value.encode('utf-8')
+    return hashlib.md5(str(value)).hexdigest()
+
+
 def register_models(engine):
     """
     Creates database tables for all models with the given engine
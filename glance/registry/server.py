@@ -37,7 +37,7 @@ DISPLAY_FIELDS_IN_INDEX = ['id', 'name', 'size',
                            'checksum']
 
 SUPPORTED_FILTERS = ['name', 'status', 'container_format', 'disk_format',
-                     'size_min', 'size_max']
+                     'size_min', 'size_max', 'id']
 
 SUPPORTED_SORT_KEYS = ('name', 'status', 'container_format', 'disk_format',
                        'size', 'id', 'created_at', 'updated_at')
@@ -46,6 +46,9 @@ SUPPORTED_SORT_DIRS = ('asc', 'desc')
 
 SUPPORTED_PARAMS = ('limit', 'marker', 'sort_key', 'sort_dir')
 
+SUPPORTED_GROUP_BY = ('status', 'container_format', 'disk_format', 'owner',
+                      'is_public')
+
 
 class Controller(object):
     """Controller for the reference implementation registry server"""
@@ -59,7 +62,8 @@ class Controller(object):
         Get images, wrapping in exception if necessary.
         """
         try:
-            return db_api.image_get_all(context, **params)
+            return db_api.image_get_all(context, load_members=False,
+                                        **params)
         except exception.NotFound, e:
             msg = _("Invalid marker. Image could not be found.")
             raise exc.HTTPBadRequest(explanation=msg)
@@ -85,7 +89,8 @@ class Controller(object):
             }
         """
         params = self._get_query_params(req)
-        images = self._get_images(req.context, **params)
+        images = self._get_images(req.context, load_properties=False,
+                                  **params)
 
         results = []
         for image in images:
@@ -113,6 +118,45 @@ class Controller(object):
         image_dicts = [make_image_dict(i) for i in images]
         return dict(images=image_dicts)
 
+    def count(self, req):
+        """
+        Return the number of public, non-deleted images matching the
+        filters of a list of images
+
+        :param req: the Request object coming from the wsgi layer
+        :retval a mapping of the following form::
+
+            dict(count=<COUNT>)
+        """
+        return dict(count=db_api.image_count(req.context,
+                                             self._get_filters(req)))
+
+    def stats(self, req):
+        """
+        Return the number and total size of the public, non-deleted images
+        matching the filters of a list of images, either overall or per
+        value of the image attribute given by the group_by query param
+
+        :param req: the Request object coming from the wsgi layer
+        :retval a mapping of the following form::
+
+            dict(stats=[stats_list])
+
+        Where stats_list is a sequence of mappings::
+
+            {
+            '<GROUP_BY>': <VALUE>,
+            'count': <COUNT>,
+            'size': <SIZE>
+            }
+
+        with a single mapping without the `group_by` attribute if the
+        images aren't grouped.
+        """
+        stats = db_api.image_stats(req.context, self._get_filters(req),
+                                   self._get_group_by(req))
+        return dict(stats=stats)
+
     def _get_query_params(self, req):
         """
         Extract necessary query parameters from http request.
@@ -159,8 +203,25 @@ class Controller(object):
         if len(properties) > 0:
             filters['properties'] = properties
 
+        if 'id' in filters:
+            filters['id'] = self._get_ids(req)
+
         return filters
 
+    def _get_ids(self, req):
+        """Parse a comma-separated id query param into a list of ids."""
+        try:
+            ids = [int(id) for id in req.str_params['id'].split(',')]
+        except ValueError:
+            raise exc.HTTPBadRequest(_("id param must be a comma-separated "
+                                       "list of integers"))
+
+        if len(ids) > self._get_api_limit_max():
+            msg = _("Too many ids, at most %d images may be requested "
+                    "at once") % self._get_api_limit_max()
+            raise exc.HTTPBadRequest(explanation=msg)
+        return ids
+
     def _get_limit(self, req):
         """Parse a limit query param into something usable."""
         try:
@@ -172,6 +233,10 @@ class Controller(object):
                     "Defaulting to %s") % default
             logger.debug(msg)
 
+        if 'id' in req.str_params:
+            # NOTE: All the images asked for by id fit in one page
+            default = len(req.str_params['id'].split(','))
+
         try:
             limit = int(req.str_params.get('limit', default))
         except ValueError:
@@ -180,15 +245,18 @@ class Controller(object):
         if limit < 0:
             raise exc.HTTPBadRequest(_("limit param must be positive"))
 
+        return min(self._get_api_limit_max(), limit)
+
+    def _get_api_limit_max(self):
+        """Read the maximum page size from the config."""
         try:
-            api_limit_max = int(self.options['api_limit_max'])
+            return int(self.options['api_limit_max'])
         except (KeyError, ValueError):
             api_limit_max = 1000
             msg = _("Failed to read api_limit_max from config. "
                     "Defaulting to %s") % api_limit_max
             logger.debug(msg)
-
-        return min(api_limit_max, limit)
+            return api_limit_max
 
     def _get_marker(self, req):
         """Parse a marker query param into something usable."""
@@ -221,11 +289,24 @@ class Controller(object):
             raise exc.HTTPBadRequest(explanation=msg)
         return sort_dir
 
+    def _get_group_by(self, req):
+        """Parse a group_by query param from the request object."""
+        group_by = req.str_params.get('group_by', None)
+        if group_by is not None and group_by not in SUPPORTED_GROUP_BY:
+            _keys = ', '.join(SUPPORTED_GROUP_BY)
+            msg = _("Unsupported group_by. Acceptable values: %s") % (_keys,)
+            raise exc.HTTPBadRequest(explanation=msg)
+        return group_by
+
     def _get_is_public(self, req):
         """Parse is_public into something usable."""
         is_public = req.str_params.get('is_public', None)
 
         if is_public is None:
+            if 'id' in req.str_params:
+                # NOTE: Images asked for by id are returned whether public
+                #       or not, just like when asked for one at a time
+                return None
             # NOTE(vish): This preserves the default value of showing only
             #             public images.
             return True
@@ -616,7 +697,8 @@ class API(wsgi.Router):
         mapper = routes.Mapper()
         resource = create_resource(Controller(options))
         mapper.resource("image", "images", controller=resource,
-                        collection={'detail': 'GET'})
+                        collection={'detail': 'GET', 'count': 'GET',
+                                    'stats': 'GET'})
         mapper.connect("/", controller=resource, action="index")
         mapper.connect("/shared-images/{member}",
                        controller=resource, action="shared_images")
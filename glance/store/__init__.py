@@ -121,13 +121,20 @@ def get_store_from_uri(uri):
     return get_store_from_scheme(scheme)
 
 
-def get_from_backend(uri, **kwargs):
-    """Yields chunks of data from backend specified by uri"""
+def get_from_backend(uri, offset=0, length=None, **kwargs):
+    """
+    Yields chunks of data from backend specified by uri
+
+    :param uri: URI of the image data in the backend
+    :param offset: Byte offset to start reading the image data from
+    :param length: Number of bytes to read, or None to read until the
+                   end of the image data
+    """
 
     store = get_store_from_uri(uri)
     loc = location.get_location_from_uri(uri)
 
-    return store.get(loc)
+    return store.get(loc, offset=offset, length=length)
 
 
 def delete_from_backend(uri, **kwargs):
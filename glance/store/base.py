@@ -52,7 +52,7 @@ class Store(object):
         """
         pass
 
-    def get(self, location):
+    def get(self, location, offset=0, length=None):
         """
         Takes a `glance.store.location.Location` object that indicates
         where to find the image file, and returns a generator for reading
@@ -60,6 +60,9 @@ class Store(object):
 
         :param location `glance.store.location.Location` object, supplied
                         from glance.store.location.get_location_from_uri()
+        :param offset: Byte offset to start reading the image file from
+        :param length: Number of bytes to read, or None to read until the
+                       end of the image file
         :raises `glance.exception.NotFound` if image does not exist
         """
         raise NotImplementedError
@@ -98,3 +101,48 @@ class Store(object):
         :raises `glance.exception.NotFound` if image does not exist
         """
         raise NotImplementedError
+
+
+def get_range_headers(offset=0, length=None):
+    """
+    Returns a mapping of HTTP headers that request the byte range
+    described by `offset` and `length` from a remote server, or an
+    empty mapping if the whole object should be retrieved
+
+    :param offset: Byte offset of the first byte to retrieve
+    :param length: Number of bytes to retrieve, or None for all bytes
+                   following `offset`
+    """
+    if not offset and length is None:
+        return {}
+    if length is None:
+        return {'Range': 'bytes=%d-' % offset}
+    return {'Range': 'bytes=%d-%d' % (offset, offset + length - 1)}
+
+
+def get_range_from_chunks(chunks, offset=0, length=None):
+    """
+    Yields the byte range described by `offset` and `length` out of the
+    chunks of a whole object, for when a remote server can't be asked for
+    the range itself
+
+    :param chunks: Iterable over the chunks of data of the whole object
+    :param offset: Byte offset of the first byte to yield
+    :param length: Number of bytes to yield, or None for all bytes
+                   following `offset`
+    """
+    remaining = length
+    for chunk in chunks:
+        if offset >= len(chunk):
+            offset -= len(chunk)
+            continue
+        if offset:
+            chunk = chunk[offset:]
+            offset = 0
+        if remaining is not None:
+            chunk = chunk[:remaining]
+            remaining -= len(chunk)
+        if chunk:
+            yield chunk
+        if remaining == 0:
+            break
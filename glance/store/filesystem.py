@@ -28,6 +28,7 @@ from glance.common import exception
 import glance.store
 import glance.store.base
 import glance.store.location
+from glance import utils
 
 logger = logging.getLogger('glance.store.filesystem')
 
@@ -59,7 +60,7 @@ class StoreLocation(glance.store.location.StoreLocation):
         self.path = path
 
 
-class ChunkedFile(object):
+class ChunkedFile(utils.FileWrapper):
 
     """
     We send this back to the Glance API server as
@@ -68,27 +69,12 @@ class ChunkedFile(object):
 
     CHUNKSIZE = 65536
 
-    def __init__(self, filepath):
+    def __init__(self, filepath, offset=0, length=None):
         self.filepath = filepath
-        self.fp = open(self.filepath, 'rb')
-
-    def __iter__(self):
-        """Return an iterator over the image file"""
-        try:
-            while True:
-                chunk = self.fp.read(ChunkedFile.CHUNKSIZE)
-                if chunk:
-                    yield chunk
-                else:
-                    break
-        finally:
-            self.close()
-
-    def close(self):
-        """Close the internal file pointer"""
-        if self.fp:
-            self.fp.close()
-            self.fp = None
+        fp = open(self.filepath, 'rb')
+        if offset:
+            fp.seek(offset)
+        super(ChunkedFile, self).__init__(fp, length)
 
 
 class Store(glance.store.base.Store):
@@ -123,7 +109,7 @@ class Store(glance.store.base.Store):
                                                   reason=reason)
         return result
 
-    def get(self, location):
+    def get(self, location, offset=0, length=None):
         """
         Takes a `glance.store.location.Location` object that indicates
         where to find the image file, and returns a generator for reading
@@ -131,6 +117,9 @@ class Store(glance.store.base.Store):
 
         :param location `glance.store.location.Location` object, supplied
                         from glance.store.location.get_location_from_uri()
+        :param offset: Byte offset to start reading the image file from
+        :param length: Number of bytes to read, or None to read until the
+                       end of the image file
         :raises `glance.exception.NotFound` if image does not exist
         """
         loc = location.store_location
@@ -140,7 +129,7 @@ class Store(glance.store.base.Store):
         else:
             msg = _("Found image at %s. Returning in ChunkedFile.") % filepath
             logger.debug(msg)
-            return ChunkedFile(filepath)
+            return ChunkedFile(filepath, offset=offset, length=length)
 
     def delete(self, location):
         """
@@ -200,7 +189,7 @@ class Store(glance.store.base.Store):
                     break
                 bytes_written += len(buf)
                 checksum.update(buf)
-                f.write(buf)
+                utils.execute_io(f.write, buf)
 
         checksum_hex = checksum.hexdigest()
 
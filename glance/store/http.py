@@ -85,21 +85,38 @@ class StoreLocation(glance.store.location.StoreLocation):
         self.path = path
 
 
-def http_response_iterator(f, size):
+def http_response_iterator(f, size, offset=0, length=None):
     """
     Return an iterator for a file-like object
+
+    :param f: File-like object to read from
+    :param size: Maximum size of each chunk
+    :param offset: Number of leading bytes to discard
+    :param length: Maximum number of bytes to yield, or None for no limit
     """
-    chunk = f.read(size)
-    while chunk:
+    while offset > 0:
+        skipped = f.read(min(size, offset))
+        if not skipped:
+            return
+        offset -= len(skipped)
+
+    remaining = length
+    while remaining is None or remaining > 0:
+        if remaining is None:
+            chunk = f.read(size)
+        else:
+            chunk = f.read(min(size, remaining))
+            remaining -= len(chunk)
+        if not chunk:
+            break
         yield chunk
-        chunk = f.read(size)
 
 
 class Store(glance.store.base.Store):
 
     """An implementation of the HTTP(S) Backend Adapter"""
 
-    def get(self, location):
+    def get(self, location, offset=0, length=None):
         """
         Takes a `glance.store.location.Location` object that indicates
         where to find the image file, and returns a generator for reading
@@ -107,16 +124,27 @@ class Store(glance.store.base.Store):
 
         :param location `glance.store.location.Location` object, supplied
                         from glance.store.location.get_location_from_uri()
+        :param offset: Byte offset to start reading the image file from
+        :param length: Number of bytes to read, or None to read until the
+                       end of the image file
         :raises `glance.exception.NotFound` if image does not exist
         """
         loc = location.store_location
 
         conn_class = self._get_conn_class(loc)
         conn = conn_class(loc.netloc)
-        conn.request("GET", loc.path, "", {})
+        headers = glance.store.base.get_range_headers(offset, length)
+        conn.request("GET", loc.path, "", headers)
 
         try:
-            return http_response_iterator(conn.getresponse(), self.CHUNKSIZE)
+            response = conn.getresponse()
+            if headers and getattr(response, 'status', None) != \
+                    httplib.PARTIAL_CONTENT:
+                # NOTE: The remote server ignored our Range header and is
+                # sending back the entire object, so trim it ourselves
+                return http_response_iterator(response, self.CHUNKSIZE,
+                                              offset, length)
+            return http_response_iterator(response, self.CHUNKSIZE)
         finally:
             conn.close()
 
@@ -220,7 +220,7 @@ class Store(glance.store.base.Store):
                                                   reason=reason)
         return result
 
-    def get(self, location):
+    def get(self, location, offset=0, length=None):
         """
         Takes a `glance.store.location.Location` object that indicates
         where to find the image file, and returns a generator for reading
@@ -228,6 +228,9 @@ class Store(glance.store.base.Store):
 
         :param location `glance.store.location.Location` object, supplied
                         from glance.store.location.get_location_from_uri()
+        :param offset: Byte offset to start reading the image file from
+        :param length: Number of bytes to read, or None to read until the
+                       end of the image file
         :raises `glance.exception.NotFound` if image does not exist
         """
         loc = location.store_location
@@ -253,6 +256,11 @@ class Store(glance.store.base.Store):
         #   raise glance.store.BackendException(msg)
 
         key.BufferSize = self.CHUNKSIZE
+        headers = glance.store.base.get_range_headers(offset, length)
+        if headers:
+            # Opening the key with a Range header up front means the
+            # subsequent reads in ChunkedFile only return the ranged bytes
+            key.open_read(headers=headers)
         return ChunkedFile(key)
 
     def add(self, image_id, image_file, image_size):
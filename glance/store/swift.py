@@ -21,6 +21,7 @@ from __future__ import absolute_import
 
 import hashlib
 import httplib
+import inspect
 import logging
 import math
 import tempfile
@@ -227,7 +228,7 @@ class Store(glance.store.base.Store):
         self.snet = config.get_option(
             self.options, 'swift_enable_snet', type='bool', default=False)
 
-    def get(self, location):
+    def get(self, location, offset=0, length=None):
         """
         Takes a `glance.store.location.Location` object that indicates
         where to find the image file, and returns a generator for reading
@@ -235,16 +236,30 @@ class Store(glance.store.base.Store):
 
         :param location `glance.store.location.Location` object, supplied
                         from glance.store.location.get_location_from_uri()
+        :param offset: Byte offset to start reading the image file from
+        :param length: Number of bytes to read, or None to read until the
+                       end of the image file
         :raises `glance.exception.NotFound` if image does not exist
         """
         loc = location.store_location
         swift_conn = self._make_swift_connection(
             auth_url=loc.swift_auth_url, user=loc.user, key=loc.key)
 
+        kwargs = {}
+        headers = glance.store.base.get_range_headers(offset, length)
+        trim = False
+        if headers:
+            # NOTE: Older Swift client libraries can't send headers along,
+            # those read the whole object and we trim it ourselves
+            if get_object_accepts_headers(swift_conn):
+                kwargs['headers'] = headers
+            else:
+                trim = True
+
         try:
             (resp_headers, resp_body) = swift_conn.get_object(
                 container=loc.container, obj=loc.obj,
-                resp_chunk_size=self.CHUNKSIZE)
+                resp_chunk_size=self.CHUNKSIZE, **kwargs)
         except swift_client.ClientException, e:
             if e.http_status == httplib.NOT_FOUND:
                 uri = location.get_store_uri()
@@ -260,6 +275,9 @@ class Store(glance.store.base.Store):
         #            "Expected %s byte file, Swift has %s bytes" %
         #            (expected_size, obj_size))
 
+        if trim:
+            return glance.store.base.get_range_from_chunks(resp_body,
+                                                           offset, length)
         return resp_body
 
     def _make_swift_connection(self, auth_url, user, key):
@@ -468,4 +486,18 @@ def create_container_if_missing(container, swift_conn, options):
             raise
 
 
+def get_object_accepts_headers(swift_conn):
+    """
+    Returns True if the Swift client library's `get_object` can send
+    request headers, such as a Range header, along with the request
+
+    :param swift_conn: Connection to Swift
+    """
+    try:
+        args = inspect.getargspec(swift_conn.get_object)[0]
+    except TypeError:
+        return False
+    return 'headers' in args
+
+
 glance.store.register_store(__name__, ['swift', 'swift+http', 'swift+https'])
@@ -20,6 +20,8 @@ import hashlib
 import httplib
 import os
 import json
+import shutil
+import tempfile
 import unittest
 
 import stubout
@@ -27,6 +29,9 @@ import webob
 
 from glance.api import v1 as server
 from glance.common import context
+from glance.common import exception
+from glance import image_cache
+from glance.image_cache import peers
 from glance.registry import context as rcontext
 from glance.registry import server as rserver
 from glance.registry.db import api as db_api
@@ -1034,6 +1039,139 @@ class TestRegistryAPI(unittest.TestCase):
         for image in images:
             self.assertTrue(image['size'] >= 19)
 
+    def test_get_details_filter_id(self):
+        """
+        Tests that the /images/detail registry API returns all the images
+        with the given ids, public or not, in a single page
+        """
+        for id in (3, 4):
+            extra_fixture = {'id': id,
+                             'status': 'active',
+                             'is_public': True,
+                             'disk_format': 'vhd',
+                             'container_format': 'ovf',
+                             'name': 'fake image #%d' % id,
+                             'size': 19,
+                             'checksum': None}
+            db_api.image_create(self.context, extra_fixture)
+
+        req = webob.Request.blank('/images/detail?id=1,3,4,5&limit=2')
+        res = req.get_response(self.api)
+        self.assertEquals(res.status_int, 200)
+        images = json.loads(res.body)['images']
+        self.assertEquals([4, 3], [image['id'] for image in images])
+
+        req = webob.Request.blank('/images/detail?id=1,3,4,5')
+        res = req.get_response(self.api)
+        self.assertEquals(res.status_int, 200)
+        images = json.loads(res.body)['images']
+        self.assertEquals([4, 3, 1], [image['id'] for image in images])
+
+    def test_get_details_filter_id_invalid(self):
+        """
+        Tests that the /images/detail registry API rejects invalid ids
+        and more ids than fit in a page
+        """
+        req = webob.Request.blank('/images/detail?id=1,abc')
+        res = req.get_response(self.api)
+        self.assertEquals(res.status_int, 400)
+
+        ids = ','.join(str(id) for id in xrange(1001))
+        req = webob.Request.blank('/images/detail?id=%s' % ids)
+        res = req.get_response(self.api)
+        self.assertEquals(res.status_int, 400)
+
+    def test_get_count(self):
+        """
+        Tests that the /images/count registry API returns the number of
+        images matching the filters of a list of images
+        """
+        for query, count in (('', 1),
+                             ('?is_public=none', 2),
+                             ('?is_public=none&disk_format=vhd', 1),
+                             ('?is_public=none&property-type=kernel', 1),
+                             ('?is_public=none&size_min=20', 0)):
+            req = webob.Request.blank('/images/count' + query)
+            res = req.get_response(self.api)
+            self.assertEquals(res.status_int, 200)
+            self.assertEquals(count, json.loads(res.body)['count'])
+
+    def test_get_stats(self):
+        """
+        Tests that the /images/stats registry API returns the number and
+        total size of the images matching the filters of a list of images,
+        overall or grouped by an image attribute
+        """
+        req = webob.Request.blank('/images/stats?is_public=none')
+        res = req.get_response(self.api)
+        self.assertEquals(res.status_int, 200)
+        self.assertEquals([{'count': 2, 'size': 32}],
+                          json.loads(res.body)['stats'])
+
+        req = webob.Request.blank('/images/stats?is_public=none&'
+                                  'group_by=disk_format')
+        res = req.get_response(self.api)
+        self.assertEquals(res.status_int, 200)
+        self.assertEquals([{'disk_format': 'ami', 'count': 1, 'size': 13},
+                           {'disk_format': 'vhd', 'count': 1, 'size': 19}],
+                          json.loads(res.body)['stats'])
+
+        req = webob.Request.blank('/images/stats?group_by=is_public&'
+                                  'status=saving')
+        res = req.get_response(self.api)
+        self.assertEquals(res.status_int, 200)
+        self.assertEquals([], json.loads(res.body)['stats'])
+
+    def test_get_stats_bad_group_by(self):
+        """Tests that grouping the stats by an unsupported key fails"""
+        req = webob.Request.blank('/images/stats?group_by=location')
+        res = req.get_response(self.api)
+        self.assertEquals(res.status_int, 400)
+
+    def test_image_get_all_loads_collections(self):
+        """
+        Tests that db_api.image_get_all batch-loads the properties and
+        members of the page of images only when asked to
+        """
+        db_api.image_member_create(self.context,
+                                   {'image_id': 1, 'member': 'pattieblack'})
+
+        images = db_api.image_get_all(self.context, sort_key='id',
+                                      sort_dir='asc',
+                                      filters={'is_public': None})
+        self.assertEquals([1, 2], [image.id for image in images])
+        self.assertEquals(['type'],
+                          [prop.name for prop in images[0].properties])
+        self.assertEquals([], images[1].properties)
+        self.assertEquals(['pattieblack'],
+                          [memb.member for memb in images[0].members])
+
+        images = db_api.image_get_all(self.context, load_properties=False,
+                                      load_members=False,
+                                      filters={'is_public': None})
+        for image in images:
+            self.assertFalse('properties' in image.__dict__)
+            self.assertFalse('members' in image.__dict__)
+
+    def test_shared_image_visibility(self):
+        """
+        Tests that a private image shared with a tenant is seen by the
+        tenant, in listings and on its own, and not by other tenants
+        """
+        db_api.image_update(self.context, 1, {'owner': 'pattieblack'})
+        db_api.image_member_create(self.context,
+                                   {'image_id': 1, 'member': 'froggy'})
+
+        froggy = rcontext.RequestContext(tenant='froggy')
+        images = db_api.image_get_all(froggy, filters={'is_public': True})
+        self.assertEquals([2, 1], [image.id for image in images])
+        self.assertEquals(1, db_api.image_get(froggy, 1).id)
+
+        toad = rcontext.RequestContext(tenant='toad')
+        images = db_api.image_get_all(toad, filters={'is_public': True})
+        self.assertEquals([2], [image.id for image in images])
+        self.assertRaises(exception.NotAuthorized, db_api.image_get, toad, 1)
+
     def test_get_details_filter_size_max(self):
         """
         Tests that the /images/detail registry API returns list of
@@ -1162,6 +1300,45 @@ class TestRegistryAPI(unittest.TestCase):
         for image in images:
             self.assertEqual('v a', image['properties']['prop_123'])
 
+    def test_get_details_filter_properties(self):
+        """
+        Tests that the /images/detail registry API returns list of
+        public images that have all of several custom properties, as
+        last updated
+        """
+        for id, properties in ((3, {'distro': 'fedora', 'arch': 'i386'}),
+                               (4, {'distro': 'fedora', 'arch': 'x86_64'}),
+                               (5, {'distro': 'ubuntu', 'arch': 'x86_64'})):
+            extra_fixture = {'id': id,
+                             'status': 'active',
+                             'is_public': True,
+                             'disk_format': 'vhd',
+                             'container_format': 'ovf',
+                             'name': 'fake image #%d' % id,
+                             'size': 19,
+                             'checksum': None,
+                             'properties': properties}
+
+            db_api.image_create(self.context, extra_fixture)
+
+        db_api.image_update(self.context, 3,
+                            {'properties': {'arch': 'x86_64'}})
+
+        # NOTE: The rarer property is joined to the images unless no
+        # property is considered rare, in which case both are checked
+        # image by image
+        for max_matches in (db_api.PROPERTY_JOIN_MAX_MATCHES, 0):
+            self.stubs.Set(db_api, 'PROPERTY_JOIN_MAX_MATCHES', max_matches)
+
+            req = webob.Request.blank('/images/detail?property-distro=fedora&'
+                                      'property-arch=x86_64')
+            res = req.get_response(self.api)
+            res_dict = json.loads(res.body)
+            self.assertEquals(res.status_int, 200)
+
+            images = res_dict['images']
+            self.assertEquals([4, 3], [image['id'] for image in images])
+
     def test_get_details_filter_public_none(self):
         """
         Tests that the /images/detail registry API returns list of
@@ -1898,6 +2075,29 @@ class TestGlanceAPI(unittest.TestCase):
         for key, value in expected_headers.iteritems():
             self.assertEquals(value, res.headers[key])
 
+    def test_get_count(self):
+        """Tests that the number of images matching filters is returned"""
+        req = webob.Request.blank("/images/count?is_public=none")
+        res = req.get_response(self.api)
+        self.assertEquals(res.status_int, 200)
+        self.assertEquals(2, json.loads(res.body)['count'])
+
+    def test_get_stats(self):
+        """Tests that stats of the images matching filters are returned"""
+        req = webob.Request.blank("/images/stats?is_public=none&"
+                                  "group_by=container_format")
+        res = req.get_response(self.api)
+        self.assertEquals(res.status_int, 200)
+        self.assertEquals([{'container_format': 'ami', 'count': 1,
+                            'size': 13},
+                           {'container_format': 'ovf', 'count': 1,
+                            'size': 19}],
+                          json.loads(res.body)['stats'])
+
+        req = webob.Request.blank("/images/stats?group_by=location")
+        res = req.get_response(self.api)
+        self.assertEquals(res.status_int, 400)
+
     def test_image_meta(self):
         """Test for HEAD /images/<ID>"""
         expected_headers = {'x-image-meta-id': '2',
@@ -1917,6 +2117,190 @@ class TestGlanceAPI(unittest.TestCase):
         self.assertEqual(res.content_type, 'application/octet-stream')
         self.assertEqual('chunk00000remainder', res.body)
 
+    def test_show_image_range(self):
+        req = webob.Request.blank("/images/2")
+        req.headers['Range'] = 'bytes=5-9'
+        res = req.get_response(self.api)
+        self.assertEqual(res.status_int, httplib.PARTIAL_CONTENT)
+        self.assertEqual('bytes 5-9/19', res.headers['Content-Range'])
+        self.assertEqual(5, res.content_length)
+        self.assertEqual('00000', res.body)
+
+    def test_show_image_range_suffix(self):
+        req = webob.Request.blank("/images/2")
+        req.headers['Range'] = 'bytes=-9'
+        res = req.get_response(self.api)
+        self.assertEqual(res.status_int, httplib.PARTIAL_CONTENT)
+        self.assertEqual('bytes 10-18/19', res.headers['Content-Range'])
+        self.assertEqual('remainder', res.body)
+
+    def test_show_image_range_not_satisfiable(self):
+        req = webob.Request.blank("/images/2")
+        req.headers['Range'] = 'bytes=42-'
+        res = req.get_response(self.api)
+        self.assertEqual(res.status_int,
+                         webob.exc.HTTPRequestRangeNotSatisfiable.code)
+        self.assertEqual('bytes */19', res.headers['Content-Range'])
+
+    def test_show_image_range_if_range_mismatch(self):
+        req = webob.Request.blank("/images/2")
+        req.headers['Range'] = 'bytes=5-9'
+        req.headers['If-Range'] = 'not-the-checksum'
+        res = req.get_response(self.api)
+        self.assertEqual(res.status_int, 200)
+        self.assertEqual('chunk00000remainder', res.body)
+
+    def test_show_image_memory_cache(self):
+        cache_dir = tempfile.mkdtemp()
+        options = dict(OPTIONS, image_cache_enabled='True',
+                       image_cache_datadir=cache_dir,
+                       image_cache_memory_max_size_bytes='1024',
+                       image_cache_hit_flush_interval='0')
+        cache = image_cache.ImageCache(options)
+        image_meta = {'id': 2}
+        try:
+            api = context.ContextMiddleware(server.API(options), options)
+            for i in xrange(3):
+                res = webob.Request.blank("/images/2").get_response(api)
+                self.assertEqual(res.status_int, 200)
+                self.assertEqual('chunk00000remainder', res.body)
+
+            self.assertEqual('chunk00000remainder',
+                             cache.get_from_memory(image_meta))
+
+            req = webob.Request.blank("/images/2")
+            req.headers['Range'] = 'bytes=5-9'
+            res = req.get_response(api)
+            self.assertEqual(res.status_int, httplib.PARTIAL_CONTENT)
+            self.assertEqual('00000', res.body)
+        finally:
+            cache.memory.clear()
+            shutil.rmtree(cache_dir, ignore_errors=True)
+
+    def _peer_options(self, image_id, **kwargs):
+        """Returns options putting this node in peer mode with a peer
+        owning the image
+        """
+        nodes = ['127.0.0.1:9292', '127.0.0.2:9292']
+        owner = peers.HashRing(nodes).get_node(image_id)
+        nodes.remove(owner)
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir, ignore_errors=True)
+        options = dict(OPTIONS, image_cache_enabled='True',
+                       image_cache_datadir=cache_dir,
+                       image_cache_peers='127.0.0.1:9292,127.0.0.2:9292',
+                       image_cache_peer_self=nodes[0])
+        options.update(kwargs)
+        return owner, options
+
+    def test_show_image_peer_redirect(self):
+        owner, options = self._peer_options(2,
+                                            image_cache_peer_mode='redirect')
+        api = context.ContextMiddleware(server.API(options), options)
+        res = webob.Request.blank("/images/2").get_response(api)
+        self.assertEqual(res.status_int, httplib.FOUND)
+        self.assertEqual("http://%s/images/2" % owner, res.location)
+
+        req = webob.Request.blank("/images/2")
+        req.headers[peers.PEER_REQUEST_HEADER] = 'True'
+        res = req.get_response(api)
+        self.assertEqual(res.status_int, 200)
+        self.assertEqual('chunk00000remainder', res.body)
+
+    def test_show_image_peer_proxy(self):
+        owner, options = self._peer_options(2)
+        proxied = []
+
+        def fake_fetch(router, req, peer):
+            proxied.append(peer)
+            return iter(['chunk00000remainder'])
+
+        self.stubs.Set(peers.PeerRouter, 'fetch', fake_fetch)
+        api = context.ContextMiddleware(server.API(options), options)
+        res = webob.Request.blank("/images/2").get_response(api)
+        self.assertEqual(res.status_int, 200)
+        self.assertEqual('chunk00000remainder', res.body)
+        self.assertEqual([owner], proxied)
+        self.assertFalse(image_cache.ImageCache(options).hit(2))
+
+    def test_show_image_peer_proxy_failure(self):
+        owner, options = self._peer_options(2)
+
+        def fake_fetch(router, req, peer):
+            raise exception.ClientConnectionError("peer down")
+
+        self.stubs.Set(peers.PeerRouter, 'fetch', fake_fetch)
+        api = context.ContextMiddleware(server.API(options), options)
+        res = webob.Request.blank("/images/2").get_response(api)
+        self.assertEqual(res.status_int, 200)
+        self.assertEqual('chunk00000remainder', res.body)
+
+    def _peer_fill_options(self, peer_chunks):
+        """Returns options filling the cache from a sibling that serves
+        `peer_chunks`
+        """
+        checksum = hashlib.md5('chunk00000remainder').hexdigest()
+        db_api.image_update(self.context, 2, {'checksum': checksum})
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir, ignore_errors=True)
+
+        def fake_fetch(peer_fill, req):
+            self.assertTrue(peer_fill.enabled)
+            return '127.0.0.2:9292', peer_chunks
+
+        self.stubs.Set(peers.PeerFill, 'fetch', fake_fetch)
+        return dict(OPTIONS, image_cache_enabled='True',
+                    image_cache_datadir=cache_dir,
+                    image_cache_fill_peers='127.0.0.2:9292')
+
+    def test_show_image_peer_fill(self):
+        options = self._peer_fill_options(iter(['chunk00000remainder']))
+        api = context.ContextMiddleware(server.API(options), options)
+        res = webob.Request.blank("/images/2").get_response(api)
+        self.assertEqual(res.status_int, 200)
+        self.assertEqual('chunk00000remainder', res.body)
+        self.assertTrue(image_cache.ImageCache(options).hit(2))
+
+    def test_show_image_peer_fill_bad_data(self):
+        options = self._peer_fill_options(iter(['chunk00000XXXXXXXXX']))
+        api = context.ContextMiddleware(server.API(options), options)
+        res = webob.Request.blank("/images/2").get_response(api)
+        self.assertEqual(res.status_int, 200)
+        self.assertFalse(image_cache.ImageCache(options).hit(2))
+
+    def test_show_image_peer_fill_peer_fails(self):
+        def peer_chunks():
+            yield 'chunk00000'
+            raise IOError("connection reset")
+
+        options = self._peer_fill_options(peer_chunks())
+        api = context.ContextMiddleware(server.API(options), options)
+        res = webob.Request.blank("/images/2").get_response(api)
+        self.assertEqual(res.status_int, 200)
+        self.assertEqual('chunk00000remainder', res.body)
+        self.assertTrue(image_cache.ImageCache(options).hit(2))
+
+    def test_show_image_cache_only(self):
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir, ignore_errors=True)
+        options = dict(OPTIONS, image_cache_enabled='True',
+                       image_cache_datadir=cache_dir)
+        api = context.ContextMiddleware(server.API(options), options)
+        for app in (self.api, api):
+            req = webob.Request.blank("/images/2")
+            req.headers[peers.CACHE_ONLY_HEADER] = 'True'
+            res = req.get_response(app)
+            self.assertEqual(res.status_int, webob.exc.HTTPNotFound.code)
+
+        res = webob.Request.blank("/images/2").get_response(api)
+        self.assertEqual('chunk00000remainder', res.body)
+
+        req = webob.Request.blank("/images/2")
+        req.headers[peers.CACHE_ONLY_HEADER] = 'True'
+        res = req.get_response(api)
+        self.assertEqual(res.status_int, 200)
+        self.assertEqual('chunk00000remainder', res.body)
+
     def test_show_non_exists_image(self):
         req = webob.Request.blank("/images/42")
         res = req.get_response(self.api)
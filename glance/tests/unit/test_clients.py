@@ -16,17 +16,22 @@
 #    under the License.
 
 import datetime
+import httplib
 import json
 import os
 import stubout
 import StringIO
 import unittest
 
+import eventlet
+import eventlet.wsgi
 import webob
 
 from glance import client
+from glance.common import client as base_client
 from glance.common import context
 from glance.common import exception
+from glance import registry
 from glance.registry.db import api as db_api
 from glance.registry.db import models as db_models
 from glance.registry import client as rclient
@@ -48,6 +53,214 @@ class TestBadClients(unittest.TestCase):
                           1)
 
 
+class TestConnectionPool(unittest.TestCase):
+
+    """Test keep-alive connections are reused across requests"""
+
+    def setUp(self):
+        def app(environ, start_response):
+            if environ['PATH_INFO'] == '/chunked':
+                start_response('200 OK', [])
+                return (chunk for chunk in ['O', 'K'])
+            start_response('200 OK', [('Content-Length', '2')])
+            return ['OK']
+
+        self.sock = eventlet.listen(('127.0.0.1', 0))
+        self.port = self.sock.getsockname()[1]
+        self.server = eventlet.spawn(eventlet.wsgi.server, self.sock, app,
+                                     log=StringIO.StringIO())
+        self.pool = base_client.ConnectionPool(max_size=1)
+        self.reused = []
+
+        def get(*args):
+            c, reused = base_client.ConnectionPool.get(self.pool, *args)
+            self.reused.append(reused)
+            return c, reused
+
+        self.pool.get = get
+        self.client = base_client.BaseClient('127.0.0.1', self.port,
+                                             use_ssl=False, auth_tok=None)
+        self.client.pool = self.pool
+
+    def tearDown(self):
+        self.pool.clear()
+        self.server.kill()
+        self.sock.close()
+
+    def get(self, path='/'):
+        return self.client.do_request('GET', path).read()
+
+    def break_pooled_connection(self):
+        def getresponse():
+            raise httplib.BadStatusLine('')
+
+        c, idle_since = self.pool.connections.values()[0][0]
+        c.getresponse = getresponse
+
+    def test_connection_reused(self):
+        """Test a connection is reused once its response was read"""
+        self.get()
+        self.get()
+        self.assertEqual([False, True], self.reused)
+
+    def test_connection_busy(self):
+        """Test a connection isn't reused while its response is unread"""
+        res = self.client.do_request('GET', '/')
+        self.get()
+        self.assertEqual('OK', res.read())
+        self.assertEqual([False, False], self.reused)
+
+    def test_chunked_connection_reused(self):
+        """Test a connection is reused once its chunked response was read"""
+        self.assertEqual('OK', self.get('/chunked'))
+        self.get()
+        self.assertEqual([False, True], self.reused)
+
+    def test_partly_read_connection_not_reused(self):
+        """Test a connection isn't reused after its response was closed
+        before being read to the end"""
+        res = self.client.do_request('GET', '/')
+        self.assertEqual('O', res.read(1))
+        res.close()
+        self.assertEqual('OK', self.get())
+        self.assertEqual([False, False], self.reused)
+
+    def test_partly_read_chunked_connection_not_reused(self):
+        """Test a connection isn't reused after its chunked response was
+        closed before being read to the end"""
+        res = self.client.do_request('GET', '/chunked')
+        self.assertEqual('O', res.read(1))
+        res.close()
+        self.assertEqual('OK', self.get())
+        self.assertEqual([False, False], self.reused)
+
+    def test_head_connection_not_reused(self):
+        """Test a connection isn't reused after a HEAD request"""
+        self.client.do_request('HEAD', '/')
+        self.get()
+        self.assertEqual([False, False], self.reused)
+
+    def test_idle_connection_expired(self):
+        """Test connections idle for too long are not reused"""
+        self.get()
+        self.pool.max_idle = -1
+        self.get()
+        self.assertEqual([False, False], self.reused)
+
+    def test_stale_connection_retried(self):
+        """Test a request failing on a reused connection is retried"""
+        self.get()
+        c, idle_since = self.pool.connections.values()[0][0]
+        c.sock.close()
+        self.assertEqual('OK', self.get())
+        self.assertEqual([False, True, False], self.reused)
+
+    def test_lost_response_retried(self):
+        """Test a GET request whose response was lost is retried"""
+        self.get()
+        self.break_pooled_connection()
+        self.assertEqual('OK', self.get())
+        self.assertEqual([False, True, False], self.reused)
+
+    def test_lost_response_not_retried_for_post(self):
+        """Test a POST request whose response was lost isn't retried, as
+        the server may have acted on it"""
+        self.get()
+        self.break_pooled_connection()
+        self.assertRaises(exception.ClientConnectionError,
+                          self.client.do_request, 'POST', '/', body='{}')
+        self.assertEqual([False, True], self.reused)
+
+
+class FakeResponse(object):
+
+    def __init__(self, status, location=None):
+        self.status = status
+        self.location = location
+
+    def getheader(self, name, default=None):
+        if name == 'location' and self.location is not None:
+            return self.location
+        return default
+
+    def read(self):
+        return ''
+
+
+class TestRedirects(unittest.TestCase):
+
+    """Test which redirects are followed, and how"""
+
+    def setUp(self):
+        self.client = base_client.BaseClient('glance', 9292, use_ssl=False,
+                                             auth_tok='token',
+                                             redirect_peers=['peer:9292'])
+        self.requests = []
+        self.locations = []
+
+        def fake_pooled_request(connection_type, host, port, method, action,
+                                body, headers):
+            self.requests.append((connection_type, host, port, action,
+                                  headers.get('x-auth-token')))
+            if self.locations:
+                return FakeResponse(httplib.FOUND, self.locations.pop(0))
+            return FakeResponse(httplib.OK)
+
+        self.client._pooled_request = fake_pooled_request
+
+    def test_relative_redirect(self):
+        self.locations = ['other?x=1', '/v1/images/1']
+        self.client.do_request('GET', '/v1/images/2')
+        self.assertEqual([
+            (httplib.HTTPConnection, 'glance', 9292, '/v1/images/2', 'token'),
+            (httplib.HTTPConnection, 'glance', 9292, '/v1/images/other?x=1',
+             'token'),
+            (httplib.HTTPConnection, 'glance', 9292, '/v1/images/1',
+             'token')], self.requests)
+
+    def test_redirect_to_peer(self):
+        self.locations = ['http://peer:9292/v1/images/1']
+        self.client.do_request('GET', '/v1/images/1')
+        self.assertEqual(
+            (httplib.HTTPConnection, 'peer', 9292, '/v1/images/1', 'token'),
+            self.requests[-1])
+
+    def test_cross_scheme_redirect(self):
+        self.locations = ['https://glance:9292/v1/images/1']
+        self.client.do_request('GET', '/v1/images/1')
+        self.assertEqual(
+            (httplib.HTTPSConnection, 'glance', 9292, '/v1/images/1',
+             'token'), self.requests[-1])
+
+    def test_no_https_downgrade(self):
+        self.client.use_ssl = True
+        self.locations = ['http://glance:9292/v1/images/1']
+        self.assertRaises(Exception, self.client.do_request,
+                          'GET', '/v1/images/1')
+        self.assertEqual(1, len(self.requests))
+
+    def test_foreign_host_redirect(self):
+        for location in ('http://evil:9292/v1/images/1',
+                         'http://glance:8080/v1/images/1',
+                         'ftp://glance:9292/v1/images/1'):
+            self.requests = []
+            self.locations = [location]
+            self.assertRaises(Exception, self.client.do_request,
+                              'GET', '/v1/images/1')
+            self.assertEqual(1, len(self.requests))
+
+    def test_auth_token_stripped_on_host_change(self):
+        class Client(base_client.BaseClient):
+            def get_redirect(self, *args):
+                return (httplib.HTTPConnection, 'other', 9292, '/')
+
+        client = Client('glance', 9292, use_ssl=False, auth_tok='token')
+        client._pooled_request = self.client._pooled_request
+        self.locations = ['http://other:9292/']
+        client.do_request('GET', '/')
+        self.assertEqual([None], [r[4] for r in self.requests[1:]])
+
+
 class TestRegistryClient(unittest.TestCase):
 
     """
@@ -624,6 +837,40 @@ class TestRegistryClient(unittest.TestCase):
         for image in images:
             self.assertEquals('new name! #123', image['name'])
 
+    def test_get_images_meta(self):
+        """Tests that many images can be fetched at once by id"""
+        images = self.client.get_images_meta([1, 2, 3])
+        self.assertEquals([2, 1], [image['id'] for image in images])
+        self.assertEquals({'type': 'kernel'}, images[1]['properties'])
+
+        self.assertEquals([], self.client.get_images_meta([]))
+
+    def test_get_images_meta_invalid_id(self):
+        """Tests that fetching images by invalid ids is rejected"""
+        self.assertRaises(exception.Invalid,
+                          self.client.get_images_meta, ['abc'])
+
+    def test_get_images_count(self):
+        """Tests that the number of images matching filters is returned"""
+        self.assertEquals(1, self.client.get_images_count())
+        self.assertEquals(2, self.client.get_images_count(
+            filters={'is_public': 'none'}))
+        self.assertEquals(1, self.client.get_images_count(
+            filters={'is_public': 'none', 'disk_format': 'ami'}))
+
+    def test_get_images_stats(self):
+        """Tests that stats of the images matching filters are returned"""
+        self.assertEquals([{'count': 2, 'size': 32}],
+                          self.client.get_images_stats(
+                              filters={'is_public': 'none'}))
+        self.assertEquals([{'is_public': False, 'count': 1, 'size': 13},
+                           {'is_public': True, 'count': 1, 'size': 19}],
+                          self.client.get_images_stats(
+                              filters={'is_public': 'none'},
+                              group_by='is_public'))
+        self.assertRaises(exception.Invalid,
+                          self.client.get_images_stats, group_by='location')
+
     def test_get_image_details_by_status(self):
         """Tests that a detailed call can be filtered by status"""
         extra_fixture = {'id': 3,
@@ -964,6 +1211,26 @@ class TestRegistryClient(unittest.TestCase):
                           self.client.delete_member, 2, 'pattieblack')
 
 
+class TestLocalRegistryClient(TestRegistryClient):
+
+    """
+    Test the in-process Registry client behaves just like the client of
+    the Registry service
+    """
+
+    def setUp(self):
+        """Establish a clean test environment"""
+        super(TestLocalRegistryClient, self).setUp()
+        self.client = rclient.LocalRegistryClient(
+                OPTIONS, context.RequestContext(is_admin=True))
+
+    def test_get_registry_client(self):
+        """Test the in-process client is used with registry_driver=local"""
+        options = dict(OPTIONS, registry_driver='local')
+        c = registry.get_registry_client(options, context.RequestContext())
+        self.assertTrue(isinstance(c, rclient.LocalRegistryClient))
+
+
 class TestClient(unittest.TestCase):
 
     """
@@ -1369,6 +1636,20 @@ class TestClient(unittest.TestCase):
         for k, v in fixture.items():
             self.assertEquals(v, data[k])
 
+    def test_get_images_meta(self):
+        """Tests that many images can be fetched at once by id"""
+        images = self.client.get_images_meta([2, 1, 5])
+        self.assertEquals([2, 1], [image['id'] for image in images])
+        self.assertEquals('fake image #2', images[0]['name'])
+
+    def test_get_images_count_and_stats(self):
+        """Tests that counts and stats of images can be fetched"""
+        self.assertEquals(1, self.client.get_images_count())
+        self.assertEquals([{'status': 'active', 'count': 2, 'size': 32}],
+                          self.client.get_images_stats(
+                              filters={'is_public': 'none'},
+                              group_by='status'))
+
     def test_get_image_iso_meta(self):
         """Tests that the detailed info about an ISO image is returned"""
         fixture = {'id': 3,
@@ -45,19 +45,21 @@ class FakeMembership(object):
 
 
 class TestContext(unittest.TestCase):
-    def do_visible(self, exp_res, img_owner, img_public, **kwargs):
+    def do_visible(self, exp_res, img_owner, img_public, visible_args=None,
+                   **kwargs):
         """
         Perform a context visibility test.  Creates a (fake) image
         with the specified owner and is_public attributes, then
         creates a context with the given keyword arguments and expects
         exp_res as the result of an is_image_visible() call on the
-        context.
+        context, passing it the keyword arguments in visible_args.
         """
 
         img = FakeImage(img_owner, img_public)
         ctx = context.RequestContext(**kwargs)
 
-        self.assertEqual(ctx.is_image_visible(img), exp_res)
+        self.assertEqual(ctx.is_image_visible(img, **(visible_args or {})),
+                         exp_res)
 
     def do_sharable(self, exp_res, img_owner, membership=None, **kwargs):
         """
@@ -198,6 +200,24 @@ class TestContext(unittest.TestCase):
         """
         self.do_visible(True, 'pattieblack', False, tenant='pattieblack')
 
+    def test_auth_private_shared(self):
+        """
+        Tests that an authenticated context (with is_admin set to
+        False) can access an image (which it does not own) with
+        is_public set to False, when given its membership of the image.
+        """
+        self.do_visible(True, 'pattieblack', False,
+                        {'membership': FakeMembership()}, tenant='froggy')
+
+    def test_auth_private_not_shared(self):
+        """
+        Tests that an authenticated context (with is_admin set to
+        False) cannot access an image (which it does not own) with
+        is_public set to False, when told it is not a member of it.
+        """
+        self.do_visible(False, 'pattieblack', False, {'membership': None},
+                        tenant='froggy')
+
     def test_auth_sharable(self):
         """
         Tests that an authenticated context (with is_admin set to
@@ -66,6 +66,14 @@ class TestStore(unittest.TestCase):
         self.assertEqual(expected_data, data)
         self.assertEqual(expected_num_chunks, num_chunks)
 
+    def test_get_range(self):
+        """Test retrieval of a byte range of an image in chunks"""
+        loc = get_location_from_uri("file:///tmp/glance-tests/2")
+        image_file = self.store.get(loc, offset=5, length=12)
+
+        chunks = [chunk for chunk in image_file]
+        self.assertEqual(["00000remai", "nd"], chunks)
+
     def test_get_non_existing(self):
         """
         Test that trying to retrieve a file that doesn't exist
@@ -87,6 +87,15 @@ class TestHttpStore(unittest.TestCase):
         chunks = [c for c in image_file]
         self.assertEqual(chunks, expected_returns)
 
+    def test_http_get_range(self):
+        uri = "http://netloc/path/to/file.tar.gz"
+        expected_returns = ['te', 'ap', 'ot']
+        loc = get_location_from_uri(uri)
+        image_file = self.store.get(loc, offset=7, length=6)
+
+        chunks = [c for c in image_file]
+        self.assertEqual(chunks, expected_returns)
+
     def test_http_delete_raise_error(self):
         uri = "https://netloc/path/to/file.tar.gz"
         loc = get_location_from_uri(uri)
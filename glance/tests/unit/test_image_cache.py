@@ -14,11 +14,31 @@
 #    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
 #    License for the specific language governing permissions and limitations
 #    under the License.
+import errno
+import hashlib
+import os
+import shutil
+import tempfile
+import time
 import unittest
 
+import eventlet
 import stubout
+import webob
+import webob.exc
 
+from glance.api import cached_images
+from glance.common import exception
 from glance import image_cache
+from glance.image_cache import memory
+from glance.image_cache import peers
+from glance.image_cache import policies
+from glance.image_cache import prefetcher
+from glance.image_cache import pruner
+from glance.image_cache import verifier
+from glance.image_cache.drivers import sqlite
+from glance import registry
+from glance import utils
 
 
 def stub_out_image_cache(stubs):
@@ -53,3 +73,967 @@ class TestImageCache(unittest.TestCase):
                    'image_cache_datadir': '/some/place'}
         cache = image_cache.ImageCache(options)
         self.assertEqual(cache.enabled, True)
+
+    def test_invalid_driver(self):
+        options = {'image_cache_enabled': 'True',
+                   'image_cache_datadir': '/some/place',
+                   'image_cache_driver': 'bogus'}
+        cache = image_cache.ImageCache(options)
+        self.assertRaises(exception.InvalidImageCacheDriver,
+                          getattr, cache, 'driver')
+
+    def test_invalid_policy(self):
+        options = {'image_cache_enabled': 'True',
+                   'image_cache_datadir': '/some/place',
+                   'image_cache_admission_policy': 'bogus'}
+        cache = image_cache.ImageCache(options)
+        self.assertRaises(exception.InvalidImageCachePolicy,
+                          getattr, cache, 'policy')
+
+
+class TestImageCacheFollowIncomplete(unittest.TestCase):
+    def setUp(self):
+        self.stubs = stubout.StubOutForTesting()
+        self.cache_dir = tempfile.mkdtemp()
+        options = {'image_cache_enabled': 'True',
+                   'image_cache_datadir': self.cache_dir,
+                   'image_cache_follow_timeout': '60'}
+        self.cache = image_cache.ImageCache(options)
+        self.image_meta = {'id': 1, 'name': 'image', 'size': 19}
+        self.cache.reserve(self.image_meta)
+
+        self.incomplete_path = self.cache.incomplete_path_for_image(1)
+        with open(self.incomplete_path, 'wb') as f:
+            f.write("chunk00000")
+
+    def tearDown(self):
+        self.stubs.UnsetAll()
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+    def test_follow_until_committed(self):
+        def fake_sleep(seconds):
+            with open(self.incomplete_path, 'ab') as f:
+                f.write("remainder")
+            self.cache._make_shard_directory(1)
+            os.rename(self.incomplete_path, self.cache.path_for_image(1))
+
+        self.stubs.Set(eventlet, 'sleep', fake_sleep)
+
+        data = ''.join(self.cache.follow_incomplete(self.image_meta))
+        self.assertEqual("chunk00000remainder", data)
+
+    def test_follow_already_committed(self):
+        with open(self.incomplete_path, 'ab') as f:
+            f.write("remainder")
+        self.cache._make_shard_directory(1)
+        os.rename(self.incomplete_path, self.cache.path_for_image(1))
+
+        data = ''.join(self.cache.follow_incomplete(self.image_meta))
+        self.assertEqual("chunk00000remainder", data)
+
+    def test_follow_failed_write(self):
+        def fake_sleep(seconds):
+            os.rename(self.incomplete_path,
+                      self.cache.invalid_path_for_image(1))
+
+        self.stubs.Set(eventlet, 'sleep', fake_sleep)
+
+        chunks = []
+        try:
+            for chunk in self.cache.follow_incomplete(self.image_meta):
+                chunks.append(chunk)
+        except exception.ImageCacheFollowFailed:
+            pass
+        else:
+            self.fail("ImageCacheFollowFailed not raised")
+        self.assertEqual(["chunk00000"], chunks)
+
+    def test_follow_stalled_write(self):
+        self.cache.options['image_cache_follow_timeout'] = '-1'
+        self.stubs.Set(eventlet, 'sleep', lambda seconds: None)
+        follower = self.cache.follow_incomplete(self.image_meta)
+        self.assertEqual("chunk00000", follower.next())
+        self.assertRaises(exception.ImageCacheFollowFailed, follower.next)
+
+    def test_follow_unknown_size(self):
+        self.image_meta['size'] = 0
+        follower = self.cache.follow_incomplete(self.image_meta)
+        self.assertRaises(exception.ImageCacheFollowFailed, follower.next)
+
+    def test_being_written(self):
+        self.assertTrue(self.cache.is_image_currently_being_written(1))
+
+    def test_being_written_without_reservation(self):
+        self.cache.driver.delete_reservation(1)
+        self.assertFalse(self.cache.is_image_currently_being_written(1))
+
+    def test_being_written_without_progress(self):
+        stale = os.stat(self.incomplete_path).st_mtime - 61
+        os.utime(self.incomplete_path, (stale, stale))
+        self.assertFalse(self.cache.is_image_currently_being_written(1))
+
+
+class ImageCacheDriverTests(object):
+    """Tests that are run against each of the cache metadata drivers"""
+
+    driver = None
+
+    def setUp(self):
+        self.stubs = stubout.StubOutForTesting()
+        self.cache_dir = tempfile.mkdtemp()
+        self.options = {'image_cache_enabled': 'True',
+                        'image_cache_datadir': self.cache_dir,
+                        'image_cache_driver': self.driver,
+                        'image_cache_hit_flush_interval': '0'}
+        self.cache = image_cache.ImageCache(self.options)
+
+    def tearDown(self):
+        self.stubs.UnsetAll()
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+    def cache_image(self, image_id, data, **kwargs):
+        image_meta = {'id': image_id, 'name': 'image%d' % image_id,
+                      'size': len(data)}
+        image_meta.update(kwargs)
+        with self.cache.open(image_meta, 'wb') as cache_file:
+            cache_file.write(data)
+        return image_meta
+
+    def test_entries(self):
+        self.cache_image(1, "0123456789")
+        self.cache_image(2, "01234")
+
+        entries = sorted(self.cache.entries(), key=lambda e: e['id'])
+        self.assertEqual([1, 2], [e['id'] for e in entries])
+        self.assertEqual([10, 5], [e['size'] for e in entries])
+        self.assertEqual(self.cache.path_for_image(1), entries[0]['path'])
+
+    def test_sharded_layout(self):
+        self.cache_image(1, "0123456789")
+        path = self.cache.path_for_image(1)
+        self.assertTrue(os.path.exists(path))
+        shard, subshard, filename = path.split(os.sep)[-3:]
+        self.assertEqual(2, len(shard))
+        self.assertEqual(2, len(subshard))
+        self.assertEqual('1', filename)
+
+    def test_migrate_flat_entries(self):
+        with open(os.path.join(self.cache_dir, '3'), 'wb') as f:
+            f.write("012")
+        with open(os.path.join(self.cache_dir, 'notanimage'), 'wb') as f:
+            f.write("012")
+
+        cache = image_cache.ImageCache(self.options)
+        self.assertTrue(cache.hit(3))
+        self.assertFalse(os.path.exists(os.path.join(self.cache_dir, '3')))
+        self.assertEqual([3], [e['id'] for e in cache.entries()])
+        self.assertEqual(3, cache.get_cache_size())
+
+    def test_entries_paginated(self):
+        self.cache_image(1, "0123456789")
+        self.cache_image(2, "01234")
+        self.cache_image(3, "0123456")
+        self.cache_image(4, "01234")
+
+        def ids(**kwargs):
+            return [e['id'] for e in self.cache.entries(**kwargs)]
+
+        self.assertEqual([1, 2], ids(limit=2))
+        self.assertEqual([3, 4], ids(limit=2, marker=2))
+        self.assertEqual([2, 4, 3, 1], ids(sort_key='size'))
+        self.assertEqual([1, 3, 4, 2], ids(sort_key='size', sort_dir='desc'))
+        self.assertEqual([3, 1], ids(sort_key='size', marker=4))
+        self.assertEqual([2], ids(sort_key='size', sort_dir='desc',
+                                  marker=4))
+        self.assertEqual([1, 3], ids(filters={'size_min': 6}))
+        self.assertEqual([2], ids(filters={'size_max': 6}, limit=1))
+        self.assertRaises(exception.NotFound, ids, marker=5)
+
+    def test_get_cache_size(self):
+        self.assertEqual(0, self.cache.get_cache_size())
+        self.cache_image(1, "0123456789")
+        self.cache_image(2, "01234")
+        self.assertEqual(15, self.cache.get_cache_size())
+
+    def test_get_images_to_evict(self):
+        self.cache_image(1, "0123456789")
+        os.utime(self.cache.path_for_image(1), (100, 100))
+        self.cache_image(2, "01234")
+        os.utime(self.cache.path_for_image(2), (200, 200))
+
+        self.assertEqual(([], True),
+                         self.cache.driver.get_images_to_evict(5, 20))
+        self.assertEqual(([(1, 10)], True),
+                         self.cache.driver.get_images_to_evict(10, 20))
+        self.assertEqual(([(1, 10), (2, 5)], True),
+                         self.cache.driver.get_images_to_evict(16, 20))
+        self.assertEqual(([(1, 10), (2, 5)], False),
+                         self.cache.driver.get_images_to_evict(21, 20))
+
+    def test_get_least_recently_accessed_empty(self):
+        self.assertEqual(None, self.cache.get_least_recently_accessed())
+
+    def test_purge(self):
+        self.cache_image(1, "0123456789")
+        self.cache_image(2, "01234")
+        self.cache.purge(1)
+
+        self.assertFalse(self.cache.hit(1))
+        self.assertEqual([2], [e['id'] for e in self.cache.entries()])
+        self.assertEqual(5, self.cache.get_cache_size())
+
+    def test_clear(self):
+        self.cache_image(1, "0123456789")
+        self.cache_image(2, "01234")
+
+        self.assertEqual(2, self.cache.clear())
+        self.assertFalse(self.cache.hit(1))
+        self.assertFalse(self.cache.hit(2))
+        self.assertEqual([], list(self.cache.entries()))
+
+    def test_prune_looks_at_cache_once(self):
+        self.options['image_cache_max_size_bytes'] = '2'
+        self.options['image_cache_percent_extra_to_free'] = '0'
+        self.cache_image(1, "0123456789")
+        self.cache_image(2, "01234")
+
+        pruner_ = pruner.Pruner(self.options)
+        calls = []
+        get_images_to_evict = pruner_.cache.driver.get_images_to_evict
+
+        def fake_get_images_to_evict(*args):
+            calls.append(args)
+            return get_images_to_evict(*args)
+
+        self.stubs.Set(pruner_.cache.driver, 'get_images_to_evict',
+                       fake_get_images_to_evict)
+        self.stubs.Set(pruner_.cache.driver, 'get_least_recently_accessed',
+                       None)
+        pruner_.run()
+
+        self.assertEqual([(0, 2)], calls)
+        self.assertFalse(self.cache.hit(1))
+        self.assertFalse(self.cache.hit(2))
+
+    def test_reserve_evicts_lru(self):
+        self.options['image_cache_max_size_bytes'] = '12'
+        self.cache_image(1, "0123456789")
+
+        self.assertTrue(self.cache.reserve({'id': 2, 'size': 5}))
+        self.assertFalse(self.cache.hit(1))
+
+    def test_reserve_too_large(self):
+        self.options['image_cache_max_size_bytes'] = '12'
+        self.cache_image(1, "0123456789")
+
+        self.assertFalse(self.cache.reserve({'id': 2, 'size': 13}))
+        self.assertFalse(self.cache.reserve({'id': 3, 'size': 0}))
+        self.assertTrue(self.cache.hit(1))
+
+    def test_reserve_counts_reservations(self):
+        self.options['image_cache_max_size_bytes'] = '12'
+        self.assertTrue(self.cache.reserve({'id': 1, 'size': 8}))
+        self.assertFalse(self.cache.reserve({'id': 2, 'size': 8}))
+
+    def test_reserve_already_reserved(self):
+        self.options['image_cache_max_size_bytes'] = '12'
+        self.cache_image(1, "0123456789")
+
+        self.assertTrue(self.cache.reserve({'id': 2, 'size': 1}))
+        self.assertFalse(self.cache.reserve({'id': 2, 'size': 1}))
+        self.assertTrue(self.cache.hit(1))
+
+    def test_reservation_released_after_write(self):
+        self.options['image_cache_max_size_bytes'] = '12'
+        self.assertTrue(self.cache.reserve({'id': 1, 'size': 5}))
+        self.cache_image(1, "01234")
+
+        self.assertTrue(self.cache.reserve({'id': 2, 'size': 7}))
+        self.assertTrue(self.cache.hit(1))
+
+    def test_reservation_released_after_failed_write(self):
+        self.options['image_cache_max_size_bytes'] = '12'
+        image_meta = {'id': 1, 'name': 'image1', 'size': 5}
+        self.assertTrue(self.cache.reserve(image_meta))
+        try:
+            with self.cache.open(image_meta, 'wb') as cache_file:
+                raise IOError
+        except IOError:
+            pass
+
+        self.assertTrue(self.cache.reserve({'id': 2, 'size': 12}))
+
+    def test_abandoned_write_rolled_back(self):
+        image_meta = {'id': 1, 'name': 'image1', 'size': 10}
+        self.assertTrue(self.cache.reserve(image_meta))
+
+        def tee():
+            with self.cache.open(image_meta, 'wb') as cache_file:
+                for chunk in ("01234", "56789"):
+                    cache_file.write(chunk)
+                    yield chunk
+
+        chunks = tee()
+        self.assertEqual("01234", chunks.next())
+        chunks.close()
+
+        self.assertFalse(self.cache.is_image_currently_being_written(1))
+        self.assertFalse(os.path.exists(
+            self.cache.incomplete_path_for_image(1)))
+        self.assertEqual([1], [e['id'] for e in self.cache.invalid_entries()])
+        # NOTE: The next miss tees the image into the cache again rather
+        # than following the abandoned write
+        self.assertTrue(self.cache.reserve(image_meta))
+
+    def test_write_verifies_checksum(self):
+        self.cache_image(1, "0123456789",
+                         checksum=hashlib.md5("0123456789").hexdigest())
+        self.assertTrue(self.cache.hit(1))
+
+    def test_write_checksum_mismatch(self):
+        self.cache_image(1, "0123456789",
+                         checksum=hashlib.md5("9876543210").hexdigest())
+
+        self.assertFalse(self.cache.hit(1))
+        self.assertEqual([1], [e['id'] for e in self.cache.invalid_entries()])
+        self.assertEqual(0, self.cache.get_cache_size())
+
+    def test_write_size_mismatch(self):
+        self.cache_image(1, "0123456789", size=11)
+
+        self.assertFalse(self.cache.hit(1))
+        self.assertEqual([1], [e['id'] for e in self.cache.invalid_entries()])
+
+    def test_verifier(self):
+        self.options['image_cache_verifier_max_bytes_per_second'] = '0'
+        self.cache_image(1, "0123456789",
+                         checksum=hashlib.md5("0123456789").hexdigest())
+        self.cache_image(2, "01234",
+                         checksum=hashlib.md5("01234").hexdigest())
+        self.cache_image(3, "012")
+        self.assertEqual([], self.cache.get_images_to_verify(0))
+
+        with open(self.cache.path_for_image(2), 'r+b') as cache_file:
+            cache_file.write("X")
+
+        verifier.Verifier(self.options).run()
+        self.assertEqual([], self.cache.get_images_to_verify(0))
+
+        self.options['image_cache_verify_interval'] = '-60'
+        verifier.Verifier(self.options).run()
+
+        self.assertTrue(self.cache.hit(1))
+        self.assertFalse(self.cache.hit(2))
+        self.assertTrue(self.cache.hit(3))
+        self.assertEqual([2], [e['id'] for e in self.cache.invalid_entries()])
+        self.assertEqual([], self.cache.get_images_to_verify(0))
+
+    def test_verifier_read_error(self):
+        self.options['image_cache_verifier_max_bytes_per_second'] = '0'
+        self.options['image_cache_verify_interval'] = '-60'
+        self.cache_image(1, "0123456789",
+                         checksum=hashlib.md5("0123456789").hexdigest())
+        self.cache_image(2, "01234",
+                         checksum=hashlib.md5("01234").hexdigest())
+
+        bad_path = self.cache.path_for_image(1)
+        chunkiter = utils.chunkiter
+
+        def fake_chunkiter(fp, *args, **kwargs):
+            if fp.name == bad_path:
+                raise IOError(errno.EIO, "Input/output error")
+            return chunkiter(fp, *args, **kwargs)
+
+        self.stubs.Set(utils, 'chunkiter', fake_chunkiter)
+        verifier.Verifier(self.options).run()
+
+        self.assertFalse(self.cache.hit(1))
+        self.assertTrue(self.cache.hit(2))
+        self.assertEqual([1], [e['id'] for e in self.cache.invalid_entries()])
+
+
+class TestXattrDriver(ImageCacheDriverTests, unittest.TestCase):
+
+    driver = 'xattr'
+
+    def test_reservations_shared_between_processes(self):
+        self.options['image_cache_max_size_bytes'] = '12'
+        other_cache = image_cache.ImageCache(self.options)
+        self.assertTrue(self.cache.reserve({'id': 1, 'size': 8}))
+
+        self.assertTrue(other_cache.driver.is_reserved(1))
+        self.assertFalse(other_cache.reserve({'id': 1, 'size': 8}))
+        self.assertFalse(other_cache.reserve({'id': 2, 'size': 8}))
+
+        self.cache.driver.delete_reservation(1)
+        self.assertFalse(other_cache.driver.is_reserved(1))
+        self.assertTrue(other_cache.reserve({'id': 2, 'size': 8}))
+        self.assertFalse(self.cache.reserve({'id': 3, 'size': 8}))
+
+    def test_stale_reservation_expires(self):
+        self.options['image_cache_max_size_bytes'] = '12'
+        self.options['image_cache_stall_timeout'] = '60'
+        self.assertTrue(self.cache.reserve({'id': 1, 'size': 8}))
+        reserved_at = time.time() - 61
+        os.utime(self.cache.driver._reservation_path(1),
+                 (reserved_at, reserved_at))
+
+        self.assertFalse(self.cache.driver.is_reserved(1))
+        self.assertTrue(self.cache.reserve({'id': 2, 'size': 8}))
+
+
+class TestSqliteDriver(ImageCacheDriverTests, unittest.TestCase):
+
+    driver = 'sqlite'
+
+    def stub_time(self, now):
+        self.stubs.Set(sqlite.time, 'time', lambda: now)
+
+    def test_record_hit(self):
+        self.stub_time(100.0)
+        image_meta = self.cache_image(1, "0123456789")
+        self.stub_time(200.0)
+        self.cache.open_for_read(image_meta).close()
+
+        entry = list(self.cache.entries())[0]
+        self.assertEqual('image1', entry['name'])
+        self.assertEqual(10, entry['expected_size'])
+        self.assertEqual(1, entry['hits'])
+        self.assertEqual('1970-01-01T00:03:20', entry['last_accessed'])
+        self.assertEqual('1970-01-01T00:01:40', entry['last_modified'])
+
+    def test_get_least_recently_accessed(self):
+        self.stub_time(100.0)
+        image_meta = self.cache_image(1, "0123456789")
+        self.stub_time(200.0)
+        self.cache_image(2, "01234")
+        self.assertEqual((1, 10), self.cache.get_least_recently_accessed())
+
+        self.stub_time(300.0)
+        self.cache.open_for_read(image_meta).close()
+        self.assertEqual((2, 5), self.cache.get_least_recently_accessed())
+
+    def test_clear_keeps_database(self):
+        self.cache_image(1, "0123456789")
+        self.cache.clear()
+        self.assertTrue(os.path.exists(self.cache.driver.db_path))
+
+    def test_import_existing_entries(self):
+        with open(os.path.join(self.cache_dir, '3'), 'wb') as f:
+            f.write("012")
+
+        cache = image_cache.ImageCache(self.options)
+        entries = list(cache.entries())
+        self.assertEqual([3], [e['id'] for e in entries])
+        self.assertEqual(3, cache.get_cache_size())
+
+    def test_upgrade_database(self):
+        self.cache_image(1, "0123456789")
+        with self.cache.driver.get_db() as db:
+            db.execute("DROP TABLE cached_images")
+            db.execute("""CREATE TABLE cached_images (
+                              image_id INTEGER PRIMARY KEY,
+                              name TEXT,
+                              size INTEGER NOT NULL,
+                              expected_size INTEGER,
+                              hits INTEGER NOT NULL DEFAULT 0,
+                              last_accessed REAL NOT NULL,
+                              last_modified REAL NOT NULL)""")
+            db.execute("""INSERT INTO cached_images
+                          (image_id, name, size, last_accessed,
+                           last_modified)
+                          VALUES (1, 'image1', 10, 100, 100)""")
+
+        self.cache = image_cache.ImageCache(self.options)
+        self.assertEqual([1], [e['id'] for e in self.cache.entries()])
+
+        checksum = hashlib.md5("01234").hexdigest()
+        self.cache_image(2, "01234", checksum=checksum)
+        self.cache.driver.record_verified(2, 0)
+        self.assertEqual([(2, checksum)],
+                         self.cache.get_images_to_verify(1))
+
+    def test_hits_are_flushed_in_batches(self):
+        self.options['image_cache_hit_flush_interval'] = '60'
+        self.stub_time(100.0)
+        image_meta = self.cache_image(1, "0123456789")
+        self.stub_time(200.0)
+        self.cache.open_for_read(image_meta).close()
+        self.stub_time(300.0)
+        self.cache.open_for_read(image_meta).close()
+
+        entry = list(self.cache.entries())[0]
+        self.assertEqual(0, entry['hits'])
+        self.assertEqual('1970-01-01T00:01:40', entry['last_accessed'])
+
+        self.cache.flush_hits()
+        entry = list(self.cache.entries())[0]
+        self.assertEqual(2, entry['hits'])
+        self.assertEqual('1970-01-01T00:05:00', entry['last_accessed'])
+
+    def test_reserve_flushes_hits(self):
+        self.options['image_cache_hit_flush_interval'] = '60'
+        self.options['image_cache_max_size_bytes'] = '12'
+        self.stub_time(100.0)
+        image_meta = self.cache_image(1, "0123")
+        self.stub_time(200.0)
+        self.cache_image(2, "0123")
+        self.stub_time(300.0)
+        self.cache.open_for_read(image_meta).close()
+
+        self.assertTrue(self.cache.reserve({'id': 3, 'size': 5}))
+        self.assertTrue(self.cache.hit(1))
+        self.assertFalse(self.cache.hit(2))
+
+    def test_reserve_tinylfu_rejects_infrequent_image(self):
+        self.options['image_cache_max_size_bytes'] = '12'
+        self.options['image_cache_admission_policy'] = 'tinylfu'
+        self.cache_image(1, "0123456789")
+        for i in xrange(3):
+            self.cache.record_access(1)
+
+        image_meta = {'id': 2, 'size': 5}
+        self.cache.record_access(2)
+        self.assertFalse(self.cache.reserve(image_meta))
+        self.assertTrue(self.cache.hit(1))
+
+        for i in xrange(3):
+            self.cache.record_access(2)
+        self.assertTrue(self.cache.reserve(image_meta))
+        self.assertFalse(self.cache.hit(1))
+
+    def test_reserve_rejected_by_later_victim_evicts_nothing(self):
+        self.options['image_cache_max_size_bytes'] = '12'
+        self.options['image_cache_admission_policy'] = 'tinylfu'
+        self.stub_time(100.0)
+        self.cache_image(1, "0123")
+        self.stub_time(200.0)
+        self.cache_image(2, "0123")
+        self.cache.record_access(1)
+        for i in xrange(3):
+            self.cache.record_access(2)
+
+        # NOTE: Image 3 is admitted in favour of image 1, the first victim,
+        # but not of image 2, the second
+        for i in xrange(2):
+            self.cache.record_access(3)
+        self.assertFalse(self.cache.reserve({'id': 3, 'size': 10}))
+        self.assertTrue(self.cache.hit(1))
+        self.assertTrue(self.cache.hit(2))
+
+    def test_reserve_force_skips_admission_policy(self):
+        self.options['image_cache_max_size_bytes'] = '12'
+        self.options['image_cache_admission_policy'] = 'tinylfu'
+        self.cache_image(1, "0123456789")
+        self.cache.record_access(1)
+
+        self.assertTrue(self.cache.reserve({'id': 2, 'size': 5}, force=True))
+        self.assertFalse(self.cache.hit(1))
+
+    def test_stale_reservation_expires(self):
+        self.options['image_cache_max_size_bytes'] = '12'
+        self.options['image_cache_stall_timeout'] = '60'
+        self.stub_time(100.0)
+        self.assertTrue(self.cache.reserve({'id': 1, 'size': 8}))
+        self.stub_time(161.0)
+        self.assertTrue(self.cache.reserve({'id': 2, 'size': 8}))
+
+    def test_prune(self):
+        self.options['image_cache_max_size_bytes'] = '12'
+        self.options['image_cache_percent_extra_to_free'] = '0'
+
+        self.stub_time(100.0)
+        image_meta = self.cache_image(1, "0123456789")
+        self.stub_time(200.0)
+        self.cache_image(2, "01234")
+        self.stub_time(300.0)
+        self.cache.open_for_read(image_meta).close()
+
+        pruner.Pruner(self.options).run()
+
+        self.assertTrue(self.cache.hit(1))
+        self.assertFalse(self.cache.hit(2))
+        self.assertEqual(10, self.cache.get_cache_size())
+
+
+class TestCachedImagesController(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.options = {'image_cache_enabled': 'True',
+                        'image_cache_datadir': self.cache_dir,
+                        'limit_param_default': '2',
+                        'api_limit_max': '3'}
+        self.controller = cached_images.Controller(self.options)
+        for image_id, data in ((1, "0123456789"), (2, "01234"),
+                               (3, "0123456"), (4, "012")):
+            image_meta = {'id': image_id, 'name': 'image%d' % image_id,
+                          'size': len(data)}
+            with self.controller.cache.open(image_meta, 'wb') as cache_file:
+                cache_file.write(data)
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+    def index(self, query=''):
+        req = webob.Request.blank('/cached_images' + query)
+        return [e['id'] for e in self.controller.index(req)['cached_images']]
+
+    def test_index_limit(self):
+        self.assertEqual([1, 2], self.index())
+        self.assertEqual([1, 2, 3], self.index('?limit=10'))
+        self.assertEqual([3, 4], self.index('?marker=2'))
+
+    def test_index_sort(self):
+        self.assertEqual([1, 3], self.index('?sort_key=size&sort_dir=desc'))
+        self.assertEqual([3, 1], self.index('?sort_key=size&size_min=6'))
+
+    def test_index_invalid_params(self):
+        for query in ('?limit=-1', '?limit=a', '?marker=a', '?marker=5',
+                      '?sort_key=name', '?sort_dir=up', '?size_min=a'):
+            self.assertRaises(webob.exc.HTTPBadRequest, self.index, query)
+
+    def test_index_invalid_entries(self):
+        self.controller.cache.invalidate(1, "corrupt")
+        self.controller.cache.invalidate(2, "corrupt")
+        self.controller.cache.invalidate(3, "corrupt")
+        self.assertEqual([2, 3], self.index('?status=invalid&marker=1'))
+
+
+class TestMemoryCache(unittest.TestCase):
+
+    def test_lru_eviction(self):
+        memory_cache = memory.MemoryCache(10, 5)
+        self.assertTrue(memory_cache.add(1, "0123"))
+        self.assertTrue(memory_cache.add(2, "0123"))
+        memory_cache.get(1)
+        self.assertTrue(memory_cache.add(3, "0123"))
+
+        self.assertEqual("0123", memory_cache.get(1))
+        self.assertEqual(None, memory_cache.get(2))
+        self.assertEqual("0123", memory_cache.get('3'))
+        self.assertEqual(8, memory_cache.size)
+
+    def test_rejects_large_images(self):
+        memory_cache = memory.MemoryCache(10, 5)
+        self.assertFalse(memory_cache.add(1, "012345"))
+        self.assertEqual(None, memory_cache.get(1))
+        self.assertEqual(0, memory_cache.size)
+
+    def test_disabled(self):
+        memory_cache = memory.MemoryCache(0, 5)
+        self.assertFalse(memory_cache.accepts(1))
+        self.assertFalse(memory_cache.add(1, "0"))
+
+    def test_remove(self):
+        memory_cache = memory.MemoryCache(10, 5)
+        memory_cache.add(1, "0123")
+        memory_cache.remove('1')
+        self.assertEqual(None, memory_cache.get(1))
+        self.assertEqual(0, memory_cache.size)
+
+
+class TestImageCacheMemoryTier(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        options = {'image_cache_enabled': 'True',
+                   'image_cache_datadir': self.cache_dir,
+                   'image_cache_memory_max_size_bytes': '100',
+                   'image_cache_memory_max_image_size_bytes': '10',
+                   'image_cache_hit_flush_interval': '0'}
+        self.cache = image_cache.ImageCache(options)
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+    def cache_image(self, image_id, data):
+        image_meta = {'id': image_id, 'name': 'image%d' % image_id,
+                      'size': len(data)}
+        with self.cache.open(image_meta, 'wb') as cache_file:
+            cache_file.write(data)
+        return image_meta
+
+    def test_load_into_memory(self):
+        image_meta = self.cache_image(1, "0123456789")
+        self.assertEqual(None, self.cache.get_from_memory(image_meta))
+
+        self.assertEqual("0123456789", self.cache.load_into_memory(image_meta))
+        self.assertEqual("0123456789", self.cache.get_from_memory(image_meta))
+
+    def test_large_images_stay_on_disk(self):
+        image_meta = self.cache_image(1, "0123456789X")
+        self.assertEqual(None, self.cache.load_into_memory(image_meta))
+        self.assertEqual(None, self.cache.get_from_memory(image_meta))
+
+    def test_memory_tier_is_shared(self):
+        image_meta = self.cache_image(1, "0123456789")
+        self.cache.load_into_memory(image_meta)
+
+        cache = image_cache.ImageCache(self.cache.options)
+        self.assertEqual("0123456789", cache.get_from_memory(image_meta))
+
+        cache.purge(1)
+        self.assertEqual(None, self.cache.get_from_memory(image_meta))
+
+
+class TestPeers(unittest.TestCase):
+
+    NODES = ['10.0.0.1:9292', '10.0.0.2:9292', '10.0.0.3:9292']
+
+    def test_hash_ring_spreads_keys(self):
+        ring = peers.HashRing(self.NODES)
+        owners = [ring.get_node(image_id) for image_id in xrange(3000)]
+        for node in self.NODES:
+            self.assertTrue(700 < owners.count(node) < 1300)
+        self.assertEqual(owners, [peers.HashRing(self.NODES).get_node(i)
+                                  for i in xrange(3000)])
+
+    def test_hash_ring_removing_node_only_moves_its_keys(self):
+        ring = peers.HashRing(self.NODES)
+        smaller_ring = peers.HashRing(self.NODES[:2])
+        for image_id in xrange(1000):
+            owner = ring.get_node(image_id)
+            if owner != self.NODES[2]:
+                self.assertEqual(owner, smaller_ring.get_node(image_id))
+
+    def test_hash_ring_empty(self):
+        self.assertEqual(None, peers.HashRing([]).get_node(1))
+
+    def test_router_disabled(self):
+        router = peers.PeerRouter({})
+        self.assertFalse(router.enabled)
+        self.assertEqual(None, router.get_owner(webob.Request.blank('/'), 1))
+
+    def test_router_get_owner(self):
+        options = {'image_cache_peers': ','.join(self.NODES),
+                   'image_cache_peer_self': self.NODES[0]}
+        router = peers.PeerRouter(options)
+        ring = peers.HashRing(self.NODES)
+        req = webob.Request.blank('/images/1')
+        for image_id in xrange(10):
+            owner = ring.get_node(image_id)
+            if owner == self.NODES[0]:
+                owner = None
+            self.assertEqual(owner, router.get_owner(req, image_id))
+
+        req.headers[peers.PEER_REQUEST_HEADER] = 'True'
+        for image_id in xrange(10):
+            self.assertEqual(None, router.get_owner(req, image_id))
+
+    def test_fill_tries_peers_in_order(self):
+        asked = []
+
+        def fake_get_from_peer(peer, req, path, headers=None,
+                               use_ssl=False):
+            asked.append(peer)
+            self.assertTrue(headers[peers.CACHE_ONLY_HEADER])
+            self.assertTrue(use_ssl)
+            if peer == self.NODES[0]:
+                raise exception.ClientConnectionError("peer down")
+            if peer == self.NODES[1]:
+                raise exception.NotFound()
+            return iter(["data"])
+
+        stubs = stubout.StubOutForTesting()
+        stubs.Set(peers, 'get_from_peer', fake_get_from_peer)
+        try:
+            fill = peers.PeerFill({'image_cache_fill_peers':
+                                   ','.join(self.NODES),
+                                   'image_cache_peer_use_ssl': 'True'})
+            peer, chunks = fill.fetch(webob.Request.blank('/images/1'))
+            self.assertEqual(self.NODES[2], peer)
+            self.assertEqual(["data"], list(chunks))
+            self.assertEqual(self.NODES, asked)
+
+            fill = peers.PeerFill({'image_cache_fill_peers':
+                                   ','.join(self.NODES[:2]),
+                                   'image_cache_peer_use_ssl': 'True'})
+            self.assertEqual(None, fill.fetch(webob.Request.blank('/')))
+        finally:
+            stubs.UnsetAll()
+
+    def test_get_from_peer_ssl(self):
+        clients = []
+
+        def fake_do_request(client, method, path, headers=None):
+            clients.append(client)
+            raise exception.NotFound()
+
+        stubs = stubout.StubOutForTesting()
+        stubs.Set(peers.client.BaseClient, 'do_request', fake_do_request)
+        try:
+            req = webob.Request.blank('/images/1')
+            for use_ssl in (False, True):
+                self.assertRaises(exception.NotFound, peers.get_from_peer,
+                                  self.NODES[0], req, req.path,
+                                  use_ssl=use_ssl)
+            self.assertEqual([False, True], [c.use_ssl for c in clients])
+        finally:
+            stubs.UnsetAll()
+
+    def test_router_misconfigured(self):
+        nodes = ','.join(self.NODES)
+        for options in ({'image_cache_peers': nodes},
+                        {'image_cache_peers': nodes,
+                         'image_cache_peer_self': '10.0.0.4:9292'},
+                        {'image_cache_peers': nodes,
+                         'image_cache_peer_self': self.NODES[0],
+                         'image_cache_peer_mode': 'teleport'},
+                        {'image_cache_peers': '10.0.0.1,10.0.0.2',
+                         'image_cache_peer_self': '10.0.0.1'}):
+            self.assertRaises(RuntimeError, peers.PeerRouter, options)
+
+
+class TestAdmissionPolicies(unittest.TestCase):
+
+    def test_count_min_sketch(self):
+        sketch = policies.CountMinSketch(64, sample_size=1000)
+        for i in xrange(5):
+            sketch.add('1')
+        sketch.add('2')
+
+        self.assertTrue(sketch.estimate('1') >= 5)
+        self.assertTrue(sketch.estimate('2') >= 1)
+        self.assertTrue(sketch.estimate('1') > sketch.estimate('2'))
+
+    def test_count_min_sketch_caps_counts(self):
+        sketch = policies.CountMinSketch(64, max_count=3, sample_size=1000)
+        for i in xrange(10):
+            sketch.add('1')
+        self.assertEqual(3, sketch.estimate('1'))
+
+    def test_count_min_sketch_ages(self):
+        sketch = policies.CountMinSketch(64, max_count=15, sample_size=8)
+        for i in xrange(8):
+            sketch.add('1')
+        self.assertEqual(4, sketch.estimate('1'))
+        self.assertEqual(4, sketch.additions)
+
+    def test_lru_admits_everything(self):
+        policy = policies.LRUPolicy({})
+        self.assertTrue(policy.admit((1, 10), (2, 10)))
+
+    def test_tinylfu(self):
+        policy = policies.TinyLFUPolicy({})
+        policy.record_access(1)
+        policy.record_access(2)
+        policy.record_access(2)
+
+        self.assertFalse(policy.admit((1, 10), (2, 10)))
+        self.assertTrue(policy.admit((2, 10), (1, 10)))
+
+    def test_size_aware_gdsf(self):
+        policy = policies.SizeAwareGDSFPolicy({})
+        policy.record_access(1)
+        policy.record_access(2)
+        policy.record_access(2)
+
+        # Twice as popular, but ten times as large
+        self.assertFalse(policy.admit((2, 100), (1, 10)))
+        self.assertTrue(policy.admit((1, 10), (2, 100)))
+
+
+class TestPrefetcher(unittest.TestCase):
+    def setUp(self):
+        self.stubs = stubout.StubOutForTesting()
+        self.cache_dir = tempfile.mkdtemp()
+        self.options = {'image_cache_enabled': 'True',
+                        'image_cache_datadir': self.cache_dir,
+                        'image_cache_prefetcher_workers': '4'}
+        self.cache = image_cache.ImageCache(self.options)
+
+        def fake_get_image_metadata(options, context, image_id):
+            image_id = int(image_id)
+            return {'id': image_id, 'name': 'image%d' % image_id,
+                    'size': 5, 'location': self.locations[image_id]}
+
+        self.stubs.Set(registry, 'get_image_metadata',
+                       fake_get_image_metadata)
+        self.locations = {}
+
+    def tearDown(self):
+        self.stubs.UnsetAll()
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+    def queue_prefetch(self, image_id, priority=0, queued_at=None,
+                       location='file:///tmp/image'):
+        self.locations[image_id] = location
+        self.cache.queue_prefetch({'id': image_id, 'name': 'image'},
+                                  priority=priority)
+        if queued_at is not None:
+            path = os.path.join(self.cache.prefetch_path, str(image_id))
+            os.utime(path, (queued_at, queued_at))
+
+    def test_queue_order(self):
+        self.queue_prefetch(1, queued_at=100)
+        self.queue_prefetch(2, priority=5, queued_at=300)
+        self.queue_prefetch(3, queued_at=200)
+
+        queue = prefetcher.PrefetchQueue(self.cache)
+        queue.refresh()
+        queue.refresh()
+        self.assertEqual(3, len(queue))
+        self.assertEqual(['2', '1', '3'],
+                         [queue.pop(), queue.pop(), queue.pop()])
+        self.assertRaises(IndexError, queue.pop)
+
+    def test_queue_skips_dequeued_images(self):
+        self.queue_prefetch(1, priority=5)
+        self.queue_prefetch(2)
+
+        queue = prefetcher.PrefetchQueue(self.cache)
+        queue.refresh()
+        self.cache.delete_queued_prefetch_image(1)
+        self.assertEqual('2', queue.pop())
+
+    def test_prefetch_entries_priority(self):
+        self.queue_prefetch(1, priority=5)
+        entries = list(self.cache.prefetch_entries())
+        self.assertEqual(5, entries[0]['priority'])
+        self.assertEqual('queued', entries[0]['status'])
+
+    def test_run_prefetches_concurrently(self):
+        active = {'file': 0, 'swift': 0}
+        max_active = {'file': 0, 'swift': 0}
+
+        def fake_get_from_backend(location, **kwargs):
+            scheme = location.split(':')[0]
+            active[scheme] += 1
+            max_active[scheme] = max(max_active[scheme], active[scheme])
+            eventlet.sleep(0)
+            active[scheme] -= 1
+            return ["01234"]
+
+        self.stubs.Set(prefetcher, 'get_from_backend', fake_get_from_backend)
+        self.options['image_cache_prefetcher_backend_workers'] = 'swift:1'
+        for image_id in xrange(1, 4):
+            self.queue_prefetch(image_id)
+        for image_id in xrange(4, 7):
+            self.queue_prefetch(image_id, location='swift://a/b/c')
+
+        prefetcher.Prefetcher(self.options).run()
+
+        for image_id in xrange(1, 7):
+            self.assertTrue(self.cache.hit(image_id))
+        self.assertEqual([], list(self.cache.prefetch_entries()))
+        self.assertEqual(3, max_active['file'])
+        self.assertEqual(1, max_active['swift'])
+
+    def test_run_continues_after_failed_prefetch(self):
+        def fake_get_from_backend(location, **kwargs):
+            if location == 'file:///bad':
+                raise IOError
+            return ["01234"]
+
+        self.stubs.Set(prefetcher, 'get_from_backend', fake_get_from_backend)
+        self.queue_prefetch(1, priority=5, location='file:///bad')
+        self.queue_prefetch(2)
+
+        prefetcher.Prefetcher(self.options).run()
+
+        self.assertFalse(self.cache.hit(1))
+        self.assertTrue(self.cache.hit(2))
+        self.assertEqual([], list(self.cache.prefetch_entries()))
+
+    def test_invalid_backend_workers(self):
+        self.options['image_cache_prefetcher_backend_workers'] = 'swift'
+        self.assertRaises(RuntimeError, prefetcher.Prefetcher, self.options)
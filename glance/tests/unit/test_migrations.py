@@ -26,12 +26,14 @@ if possible.
 
 import ConfigParser
 import datetime
+import hashlib
 import os
 import unittest
 import urlparse
 
 from migrate.versioning.repository import Repository
 from sqlalchemy import *
+from sqlalchemy.engine.reflection import Inspector
 from sqlalchemy.pool import NullPool
 
 from glance.common import exception
@@ -256,3 +258,106 @@ class TestMigrations(unittest.TestCase):
         last_num_image_properties = conn.execute(sel).scalar()
 
         self.assertEqual(num_image_properties - 2, last_num_image_properties)
+
+    def test_property_value_hash_9_to_10(self):
+        """
+        Tests that the upgrade to 10 fills in the value hashes of the
+        existing image properties, and that the downgrade keeps the
+        properties
+        """
+        for key, engine in self.engines.items():
+            options = {'sql_connection': TestMigrations.TEST_DATABASES[key]}
+            self._property_value_hash_9_to_10(engine, options)
+
+    def _property_value_hash_9_to_10(self, engine, options):
+        migration_api.version_control(options)
+        migration_api.upgrade(options, 9)
+
+        images_table = Table('images', MetaData(), autoload=True,
+                             autoload_with=engine)
+        image_properties_table = Table('image_properties', MetaData(),
+                                       autoload=True,
+                                       autoload_with=engine)
+
+        now = datetime.datetime.now()
+        conn = engine.connect()
+        conn.execute(images_table.insert(), [
+                {'id': 1, 'deleted': False, 'created_at': now,
+                 'status': 'active', 'is_public': True}])
+        conn.execute(image_properties_table.insert(), [
+                {'image_id': 1, 'name': 'distro', 'value': 'fedora',
+                 'deleted': False, 'created_at': now},
+                {'image_id': 1, 'name': 'kernel_id', 'value': None,
+                 'deleted': False, 'created_at': now}])
+        conn.close()
+
+        migration_api.upgrade(options, 10)
+
+        image_properties_table = Table('image_properties', MetaData(),
+                                       autoload=True,
+                                       autoload_with=engine)
+
+        conn = engine.connect()
+        sel = select([image_properties_table.c.name,
+                      image_properties_table.c.value_hash]).\
+                     order_by(image_properties_table.c.name)
+        self.assertEqual([('distro', hashlib.md5('fedora').hexdigest()),
+                          ('kernel_id', None)],
+                         [tuple(row) for row in conn.execute(sel)])
+        conn.close()
+
+        migration_api.downgrade(options, 9)
+
+        image_properties_table = Table('image_properties', MetaData(),
+                                       autoload=True,
+                                       autoload_with=engine)
+
+        self.assertTrue('value_hash' not in image_properties_table.c)
+
+        conn = engine.connect()
+        sel = select([func.count("*")], from_obj=[image_properties_table])
+        self.assertEqual(2, conn.execute(sel).scalar())
+        conn.close()
+
+    def test_indexes_9_to_10_to_9_to_10(self):
+        """
+        Tests that downgrading from 10 leaves image_properties with exactly
+        the indexes it had on 9, and that 10 can be upgraded to again
+        """
+        for key, engine in self.engines.items():
+            options = {'sql_connection': TestMigrations.TEST_DATABASES[key]}
+            self._indexes_9_to_10_to_9_to_10(engine, options)
+
+    def _get_indexes(self, engine, table_name):
+        indexes = Inspector.from_engine(engine).get_indexes(table_name)
+        return sorted((index['name'], tuple(index['column_names']),
+                       bool(index['unique'])) for index in indexes)
+
+    def _indexes_9_to_10_to_9_to_10(self, engine, options):
+        migration_api.version_control(options)
+        migration_api.upgrade(options, 9)
+
+        # NOTE: Databases that came a different way to 9 may have other
+        # indexes, which the downgrade has to keep as well
+        image_properties_table = Table('image_properties', MetaData(),
+                                       autoload=True,
+                                       autoload_with=engine)
+        Index('ix_image_properties_image_id',
+              image_properties_table.c.image_id).create(engine)
+        Index('ix_image_properties_deleted',
+              image_properties_table.c.deleted).create(engine)
+        indexes_9 = self._get_indexes(engine, 'image_properties')
+
+        migration_api.upgrade(options, 10)
+        indexes_10 = self._get_indexes(engine, 'image_properties')
+        self.assertTrue(('ix_image_properties_name_value_hash',
+                         ('name', 'value_hash', 'image_id'), False)
+                        in indexes_10)
+
+        migration_api.downgrade(options, 9)
+        self.assertEqual(indexes_9,
+                         self._get_indexes(engine, 'image_properties'))
+
+        migration_api.upgrade(options, 10)
+        self.assertEqual(indexes_10,
+                         self._get_indexes(engine, 'image_properties'))
@@ -0,0 +1,189 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2011 OpenStack, LLC
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import unittest
+
+import stubout
+
+from glance.common import context
+from glance.common import notifier
+from glance import registry
+from glance.registry import cache
+
+
+class FakeRegistryClient(object):
+
+    def __init__(self, images):
+        self.images = images
+        self.calls = []
+
+    def get_image(self, image_id):
+        self.calls.append(('get_image', image_id))
+        return dict(self.images[image_id])
+
+    def update_image(self, image_id, image_meta, purge_props):
+        self.calls.append(('update_image', image_id))
+        self.images[image_id].update(image_meta)
+        return dict(self.images[image_id])
+
+    def delete_image(self, image_id):
+        self.calls.append(('delete_image', image_id))
+        del self.images[image_id]
+
+
+class TestMetadataCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = cache.MetadataCache(max_size=2, ttl=10)
+        self.context = context.RequestContext(tenant='tenant1')
+        self.image = {'id': 1, 'status': 'active', 'properties': {}}
+
+    def test_get_added(self):
+        self.cache.add(self.context, 1, self.image)
+        image_meta = self.cache.get(self.context, 1)
+
+        self.assertEqual(self.image, image_meta)
+        image_meta['properties']['foo'] = 'bar'
+        self.assertEqual({}, self.cache.get(self.context, 1)['properties'])
+
+    def test_only_active_images(self):
+        self.cache.add(self.context, 1, dict(self.image, status='saving'))
+        self.assertEqual(None, self.cache.get(self.context, 1))
+
+    def test_scopes(self):
+        self.cache.add(self.context, 1, self.image)
+
+        other = context.RequestContext(tenant='tenant2')
+        admin = context.RequestContext(tenant='tenant1', is_admin=True)
+        self.assertEqual(None, self.cache.get(other, 1))
+        self.assertEqual(None, self.cache.get(admin, 1))
+
+    def test_expired(self):
+        self.cache.add(self.context, 1, self.image)
+        self.cache.ttl = -1
+        self.cache.add(self.context, 2, self.image)
+
+        self.assertEqual(self.image, self.cache.get(self.context, 1))
+        self.assertEqual(None, self.cache.get(self.context, 2))
+
+    def test_lru_eviction(self):
+        self.cache.add(self.context, 1, self.image)
+        self.cache.add(self.context, 2, self.image)
+        self.cache.get(self.context, 1)
+        self.cache.add(self.context, 3, self.image)
+
+        self.assertEqual(['1', '3'], self.cache.images.keys())
+
+    def test_disabled(self):
+        self.cache.max_size = 0
+        self.cache.add(self.context, 1, self.image)
+        self.assertEqual(None, self.cache.get(self.context, 1))
+
+    def test_invalidate(self):
+        admin = context.RequestContext(is_admin=True)
+        self.cache.add(self.context, 1, self.image)
+        self.cache.add(admin, 1, self.image)
+        self.cache.invalidate(1)
+
+        self.assertEqual(None, self.cache.get(self.context, 1))
+        self.assertEqual(None, self.cache.get(admin, 1))
+
+
+class TestRegistryMetadataCache(unittest.TestCase):
+
+    def setUp(self):
+        self.stubs = stubout.StubOutForTesting()
+        self.client = FakeRegistryClient({
+            1: {'id': 1, 'name': 'fake', 'status': 'active'},
+            2: {'id': 2, 'name': 'fake', 'status': 'queued'}})
+        self.stubs.Set(registry, 'get_registry_client',
+                       lambda options, cxt: self.client)
+        self.stubs.Set(cache, '_metadata_cache', None)
+        self.options = {'debug': False, 'registry_cache_max_size': 10}
+        self.context = context.RequestContext(tenant='tenant1')
+
+    def tearDown(self):
+        self.stubs.UnsetAll()
+
+    def get_image_metadata(self, image_id):
+        return registry.get_image_metadata(self.options, self.context,
+                                           image_id)
+
+    def test_get_image_metadata_cached(self):
+        self.get_image_metadata(1)
+        self.assertEqual('fake', self.get_image_metadata(1)['name'])
+        self.get_image_metadata(2)
+        self.get_image_metadata(2)
+
+        self.assertEqual([('get_image', 1), ('get_image', 2),
+                          ('get_image', 2)], self.client.calls)
+
+    def test_update_invalidates(self):
+        self.get_image_metadata(1)
+        registry.update_image_metadata(self.options, self.context, 1,
+                                       {'name': 'new'})
+
+        self.assertEqual('new', self.get_image_metadata(1)['name'])
+
+    def test_delete_invalidates(self):
+        self.get_image_metadata(1)
+        registry.delete_image_metadata(self.options, self.context, 1)
+
+        self.assertRaises(KeyError, self.get_image_metadata, 1)
+
+    def test_invalidate_from_notification(self):
+        self.get_image_metadata(1)
+        self.get_image_metadata(1)
+        cache.invalidate_from_notification({'event_type': 'image.update',
+                                            'payload': {'id': 1}})
+        self.get_image_metadata(1)
+        cache.invalidate_from_notification({'event_type': 'image.delete',
+                                            'payload': 1})
+        self.get_image_metadata(1)
+
+        self.assertEqual([('get_image', 1), ('get_image', 1),
+                          ('get_image', 1)], self.client.calls)
+
+    def test_listen_for_notifications(self):
+        listeners = []
+        self.stubs.Set(cache.eventlet, 'spawn_n',
+                       lambda *args: listeners.append(args))
+        self.options['registry_cache_notification_invalidation'] = True
+
+        def fake_consume(strategy, priority, callback):
+            self.assertEqual('INFO', priority)
+            callback(notifier.Notifier.generate_message('image.update',
+                                                        'INFO', {'id': 1}))
+
+        self.stubs.Set(notifier.RabbitStrategy, 'consume', fake_consume)
+
+        self.get_image_metadata(1)
+        self.assertEqual(1, len(listeners))
+        func, options = listeners[0]
+        func(options)
+        self.get_image_metadata(1)
+
+        self.assertEqual([('get_image', 1), ('get_image', 1)],
+                         self.client.calls)
+
+    def test_no_listener_by_default(self):
+        listeners = []
+        self.stubs.Set(cache.eventlet, 'spawn_n',
+                       lambda *args: listeners.append(args))
+        self.get_image_metadata(1)
+
+        self.assertEqual([], listeners)
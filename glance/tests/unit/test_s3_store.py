@@ -87,6 +87,14 @@ def stub_out_s3(stubs):
         def get_file(self):
             return self.data
 
+        def open_read(self, headers=None, **kwargs):
+            # Ranged GET... subsequent reads only return the bytes of the
+            # range
+            start, end = headers['Range'][6:].split('-')
+            data = self.data.getvalue()
+            data = data[int(start):end and int(end) + 1 or None]
+            self.read = StringIO.StringIO(data).read
+
     class FakeBucket:
         """
         Acts like a ``boto.s3.bucket.Bucket``
@@ -119,6 +127,8 @@ def stub_out_s3(stubs):
     b = fixture_buckets['glance']
     k = b.new_key('2')
     k.set_contents_from_file(StringIO.StringIO("*" * FIVE_KB))
+    k = b.new_key('3')
+    k.set_contents_from_file(StringIO.StringIO("0123456789"))
 
     def fake_connection_constructor(self, *args, **kwargs):
         host = kwargs.get('host')
@@ -178,6 +188,13 @@ class TestStore(unittest.TestCase):
             data += chunk
         self.assertEqual(expected_data, data)
 
+    def test_get_range(self):
+        """Test retrieval of a byte range of an image"""
+        loc = get_location_from_uri(
+            "s3://user:key@auth_address/glance/3")
+        self.assertEqual("234", "".join(self.store.get(loc, 2, 3)))
+        self.assertEqual("23456789", "".join(self.store.get(loc, 2)))
+
     def test_get_non_existing(self):
         """
         Test that trying to retrieve a s3 that doesn't exist
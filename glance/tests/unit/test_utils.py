@@ -15,8 +15,12 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import StringIO
+import threading
 import unittest
 
+import stubout
+
 from glance import utils
 
 
@@ -106,3 +110,46 @@ class TestUtils(unittest.TestCase):
             result = utils.get_image_meta_from_headers(response)
             for k, v in expected.items():
                 self.assertEqual(v, result[k])
+
+    def test_execute_io(self):
+        def current_thread():
+            return threading.currentThread()
+
+        old_io_threads = utils._io_threads
+        try:
+            utils.set_io_threads(0)
+            self.assertEqual(threading.currentThread(),
+                             utils.execute_io(current_thread))
+
+            utils.set_io_threads(2)
+            self.assertNotEqual(threading.currentThread(),
+                                utils.execute_io(current_thread))
+        finally:
+            utils.set_io_threads(old_io_threads)
+
+    def test_set_io_threads(self):
+        sizes = []
+        warnings = []
+        stubs = stubout.StubOutForTesting()
+        stubs.Set(utils.tpool, 'set_num_threads', sizes.append)
+        stubs.Set(utils.logger, 'warn', lambda *args: warnings.append(args))
+        stubs.Set(utils, '_io_threads', 0)
+        stubs.Set(utils, '_io_pool_started', False)
+        try:
+            utils.set_io_threads(4)
+            self.assertEqual([4], sizes)
+            self.assertEqual([], warnings)
+
+            utils._io_pool_started = True
+            utils.set_io_threads(8)
+            self.assertEqual([4], sizes)
+            self.assertEqual(1, len(warnings))
+        finally:
+            stubs.UnsetAll()
+
+    def test_file_wrapper(self):
+        fp = StringIO.StringIO("0123456789")
+        fp.seek(2)
+        wrapper = utils.FileWrapper(fp, length=5)
+        self.assertEqual("23456", ''.join(wrapper))
+        self.assertEqual(None, wrapper.fp)
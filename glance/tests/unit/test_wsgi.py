@@ -15,11 +15,25 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import errno
+import httplib
+import logging
+import os
+import signal
+import socket
+import StringIO
+import tempfile
 import unittest
+
+import eventlet
+import eventlet.hubs
+import eventlet.wsgi
+import stubout
 import webob
 
 from glance.common import wsgi
 from glance.common import exception
+from glance import utils
 
 
 class RequestTest(unittest.TestCase):
@@ -182,3 +196,214 @@ class JSONRequestDeserializerTest(unittest.TestCase):
         actual = wsgi.JSONRequestDeserializer().default(request)
         expected = {"body": {"key": "value"}}
         self.assertEqual(actual, expected)
+
+
+class SendfileApplicationTest(unittest.TestCase):
+    def setUp(self):
+        self.stubs = stubout.StubOutForTesting()
+
+        def fake_sendfile(out_fd, in_fd, offset, count):
+            os.lseek(in_fd, offset, os.SEEK_SET)
+            return os.write(out_fd, os.read(in_fd, count))
+
+        self.stubs.Set(wsgi, 'sendfile', fake_sendfile)
+
+        self.client_sock, self.server_sock = socket.socketpair()
+
+        class FakeInput(object):
+            def get_socket(input):
+                return self.server_sock
+
+        self.environ = {'REQUEST_METHOD': 'GET',
+                        'wsgi.url_scheme': 'http',
+                        'eventlet.input': FakeInput()}
+
+        self.image_file = tempfile.TemporaryFile()
+        self.image_file.write("chunk00000remainder")
+        self.image_file.flush()
+
+    def tearDown(self):
+        self.stubs.UnsetAll()
+        self.client_sock.close()
+        self.server_sock.close()
+        self.image_file.close()
+
+    def _call(self, body):
+        started = []
+        self.headers = None
+        self.written = []
+
+        def app(environ, start_response):
+            start_response('200 OK', [('Content-Type', 'text/plain'),
+                                      ('Content-Length', '19')])
+            return body
+
+        def start_response(status, headers, exc_info=None):
+            started.append(status)
+            self.headers = headers
+            return self.written.append
+
+        result = wsgi.SendfileApplication(app)(self.environ, start_response)
+        return started, result
+
+    def test_sendfile_file_wrapper(self):
+        self.image_file.seek(5)
+        started, result = self._call(
+            utils.FileWrapper(self.image_file, length=5))
+
+        # NOTE: The server sends the status line and headers once the
+        # empty string is written
+        self.assertEqual(['200 OK'], started)
+        self.assertEqual([('Content-Type', 'text/plain'),
+                          ('Content-Length', '5')], self.headers)
+        self.assertEqual([''], self.written)
+        self.assertEqual([], result)
+        self.server_sock.close()
+
+        self.assertEqual('00000', self.client_sock.makefile().read())
+
+    def test_sendfile_file_truncated(self):
+        body = utils.FileWrapper(self.image_file, length=25)
+        self.assertRaises(IOError, self._call, body)
+
+    def test_sendfile_keep_alive(self):
+        def app(environ, start_response):
+            start_response('200 OK', [('Content-Type', 'text/plain')])
+            image_file = os.fdopen(os.dup(self.image_file.fileno()), 'rb')
+            image_file.seek(5)
+            return utils.FileWrapper(image_file, length=5)
+
+        log = StringIO.StringIO()
+        sock = eventlet.listen(('127.0.0.1', 0))
+        server = eventlet.spawn(eventlet.wsgi.server, sock,
+                                wsgi.SendfileApplication(app), log=log)
+        try:
+            conn = httplib.HTTPConnection('127.0.0.1', sock.getsockname()[1])
+            for i in range(2):
+                conn.request('GET', '/')
+                response = conn.getresponse()
+                self.assertEqual('00000', response.read())
+                self.assertFalse(response.will_close)
+            conn.close()
+        finally:
+            server.kill()
+            sock.close()
+
+        self.assertEqual(2, log.getvalue().count('"GET / HTTP/1.1" 200'))
+
+    def test_sendfile_partial_and_would_block(self):
+        calls = []
+        trampolines = []
+
+        def fake_sendfile(out_fd, in_fd, offset, count):
+            calls.append((offset, count))
+            if len(calls) == 2:
+                raise OSError(errno.EAGAIN, "Resource temporarily unavailable")
+            os.lseek(in_fd, offset, os.SEEK_SET)
+            return os.write(out_fd, os.read(in_fd, min(count, 3)))
+
+        self.stubs.Set(wsgi, 'sendfile', fake_sendfile)
+        self.stubs.Set(eventlet.hubs, 'trampoline',
+                       lambda fd, write: trampolines.append(fd))
+        wsgi.SendfileApplication._sendfile(self.environ,
+                                           self.image_file.fileno(), 5, 7)
+        self.server_sock.close()
+
+        self.assertEqual('00000re', self.client_sock.makefile().read())
+        self.assertEqual([(5, 7), (8, 4), (8, 4), (11, 1)], calls)
+        self.assertEqual(1, len(trampolines))
+
+    def test_passthrough_not_file_backed(self):
+        body = utils.FileWrapper(StringIO.StringIO("chunk00000remainder"))
+        started, result = self._call(body)
+
+        self.assertEqual(['200 OK'], started)
+        self.assertEqual(body, result)
+
+    def test_passthrough_without_sendfile(self):
+        self.stubs.Set(wsgi, 'sendfile', None)
+        body = utils.FileWrapper(self.image_file)
+        started, result = self._call(body)
+
+        self.assertEqual(['200 OK'], started)
+        self.assertEqual(body, result)
+
+    def test_passthrough_https(self):
+        self.environ['wsgi.url_scheme'] = 'https'
+        body = utils.FileWrapper(self.image_file)
+        started, result = self._call(body)
+
+        self.assertEqual(['200 OK'], started)
+        self.assertEqual(body, result)
+
+
+class ServerWorkersTest(unittest.TestCase):
+
+    def setUp(self):
+        self.stubs = stubout.StubOutForTesting()
+        self.forked = []
+        self.killed = []
+        self.exits = []
+
+        def fake_fork():
+            pid = 100 + len(self.forked)
+            self.forked.append(pid)
+            return pid
+
+        def fake_wait():
+            if not self.exits:
+                raise OSError(errno.ECHILD, "No child processes")
+            exit = self.exits.pop(0)
+            if isinstance(exit, Exception):
+                raise exit
+            return exit
+
+        def fake_kill(pid, signum):
+            self.killed.append((pid, signum))
+
+        self.stubs.Set(os, 'fork', fake_fork)
+        self.stubs.Set(os, 'wait', fake_wait)
+        self.stubs.Set(os, 'kill', fake_kill)
+        self.stubs.Set(signal, 'signal', lambda signum, handler: None)
+        self.stubs.Set(eventlet, 'listen', lambda *args, **kwargs: None)
+
+        self.server = wsgi.Server()
+
+    def tearDown(self):
+        self.stubs.UnsetAll()
+
+    def test_start_forks_workers(self):
+        self.server.start(None, 9292, workers=3)
+
+        self.assertEqual([100, 101, 102], self.forked)
+        self.assertEqual(set([100, 101, 102]), self.server.children)
+
+    def test_start_warns_without_sendfile(self):
+        warnings = []
+        logger = logging.getLogger('glance.common.wsgi')
+        self.stubs.Set(logger, 'warn', warnings.append)
+        self.stubs.Set(wsgi, 'sendfile', None)
+        self.server.start(None, 9292, workers=1)
+
+        self.assertEqual(1, len(warnings))
+
+    def test_wait_respawns_dead_workers(self):
+        self.server.start(None, 9292, workers=2)
+        self.exits = [(100, 256),
+                      OSError(errno.EINTR, "Interrupted system call")]
+        self.server.wait()
+
+        self.assertEqual([100, 101, 102], self.forked)
+        self.assertEqual(set([101, 102]), self.server.children)
+        self.assertEqual([], self.killed)
+
+    def test_signal_stops_respawning(self):
+        self.server.start(None, 9292, workers=2)
+        self.server._handle_signal(signal.SIGHUP, None)
+        self.exits = [(100, 0), (101, 0)]
+        self.server.wait()
+
+        self.assertEqual([100, 101], self.forked)
+        self.assertEqual(set(), self.server.children)
+        self.assertEqual([(100, signal.SIGHUP), (101, signal.SIGHUP)],
+                         sorted(self.killed))
@@ -21,10 +21,55 @@ A few utility routines used throughout Glance
 import errno
 import logging
 
+from eventlet import tpool
 import xattr
 
 logger = logging.getLogger('glance.utils')
 
+# Number of OS threads that blocking file I/O on image data is handed off to
+# by `execute_io`, 0 to do the I/O in the calling green thread
+_io_threads = 0
+
+# Whether I/O was handed off to the thread pool yet, which fixes its size
+_io_pool_started = False
+
+
+def set_io_threads(threads):
+    """
+    Sets the number of OS threads that blocking file I/O on image data is
+    handed off to. The size of the thread pool can't change once I/O was
+    handed off to it.
+    """
+    global _io_threads
+    if threads and threads != _io_threads:
+        if _io_pool_started:
+            logger.warn(_("I/O thread pool already started, not resizing "
+                          "it to %d threads"), threads)
+        elif hasattr(tpool, 'set_num_threads'):
+            tpool.set_num_threads(threads)
+        else:
+            # NOTE: Older eventlet releases only read the size of the pool
+            # from the environment when tpool is imported
+            logger.warn(_("eventlet can't resize its thread pool, set "
+                          "EVENTLET_THREADPOOL_SIZE=%d in the environment "
+                          "instead"), threads)
+    _io_threads = threads
+
+
+def execute_io(func, *args):
+    """
+    Calls `func`, which does blocking file I/O on image data, in the I/O
+    thread pool. A slow disk then only holds up the request reading or
+    writing the image, rather than every green thread of the process.
+
+    Only real files may be handed off, never green sockets.
+    """
+    global _io_pool_started
+    if _io_threads:
+        _io_pool_started = True
+        return tpool.execute(func, *args)
+    return func(*args)
+
 
 def image_meta_to_http_headers(image_meta):
     """
@@ -107,20 +152,69 @@ def has_body(req):
     return req.content_length or 'transfer-encoding' in req.headers
 
 
-def chunkiter(fp, chunk_size=65536):
+def chunkiter(fp, chunk_size=65536, length=None):
     """Return an iterator to a file-like obj which yields fixed size chunks
 
     :param fp: a file-like object
     :param chunk_size: maximum size of chunk
+    :param length: maximum number of bytes to read, or None to read until
+                   the end of the file
     """
-    while True:
-        chunk = fp.read(chunk_size)
+    while length is None or length > 0:
+        if length is None:
+            chunk = fp.read(chunk_size)
+        else:
+            chunk = fp.read(min(chunk_size, length))
+            length -= len(chunk)
         if chunk:
             yield chunk
         else:
             break
 
 
+class FileWrapper(object):
+    """Iterable over the contents of a file, akin to `wsgi.file_wrapper`
+
+    Yields up to `length` bytes from the current position of `fp`. When
+    `fp` is backed by a real file descriptor, glance.common.wsgi.Server
+    sends those bytes to the client with sendfile(2) instead of iterating.
+    """
+
+    CHUNKSIZE = 65536
+
+    def __init__(self, fp, length=None):
+        """
+        :param fp: a file-like object, positioned at the first byte to send
+        :param length: number of bytes to send, or None to send the
+                       remainder of the file
+        """
+        self.fp = fp
+        self.length = length
+
+    def fileno(self):
+        return self.fp.fileno()
+
+    def tell(self):
+        return self.fp.tell()
+
+    def read(self, size):
+        return execute_io(self.fp.read, size)
+
+    def __iter__(self):
+        """Return an iterator over the file"""
+        try:
+            for chunk in chunkiter(self, self.CHUNKSIZE, self.length):
+                yield chunk
+        finally:
+            self.close()
+
+    def close(self):
+        """Close the internal file pointer"""
+        if self.fp:
+            self.fp.close()
+            self.fp = None
+
+
 class PrettyTable(object):
     """Creates an ASCII art table for use in bin/glance
 
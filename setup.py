@@ -122,6 +122,7 @@ setup(
              'bin/glance-cache-prefetcher',
              'bin/glance-cache-pruner',
              'bin/glance-cache-reaper',
+             'bin/glance-cache-verifier',
              'bin/glance-control',
              'bin/glance-manage',
              'bin/glance-registry',
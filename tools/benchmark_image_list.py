@@ -0,0 +1,208 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2011 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Measures the latency of the registry's image listings against a database
+of many images, with and without the listing indexes.
+
+The database is filled with synthetic images the first time it is used::
+
+    $ python tools/benchmark_image_list.py --images 1000000 \\
+          --sql-connection sqlite:////tmp/glance-benchmark.sqlite
+
+Use --drop-indexes to measure the listings without the indexes of the
+009_add_listing_indexes and 010_add_property_value_hash migrations, and
+--create-indexes to put them back.
+"""
+
+import datetime
+import gettext
+import optparse
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, ROOT)
+
+gettext.install('glance', unicode=1)
+
+from glance.registry import context
+from glance.registry.db import api as db_api
+from glance.registry.db import models
+
+BATCH_SIZE = 10000
+
+# Listings to measure, as tuples of (description, admin, kwargs)
+LISTINGS = [
+    ("public images", False, {'filters': {'is_public': True}}),
+    ("admin, all images", True, {'filters': {'is_public': None}}),
+    ("by status", False, {'filters': {'is_public': True,
+                                      'status': 'saving'}}),
+    ("by disk_format", False, {'filters': {'is_public': True,
+                                           'disk_format': 'iso'}}),
+    ("by name", False, {'filters': {'is_public': True,
+                                    'name': 'image-4242'}}),
+    ("by property", False, {'filters': {'is_public': True,
+                                        'properties': {'distro': 'fedora'}}}),
+    ("by 2 properties", False, {'filters': {'is_public': True,
+                                            'properties': {'distro': 'fedora',
+                                                           'arch': 'i386'}}}),
+    ("by rare property", False, {'filters': {'is_public': True,
+                                             'properties': {
+                                                 'build': 'build-4242'}}}),
+    ("by 3 properties", False, {'filters': {'is_public': True,
+                                            'properties': {
+                                                'distro': 'fedora',
+                                                'arch': 'i386',
+                                                'build': 'build-4242'}}}),
+    ("sorted by size", False, {'filters': {'is_public': True},
+                               'sort_key': 'size', 'sort_dir': 'asc'}),
+    ("sorted by name", False, {'filters': {'is_public': True},
+                               'sort_key': 'name', 'sort_dir': 'asc'}),
+]
+
+
+def populate(engine, count):
+    """Fills the database with `count` synthetic images"""
+    images = models.Image.__table__
+    properties = models.ImageProperty.__table__
+    members = models.ImageMember.__table__
+    now = datetime.datetime.utcnow()
+
+    for start in xrange(0, count, BATCH_SIZE):
+        image_rows = []
+        property_rows = []
+        member_rows = []
+        for id in xrange(start + 1, min(start + BATCH_SIZE, count) + 1):
+            created_at = now - datetime.timedelta(seconds=count - id)
+            image_rows.append({
+                'id': id,
+                'name': 'image-%d' % id,
+                'disk_format': random.choice(('ami', 'vhd', 'raw', 'qcow2',
+                                              'iso')),
+                'container_format': random.choice(('ami', 'bare', 'ovf')),
+                'size': random.randint(1, 40) * 1024 * 1024 * 1024,
+                'status': random.choice(['active'] * 97 +
+                                        ['saving', 'queued', 'killed']),
+                'is_public': random.random() < 0.1,
+                'location': 'file:///var/lib/glance/images/%d' % id,
+                'checksum': None,
+                'owner': 'tenant-%d' % random.randint(1, 1000),
+                'created_at': created_at,
+                'updated_at': created_at,
+                'deleted_at': None,
+                'deleted': random.random() < 0.05})
+            for name, value in (('distro', random.choice(('ubuntu',
+                                                          'fedora',
+                                                          'debian'))),
+                                ('arch', random.choice(('x86_64', 'i386'))),
+                                ('build', 'build-%d' %
+                                          random.randint(1, 10000))):
+                property_rows.append({'image_id': id, 'name': name,
+                                      'value': value,
+                                      'value_hash':
+                                          models.hash_property_value(value),
+                                      'created_at': created_at,
+                                      'deleted': False})
+            if random.random() < 0.01:
+                member_rows.append({'image_id': id,
+                                    'member': 'tenant-%d' %
+                                              random.randint(1, 1000),
+                                    'can_share': False,
+                                    'created_at': created_at,
+                                    'deleted': False})
+
+        engine.execute(images.insert(), image_rows)
+        engine.execute(properties.insert(), property_rows)
+        if member_rows:
+            engine.execute(members.insert(), member_rows)
+        print "\r%d/%d images" % (start + len(image_rows), count),
+        sys.stdout.flush()
+    print
+
+
+def get_listing_indexes():
+    indexes = []
+    for model in (models.Image, models.ImageProperty, models.ImageMember):
+        indexes.extend(index for index in model.__table__.indexes
+                       if index.name.startswith(('ix_images_deleted_',
+                                                 'ix_image_properties_',
+                                                 'ix_image_members_member_')))
+    return indexes
+
+
+def measure(admin, kwargs, repeat):
+    """Returns the median latency in milliseconds of a listing"""
+    cxt = context.RequestContext(is_admin=admin, tenant='tenant-42')
+    latencies = []
+    for i in xrange(repeat):
+        params = dict(kwargs, filters=dict(kwargs['filters']))
+        start = time.time()
+        db_api.image_get_all(cxt, limit=25, **params)
+        latencies.append((time.time() - start) * 1000)
+    latencies.sort()
+    return latencies[len(latencies) / 2]
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('--sql-connection',
+                      default='sqlite:////tmp/glance-benchmark.sqlite',
+                      help="Database to run the listings against "
+                           "[default: %default]")
+    parser.add_option('--images', type='int', default=1000000,
+                      help="Number of images to fill an empty database "
+                           "with [default: %default]")
+    parser.add_option('--repeat', type='int', default=5,
+                      help="Number of times to run each listing "
+                           "[default: %default]")
+    parser.add_option('--drop-indexes', action='store_true',
+                      help="Drop the listing indexes before measuring")
+    parser.add_option('--create-indexes', action='store_true',
+                      help="Create the listing indexes before measuring")
+    options, args = parser.parse_args()
+
+    db_api.configure_db({'sql_connection': options.sql_connection})
+    engine = db_api._ENGINE
+    if not engine.execute(models.Image.__table__.count()).scalar():
+        populate(engine, options.images)
+
+    for index in get_listing_indexes():
+        try:
+            if options.drop_indexes:
+                index.drop(engine)
+            elif options.create_indexes:
+                index.create(engine)
+        except Exception:
+            # NOTE: The index is already missing or in place
+            pass
+
+    for table in (models.Image.__table__,
+                  models.ImageProperty.__table__,
+                  models.ImageMember.__table__):
+        engine.execute("ANALYZE %s" % table.name)
+
+    print "%-24s %12s" % ("listing", "median ms")
+    for description, admin, kwargs in LISTINGS:
+        print "%-24s %12.1f" % (description,
+                                measure(admin, kwargs, options.repeat))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2011 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Replays a log of image downloads against the Image Cache admission policies
+and reports the hit ratio of each of them.
+
+The log has one download per line, made up of the image id and the image
+size in bytes separated by whitespace::
+
+    $ python tools/simulate_image_cache.py --max-size 10737418240 access.log
+
+Use --generate to write a synthetic log of popular base images mixed with
+one-off downloads of large images instead.
+"""
+
+import collections
+import gettext
+import optparse
+import os
+import random
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, ROOT)
+
+gettext.install('glance', unicode=1)
+
+from glance.image_cache import ImageCache
+
+GB = 1024 * 1024 * 1024
+
+
+def read_log(path):
+    with open(path) as log:
+        for line in log:
+            fields = line.split()
+            if len(fields) >= 2:
+                yield fields[0], int(fields[1])
+
+
+def generate_log(path, downloads):
+    """
+    Writes a log where 90% of the downloads go to 50 base images of
+    1-4 GB with a skewed popularity, and the rest are one-off downloads of
+    20-40 GB images.
+    """
+    base_images = [(str(i), random.randint(1, 4) * GB) for i in xrange(50)]
+    with open(path, 'w') as log:
+        for i in xrange(downloads):
+            if random.random() < 0.9:
+                index = min(int(random.paretovariate(1.2)) - 1, 49)
+                image_id, size = base_images[index]
+            else:
+                image_id = 'oneoff-%d' % i
+                size = random.randint(20, 40) * GB
+            log.write("%s %d\n" % (image_id, size))
+
+
+def simulate(policy_class, downloads, max_size):
+    """Returns a tuple of (hits, bytes_hit) for a policy"""
+    policy = policy_class({})
+    cached = collections.OrderedDict()  # image_id -> size, LRU first
+    cur_size = 0
+    hits = 0
+    bytes_hit = 0
+
+    for image_id, size in downloads:
+        policy.record_access(image_id)
+        if image_id in cached:
+            cached[image_id] = cached.pop(image_id)
+            hits += 1
+            bytes_hit += size
+            continue
+
+        if size > max_size:
+            continue
+
+        # Pick every image to evict first and only evict them once the
+        # image was admitted in favour of each, just like
+        # ImageCache.reserve()
+        victims = []
+        excess = cur_size + size - max_size
+        for victim in cached.iteritems():
+            if excess <= 0:
+                break
+            victims.append(victim)
+            excess -= victim[1]
+        if not all(policy.admit((image_id, size), victim)
+                   for victim in victims):
+            continue
+
+        for victim_id, victim_size in victims:
+            del cached[victim_id]
+            cur_size -= victim_size
+        cached[image_id] = size
+        cur_size += size
+
+    return hits, bytes_hit
+
+
+def main():
+    parser = optparse.OptionParser(usage="%prog [options] LOG")
+    parser.add_option('--max-size', type='int', default=40 * GB,
+                      help="Maximum size of the cache in bytes "
+                           "[default: %default]")
+    parser.add_option('--generate', type='int', metavar='DOWNLOADS',
+                      help="Write a synthetic log of DOWNLOADS downloads "
+                           "to LOG instead of replaying it")
+    options, args = parser.parse_args()
+    if len(args) != 1:
+        parser.error("LOG is required")
+
+    if options.generate:
+        generate_log(args[0], options.generate)
+        return
+
+    downloads = list(read_log(args[0]))
+    total_bytes = sum(size for image_id, size in downloads) or 1
+    print "%-16s %10s %16s" % ("policy", "hit ratio", "byte hit ratio")
+    for name, policy_class in sorted(ImageCache.POLICIES.items()):
+        hits, bytes_hit = simulate(policy_class, downloads, options.max_size)
+        print "%-16s %10.3f %16.3f" % (name,
+                                       float(hits) / (len(downloads) or 1),
+                                       float(bytes_hit) / total_bytes)
+
+
+if __name__ == '__main__':
+    main()